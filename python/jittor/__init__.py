@@ -240,6 +240,66 @@ class profile_scope(_call_no_record_scope):
         self.report.extend(profiler.report())
         self.fs.__exit__(*exc)
 
+_kernel_recorder = None
+
+class record_kernels(_call_no_record_scope):
+    ''' Record jit kernels compiled by this process into a manifest file,
+    kernels of the manifest can be compiled ahead of time by
+    ``python -m jittor.precompile manifest.json``.
+
+    Recording starts when it is called, and stops at the end of the
+    scope, or when ``stop`` is called, or at exit. Kernels compiled
+    before recording are not recorded, so call it before running the
+    model.
+
+    Args:
+        path (str): path of the manifest file.
+
+    Example::
+
+        jt.record_kernels("manifest.json")
+        train()
+
+        # or
+        with jt.record_kernels("manifest.json"):
+            train()
+    '''
+    def __init__(self, path):
+        global _kernel_recorder
+        assert _kernel_recorder is None, "jt.record_kernels is already recording."
+        _kernel_recorder = self
+        self.path = path
+        start_record_kernels()
+        atexit.register(self.stop)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def stop(self):
+        ''' Stop recording and save the manifest. '''
+        global _kernel_recorder
+        if _kernel_recorder is not self:
+            return
+        _kernel_recorder = None
+        atexit.unregister(self.stop)
+        kernels = [ {
+            "jit_key": key,
+            "src": src,
+            "is_cuda": is_cuda == "1",
+            "extra_flags": extra_flags,
+        } for key, src, is_cuda, extra_flags in stop_record_kernels() ]
+        manifest = {"version": __version__, "kernels": kernels}
+        dirname = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(dirname, exist_ok=True)
+        import json
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(manifest, f)
+        os.replace(self.path + ".tmp", self.path)
+        LOG.i(f"{len(kernels)} kernels are recorded: {self.path}")
+
 
 class profile_mark(_call_no_record_scope):
     def __init__(self, mark_name: str):
@@ -386,6 +446,22 @@ def array(data, dtype=None):
                     return ret.float16()
     return ret
 
+# random Vars recorded by a checkpointed segment, and replayed when it
+# is recomputed, see jt.checkpoint
+_checkpoint_randoms = None
+_checkpoint_replay = None
+
+def _checkpoint_random(shape, dtype, type):
+    if _checkpoint_replay is not None:
+        ret = next(_checkpoint_replay, None)
+        assert ret is not None and list(ret.shape) == list(shape) and ret.dtype == dtype, \
+            "Random ops of a checkpointed segment changed when it is recomputed."
+        return ret
+    ret = ops.random(shape, dtype, type)
+    if _checkpoint_randoms is not None:
+        _checkpoint_randoms.append(ret)
+    return ret
+
 def random(shape, dtype="float32", type="uniform"):
     ''' Constructs a random jittor Var.
 
@@ -407,9 +483,9 @@ def random(shape, dtype="float32", type="uniform"):
     # TODO: move those code to core
     if dtype == "float16":
         # TODO: make curand support fp16
-        ret = ops.random(shape, "float32", type).float16()
+        ret = _checkpoint_random(shape, "float32", type).float16()
     else:
-        ret = ops.random(shape, dtype, type)
+        ret = _checkpoint_random(shape, dtype, type)
     amp_reg = jt.flags.amp_reg
     if amp_reg:
         if amp_reg & 16:
@@ -1060,9 +1136,15 @@ def display_memory_info():
     core.display_memory_info(fileline)
 
 def load(path: str):
-    ''' loads an object from a file.
+    ''' loads an object from a file, tensor container files saved by
+    jt.save_tensors are loaded lazily by jt.load_tensors.
     '''
+    from .ckpt import is_tensor_file, load_tensors, resolve_blobs
+    if is_tensor_file(path):
+        return load_tensors(path)
     model_dict = safeunpickle(path)
+    if not path.endswith(".pth"):
+        model_dict = resolve_blobs(model_dict, path)
     return model_dict
 
 def save(params_dict, path: str):
@@ -1096,6 +1178,7 @@ def _uniq(x):
     return b
 
 class Module:
+    _checkpoint = False
     def __init__(self, *args, **kw):
         pass
     def execute(self, *args, **kw):
@@ -1106,6 +1189,11 @@ class Module:
         raise NotImplementedError("Please implement 'execute' method of "+str(type(self)))
 
     def __call__(self, *args, **kw):
+        if self._checkpoint:
+            if kw:
+                return checkpoint(lambda *a: self.execute(*a, **kw), *args,
+                    params=self.parameters())
+            return checkpoint(self, *args)
         return self.execute(*args, **kw)
     def __repr__(self):
         return self.__str__()
@@ -1525,11 +1613,14 @@ Arguments of hook are defined as::
         if n_failed:
             LOG.w(f"load total {len(params)} params, {n_failed} failed")
 
-    def save(self, path: str):
+    def save(self, path: str, writer=None):
         ''' saves parameters to a file.
 
         :param path: path to save.
         :type path: str
+        :param writer: if set, parameters are written in background by
+            this jt.CheckpointWriter, only changed parameters are written.
+        :type writer: CheckpointWriter
 
         Example::
 
@@ -1540,6 +1631,9 @@ Arguments of hook are defined as::
             >>> net.load('net.pkl')
         '''
         params = self.state_dict()
+        if writer is not None:
+            writer.save(params, path)
+            return
         params_dict = {}
         for k, v in params.items():
             if isinstance(v, Var):
@@ -1578,8 +1672,25 @@ Arguments of hook are defined as::
             
             >>> [w 0205 21:49:39.962906 96 __init__.py:741] load total 100 params, 3 failed
         '''
+        if path.endswith(".pth") and os.path.isfile(path):
+            # stream tensors of pytorch file into parameters
+            from jittor_utils.load_pytorch import load_pytorch
+            load_pytorch(path, module=self)
+            return
         self.load_parameters(load(path))
 
+    def checkpoint(self, enable=True):
+        ''' Recomputes intermediates of this module in backward instead of
+        keeping them, see jt.checkpoint.
+
+        Example::
+
+            net.block.checkpoint()
+            loss = net(x)
+        '''
+        self._checkpoint = enable
+        return self
+
     def eval(self):
         ''' Sets the module in evaluation mode. '''
         def callback(parents, k, v, n):
@@ -1806,6 +1917,95 @@ the gradient of this variable will be alter,
 
 Var.register_hook = register_hook
 
+class _CheckpointFunction(Function):
+    def __init__(self, func, n_args, params):
+        self.func = func
+        self.n_args = n_args
+        # grads of params are computed for their taped inputs
+        self.params = params
+
+    def execute(self, *args):
+        # args are inputs of func and then its parameters, only
+        # detached inputs are kept, intermediates are not
+        # recorded for backward
+        self.inputs = [ a.detach() if isinstance(a, Var) else a
+            for a in args[:self.n_args] ]
+        global _checkpoint_randoms
+        # random Vars are kept, so the recompute uses the same ones
+        randoms_bk, _checkpoint_randoms = _checkpoint_randoms, []
+        try:
+            with no_grad():
+                outputs = self.func(*self.inputs)
+        finally:
+            self.randoms, _checkpoint_randoms = _checkpoint_randoms, randoms_bk
+        for o in (outputs if isinstance(outputs, Sequence) else [outputs]):
+            if isinstance(o, Var) and o.dtype.is_float():
+                o.start_grad()
+        return outputs
+
+    def grad(self, *grads):
+        need_grad = [ self.input_mask[i] >= 0 for i in range(len(self.input_mask)) ]
+        global _checkpoint_replay
+        replay_bk, _checkpoint_replay = _checkpoint_replay, iter(self.randoms)
+        try:
+            with enable_grad():
+                inputs = [ a.detach().start_grad() if need_grad[i] else a
+                    for i, a in enumerate(self.inputs) ]
+                outputs = self.func(*inputs)
+        finally:
+            _checkpoint_replay = replay_bk
+        self.randoms = []
+        if not isinstance(outputs, Sequence):
+            outputs = [outputs]
+        loss = [ (o * g.detach()).sum() for o, g in zip(outputs, grads)
+            if g is not None and isinstance(o, Var) ]
+        targets = [ v for i, v in enumerate(inputs + list(self.params)) if need_grad[i] ]
+        if len(loss) == 0 or len(targets) == 0:
+            return [None] * len(need_grad)
+        loss = loss[0] if len(loss) == 1 else sum(loss)
+        target_grads = iter(grad(loss, targets, retain_graph=False))
+        return [ next(target_grads) if need else None for need in need_grad ]
+
+def checkpoint(func, *args, params=None):
+    ''' Runs func(*args) without keeping its intermediates for backward,
+    they are recomputed by running func again in jt.grad. This trades
+    compute for peak memory of training.
+
+    Args:
+        func (Module or function): the checkpointed segment, if it is a
+            Module, its parameters are optimized as usual.
+        args: inputs of func.
+        params (list): Vars used by a function other than its inputs,
+            default is the parameters of Module func.
+
+    Random Vars of func, such as masks of dropout, are kept from the
+    forward pass and reused when func is recomputed, so func must
+    create the same random Vars in both runs.
+
+    Example::
+
+        class Net(nn.Module):
+            def __init__(self):
+                self.block1 = Block()
+                self.block2 = Block()
+            def execute(self, x):
+                x = jt.checkpoint(self.block1, x)
+                return self.block2(x)
+
+        # or checkpoint every call of a module
+        net.block2.checkpoint()
+        # or checkpoint every 2 layers of a Sequential
+        seq.checkpoint(every=2)
+    '''
+    if isinstance(func, Module):
+        if params is None:
+            params = func.parameters()
+        func = func.execute
+    if flags.no_grad:
+        return func(*args)
+    params = params or []
+    return _CheckpointFunction(func, len(args), params)(*args, *params)
+
 def make_module(func, exec_n_args=1):
     class MakeModule(Module):
         def __init__(self, *args, **kw):
@@ -1947,6 +2147,7 @@ from . import sparse
 from . import optim
 from . import dataset
 from . import init
+from .ckpt import CheckpointWriter, save_tensors, load_tensors
 
 import jittor_utils
 
@@ -0,0 +1,275 @@
+# ***************************************************************
+# Copyright (c) 2022 Jittor. All Rights Reserved.
+# Maintainers: Dun Liang <randonlang@gmail.com>.
+# This file is subject to the terms and conditions defined in
+# file 'LICENSE.txt', which is part of this source code package.
+# ***************************************************************
+import os
+import zlib
+import mmap
+import hashlib
+import threading
+from collections.abc import Mapping
+import numpy as np
+import jittor as jt
+
+class _BlobRef:
+    ''' Reference of a tensor stored in blob directory of a checkpoint. '''
+    def __init__(self, name):
+        self.name = name
+
+def _sha1(x):
+    return hashlib.sha1(memoryview(x).cast("B")).hexdigest()
+
+def _snapshot(x):
+    ''' Copy Vars and arrays of a nested dict or list to numpy. '''
+    if isinstance(x, (list, tuple)):
+        return type(x)(_snapshot(v) for v in x)
+    if isinstance(x, dict):
+        return type(x)((k, _snapshot(v)) for k, v in x.items())
+    if isinstance(x, jt.Var):
+        return x.numpy()
+    if isinstance(x, np.ndarray):
+        return x.copy()
+    return x
+
+def resolve_blobs(x, path):
+    ''' Replace blob references of a loaded checkpoint by arrays, blobs
+    are verified by their sha1 names. '''
+    if isinstance(x, list):
+        for i in range(len(x)):
+            x[i] = resolve_blobs(x[i], path)
+    elif isinstance(x, tuple):
+        return type(x)(resolve_blobs(v, path) for v in x)
+    elif isinstance(x, dict):
+        for k in x:
+            x[k] = resolve_blobs(x[k], path)
+    elif isinstance(x, _BlobRef):
+        fname = os.path.join(os.path.dirname(path), x.name)
+        a = np.load(fname)
+        if _sha1(np.ascontiguousarray(a)) != os.path.basename(x.name)[:-4]:
+            raise ValueError("Blob checksum does not match! path: "+fname,
+            " This file maybe corrupted.")
+        return a
+    return x
+
+class CheckpointWriter:
+    ''' Writes checkpoints in a background thread while training continues.
+
+    save() copies Vars of the object to host memory and returns, pickling,
+    hashing and writing are done by the writer thread. Arrays larger than
+    min_blob_bytes are stored in blob_dir as .npy files named by sha1 of
+    their content, so only tensors changed since previous checkpoints are
+    written, unchanged tensors refer to existing blobs. Checkpoints are
+    loaded by jt.load or Module.load.
+
+    Args:
+        blob_dir (str): directory of blobs, relative to directory of the
+            checkpoint, default ".blobs". Blobs are shared by checkpoints
+            in the same directory and never removed by the writer.
+        min_blob_bytes (int): smaller arrays are pickled into the
+            checkpoint file, default 4096.
+
+    Example::
+
+        writer = jt.CheckpointWriter()
+        for epoch in range(100):
+            train(model, optimizer)
+            model.save(f"ckpt/model_{epoch}.pkl", writer)
+            writer.save(optimizer.state_dict(), f"ckpt/optim_{epoch}.pkl")
+        writer.wait()
+    '''
+    def __init__(self, blob_dir=".blobs", min_blob_bytes=4096):
+        self.blob_dir = blob_dir
+        self.min_blob_bytes = min_blob_bytes
+        # number of blobs written and reused
+        self.n_written = 0
+        self.n_reused = 0
+        self._thread = None
+        self._error = None
+        self._blobs = set()
+
+    def save(self, obj, path):
+        ''' Snapshots obj and writes it to path in background, waits for
+        the previous checkpoint first. '''
+        self.wait()
+        obj = _snapshot(obj)
+        self._thread = threading.Thread(target=self._write, args=(obj, path), daemon=True)
+        self._thread.start()
+
+    def wait(self):
+        ''' Waits for the checkpoint being written, raises its error. '''
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            e, self._error = self._error, None
+            raise e
+
+    def _write_blob(self, x, path):
+        x = np.ascontiguousarray(x)
+        name = os.path.join(self.blob_dir, _sha1(x)+".npy")
+        fname = os.path.join(os.path.dirname(path), name)
+        if fname in self._blobs or os.path.isfile(fname):
+            self.n_reused += 1
+        else:
+            tmp = fname + ".tmp"
+            with open(tmp, "wb") as f:
+                np.save(f, x)
+            os.replace(tmp, fname)
+            self.n_written += 1
+        self._blobs.add(fname)
+        return _BlobRef(name)
+
+    def _write(self, obj, path):
+        try:
+            os.makedirs(os.path.join(os.path.dirname(path), self.blob_dir), exist_ok=True)
+            def dfs(x):
+                if isinstance(x, (list, tuple)):
+                    return type(x)(dfs(v) for v in x)
+                if isinstance(x, dict):
+                    return type(x)((k, dfs(v)) for k, v in x.items())
+                if isinstance(x, np.ndarray) and x.dtype != object \
+                    and x.nbytes >= self.min_blob_bytes:
+                    return self._write_blob(x, path)
+                return x
+            obj = dfs(obj)
+            tmp = path + ".tmp"
+            jt.safepickle(obj, tmp)
+            os.replace(tmp, path)
+        except Exception as e:
+            self._error = e
+
+_MAGIC = b"JTTENSOR"
+
+def _align(n, align):
+    return (n + align - 1) // align * align
+
+def save_tensors(tensors, path, align=64):
+    ''' Saves a flat dict of Vars or arrays into a tensor container file,
+    which is loaded lazily by load_tensors without pickle.
+
+    The file is the magic b"JTTENSOR", 8 bytes little endian length of
+    the json header, the header, then raw tensor data aligned by align
+    bytes. The header maps keys to dtype, shape, offset and nbytes of
+    tensor data and its crc32. Tensors are converted and written one by
+    one, memory of only one tensor is used at a time.
+
+    Args:
+        tensors (dict): names and Vars or numpy arrays.
+        path (str): file path.
+        align (int): alignment of tensor data, default 64.
+
+    Example::
+
+        jt.save_tensors(model.state_dict(), "model.jtt")
+        model.load("model.jtt")
+    '''
+    import json
+    header = {}
+    offset = 0
+    for k, v in tensors.items():
+        if not isinstance(v, (jt.Var, np.ndarray)):
+            raise TypeError(f"expect a jittor Var or numpy array, but got <{v.__class__.__name__}>, key: {k}")
+        nbytes = int(np.prod(v.shape)) * np.dtype(str(v.dtype)).itemsize
+        # crc32 is filled after data is written, with the same length
+        header[k] = {"dtype": str(v.dtype), "shape": list(v.shape),
+            "offset": offset, "nbytes": nbytes, "crc32": "0"*8}
+        offset = _align(offset + nbytes, align)
+    def dump():
+        s = json.dumps({"align": align, "tensors": header}).encode()
+        return s + b" " * (_align(len(s)+16, align) - len(s) - 16)
+    s = dump()
+    start = 16 + len(s)
+    with open(path, "wb") as f:
+        f.write(_MAGIC + len(s).to_bytes(8, "little") + s)
+        for k, v in tensors.items():
+            if isinstance(v, jt.Var):
+                v = v.numpy()
+            v = np.ascontiguousarray(v)
+            data = memoryview(v).cast("B") if v.size else b""
+            f.seek(start + header[k]["offset"])
+            f.write(data)
+            header[k]["crc32"] = "%08x" % zlib.crc32(data)
+        f.truncate(start + offset)
+        f.seek(0)
+        f.write(_MAGIC + len(s).to_bytes(8, "little") + dump())
+
+def is_tensor_file(path):
+    ''' Returns True if path is a file saved by save_tensors. '''
+    if not os.path.isfile(path):
+        return False
+    with open(path, "rb") as f:
+        return f.read(len(_MAGIC)) == _MAGIC
+
+class LazyTensors(Mapping):
+    ''' Read only mapping of tensors of tensor container files, tensors
+    are numpy arrays backed by mmap, data is read from disk when accessed,
+    and verified by its crc32 at first access if verify is True.
+    Returned by load_tensors. '''
+    def __init__(self, paths, keys=None, verify=True):
+        import json
+        self.paths = paths
+        self.verify = verify
+        # key -> (file index, start of tensor data, tensor info)
+        self._index = {}
+        for i, path in enumerate(paths):
+            with open(path, "rb") as f:
+                if f.read(len(_MAGIC)) != _MAGIC:
+                    raise ValueError(f"not a tensor container file: {path}")
+                n = int.from_bytes(f.read(8), "little")
+                header = json.loads(f.read(n))
+            for k, info in header["tensors"].items():
+                self._index[k] = (i, 16 + n, info)
+        if keys is not None:
+            if callable(keys):
+                keys = [ k for k in self._index if keys(k) ]
+            missing = [ k for k in keys if k not in self._index ]
+            if missing:
+                raise KeyError(f"keys not found in {paths}: {missing}")
+            self._index = { k:self._index[k] for k in keys }
+        self._mmaps = [None] * len(paths)
+        self._verified = set()
+
+    def __getitem__(self, key):
+        i, start, info = self._index[key]
+        if info["nbytes"] == 0:
+            return np.zeros(info["shape"], info["dtype"])
+        if self._mmaps[i] is None:
+            with open(self.paths[i], "rb") as f:
+                self._mmaps[i] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        dtype = np.dtype(info["dtype"])
+        data = np.frombuffer(self._mmaps[i], dtype,
+            info["nbytes"] // dtype.itemsize, start + info["offset"])
+        if self.verify and key not in self._verified:
+            if "%08x" % zlib.crc32(data) != info["crc32"]:
+                raise ValueError(f"Tensor checksum does not match! key: {key}, path: {self.paths[i]}",
+                " This file maybe corrupted.")
+            self._verified.add(key)
+        return data.reshape(info["shape"])
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+def load_tensors(path, keys=None, verify=True):
+    ''' Loads tensors saved by save_tensors lazily by mmap, only accessed
+    tensors are read from disk, the whole file is never read into memory.
+
+    Args:
+        path (str or list): file path, or paths of several shards.
+        keys (list or callable): only load these keys, or keys for which
+            keys(key) returns True, default loads all keys.
+        verify (bool): verify crc32 of tensors when they are accessed.
+
+    Example::
+
+        # load the backbone of model only
+        model.load_parameters(jt.load_tensors("model.jtt",
+            keys=lambda k: k.startswith("backbone.")))
+    '''
+    if not isinstance(path, (list, tuple)):
+        path = [path]
+    return LazyTensors(list(path), keys, verify)
@@ -1,6 +1,7 @@
 
-from .dataset import Dataset, ImageFolder, dataset_root, TensorDataset, VarDataset
+from .dataset import Dataset, ImageFolder, dataset_root, TensorDataset, VarDataset, IterableDataset
 from .mnist import MNIST
 from .cifar import CIFAR10, CIFAR100
 from .voc import VOC
+from .record import RecordDataset, ImageRecordDataset, RecordWriter
 from .sampler import *
\ No newline at end of file
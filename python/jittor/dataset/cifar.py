@@ -111,20 +111,15 @@ class CIFAR10(Dataset):
             self.classes = data[self.meta['key']]
         self.class_to_idx = {_class: i for i, _class in enumerate(self.classes)}
 
-    def __getitem__(self, index):
-        """
-        Args:
-            index (int): Index
-
-        Returns:
-            tuple: (image, target) where target is index of the target class.
-        """
+    def load_sample(self, index):
         img, target = self.data[index], self.targets[index]
 
         # doing this so that it is consistent with all other datasets
         # to return a PIL Image
-        img = Image.fromarray(img)
+        return Image.fromarray(img), target
 
+    def transform_sample(self, sample):
+        img, target = sample
         if self.transform is not None:
             img = self.transform(img)
 
@@ -133,6 +128,16 @@ class CIFAR10(Dataset):
 
         return img, target
 
+    def __getitem__(self, index):
+        """
+        Args:
+            index (int): Index
+
+        Returns:
+            tuple: (image, target) where target is index of the target class.
+        """
+        return self.transform_sample(self.load_sample(index))
+
     def __len__(self):
         return len(self.data)
 
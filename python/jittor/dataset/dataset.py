@@ -12,7 +12,7 @@ from urllib import request
 import gzip
 import pickle
 import os
-from jittor.dataset.utils import get_random_list, get_order_list, collate_batch, HookTimer
+from jittor.dataset.utils import get_random_list, get_order_list, collate_batch, HookTimer, SharedSlots, SampleCache, buffered_shuffle
 from collections.abc import Sequence, Mapping
 import pathlib
 from PIL import Image
@@ -22,6 +22,10 @@ from jittor_utils import LOG
 import jittor as jt
 import time
 import jittor_utils as jit_utils
+import threading
+import queue
+import itertools
+import random
 
 dataset_root = os.path.join(jit_utils.home(), ".cache", "jittor", "dataset")
 mp_log_v = os.environ.get("mp_log_v", 0) 
@@ -29,6 +33,14 @@ mpi = jt.mpi
 img_open_hook = HookTimer(Image, "open")
 CHECK_MEMORY = int(os.environ.get("CHECK_MEMORY", "0"))
 
+def _set_batch_seed(seed):
+    ''' Seed python, numpy and jittor like jt.set_global_seed, without
+    probing cupy, which is too slow to be called for every batch. '''
+    seed = seed + jt.rank * 2591
+    random.seed(seed)
+    np.random.seed(seed)
+    jt.set_seed(seed)
+
 if os.name == "nt":
     from multiprocessing import shared_memory
     class RingBuffer:
@@ -67,12 +79,20 @@ if os.name == "nt":
     jt.RingBuffer = RingBuffer
 
 class Worker:
-    def __init__(self, target, args, buffer_size, keep_numpy_array=False):
+    def __init__(self, target, args, buffer_size, keep_numpy_array=False, shm_slots=0):
+        self.slots = None
+        if shm_slots:
+            # slots and ring buffer share buffer_size, ring buffer keeps
+            # the size of one slot for descriptors and arrays which do
+            # not fit a slot
+            slot_size = buffer_size // (shm_slots+1)
+            self.slots = SharedSlots(slot_size*shm_slots, shm_slots)
+            buffer_size -= slot_size*shm_slots
         self.buffer = jt.RingBuffer(buffer_size)
         self.buffer.keep_numpy_array(keep_numpy_array)
 
         self.status = mp.Array('f', 5, lock=False)
-        self.p = mp.Process(target=target, args=args+(self.buffer,self.status))
+        self.p = mp.Process(target=target, args=args+(self.buffer,self.status,self.slots))
         self.p.daemon = True
         self.p.start()
 
@@ -89,6 +109,12 @@ class Dataset(object):
         [in] buffer_size(int): buffer size for each worker in bytes, default(512MB).
         [in] keep_numpy_array(bool): return numpy array rather than jittor array, default(False).
         [in] endless(bool): will this dataset yield data forever, default(False).
+        [in] shm_slots(int): number of shared memory slots for each worker, workers collate numpy arrays directly into these slots and main process reads them without copying through ring buffer, 0 for disable, default(0). Slots do not use extra memory, buffer_size is split into shm_slots+1 parts, one for each slot and one for ring buffer, so a batch must fit buffer_size/(shm_slots+1) to be read without copy.
+        [in] persistent_workers(bool): keep workers alive when attributes are changed by set_attrs, new attributes are sent to workers instead of restarting them, default(False).
+        [in] batch_transform(callable): transform applied to each collated batch, such as jittor.transform.BatchCompose, default(None).
+        [in] prefetch(int): number of batches received from workers and converted to jittor var by a background thread ahead of training, 0 for disable, default(0).
+        [in] auto_workers(int): maximum number of workers for auto scaling, at the end of each epoch, num_workers and buffer_size are adjusted by the time main process waits for data and workers spend on loading, starting from num_workers, 0 for disable, default(0).
+        [in] auto_memory(int): budget in bytes of ring buffers of all workers for auto scaling, 0 for no limit, default(0).
     
     Example::
 
@@ -112,7 +138,15 @@ class Dataset(object):
                  buffer_size = 512*1024*1024,
                  stop_grad = True,
                  keep_numpy_array = False,
-                 endless = False):
+                 endless = False,
+                 shm_slots = 0,
+                 persistent_workers = False,
+                 batch_transform = None,
+                 prefetch = 0,
+                 cache_size = 0,
+                 cache_file = None,
+                 auto_workers = 0,
+                 auto_memory = 0):
         super().__init__()
         if os.environ.get("DISABLE_MULTIPROCESSING", '0') == '1':
             num_workers = 0
@@ -125,16 +159,42 @@ class Dataset(object):
         self.stop_grad = stop_grad
         self.keep_numpy_array = keep_numpy_array
         self.endless = endless
+        self.shm_slots = shm_slots
+        self.persistent_workers = persistent_workers
+        self.batch_transform = batch_transform
+        self.prefetch = prefetch
+        self.cache_size = cache_size
+        self.cache_file = cache_file
+        self.auto_workers = auto_workers
+        self.auto_memory = auto_memory
         self.epoch_id = 0
         self.sampler = None
         self._disable_workers = False
         self._shuffle_rng = np.random.default_rng(1)
+        self._seed_rng = None
+        self._epoch_state = None
+        self._batch_pos = 0
+        self._resume = None
+        self._collate_alloc = None
+        self._cache = None
+        self._sampler_batches = False
+        self._loader_stats = None
         self.dataset = self
 
     def __getitem__(self, index):
         raise NotImplementedError
 
     def __batch_len__(self):
+        if self.sampler is not None:
+            from jittor.dataset.sampler import BatchSampler
+            if self._sampler_batches or isinstance(self.sampler, BatchSampler):
+                # sampler yields index list of each batch
+                try:
+                    return len(self.sampler)
+                except TypeError:
+                    if self._sampler_batches:
+                        return self.batch_len
+                    raise
         assert self.total_len >= 0
         assert self.batch_size > 0
         if self.drop_last:
@@ -161,11 +221,30 @@ class Dataset(object):
             * num_workers: number of workers for loading data
             * buffer_size: buffer size for each worker in bytes, default(512MB).
             * stop_grad: stop grad for data, default(True).
+            * shm_slots: number of shared memory slots for each worker, each slot and the ring buffer take buffer_size/(shm_slots+1), default(0).
+            * persistent_workers: keep workers alive when attributes changed, default(False).
+            * batch_transform: transform applied to each collated batch, default(None).
+            * prefetch: number of batches received and converted ahead by a background thread, default(0).
+            * cache_size: bytes of shared memory to cache decoded samples returned by load_sample, shared by all workers, default(0).
+            * cache_file: path of file to back the sample cache instead of shared memory, default(None).
+            * auto_workers: maximum number of workers, num_workers and buffer_size are adjusted at the end of each epoch to minimize data waiting time, 0 for disable, default(0).
+            * auto_memory: budget in bytes of ring buffers of all workers for auto_workers, 0 for no limit, default(0).
+            * sampler: sampler of indexes, or batch sampler(any iterable of index list) for variable size batches.
         '''
         for k,v in kw.items():
             assert hasattr(self, k), k
             setattr(self, k, v)
-        self.reset()
+        restart = kw.keys() & self._worker_init_attrs
+        if kw.keys() & {"cache_size", "cache_file", "total_len"} and \
+            self._cache is not None:
+            # workers share the cache created before them
+            self._cache = None
+            restart = True
+        if self.persistent_workers and hasattr(self, "workers") and \
+            not restart:
+            self._update_workers(kw)
+        else:
+            self.reset()
         return self
 
     def to_jittor(self, batch):
@@ -202,7 +281,56 @@ class Dataset(object):
         [in] batch(list): A list of variables, such as jt.var, Image.Image, np.ndarray, int, float, str and so on.
 
         '''
-        return collate_batch(batch)
+        return collate_batch(batch, self._collate_alloc)
+
+    def load_sample(self, index):
+        '''
+        Load and decode a sample without random augmentation, the result
+        is cached when cache_size is set, and transform_sample is applied
+        to it for every epoch. Dataset overrides load_sample and
+        transform_sample together, samples are not cached if load_sample
+        is not overridden.
+
+        Example::
+
+            class YourDataset(Dataset):
+                def load_sample(self, k):
+                    return Image.open(self.paths[k]).convert('RGB'), self.labels[k]
+
+                def transform_sample(self, sample):
+                    img, label = sample
+                    return self.transform(img), label
+
+                def __getitem__(self, k):
+                    return self.transform_sample(self.load_sample(k))
+        '''
+        return self[index]
+
+    def transform_sample(self, sample):
+        ''' Transform sample returned by load_sample, see load_sample. '''
+        return sample
+
+    def _get_sample(self, index):
+        cache = self._cache
+        if cache is None:
+            return self[index]
+        hit, sample = cache.get(index)
+        if not hit:
+            sample = self.load_sample(index)
+            cache.put(index, sample)
+        return self.transform_sample(sample)
+
+    def _collate_and_transform(self, batch):
+        if self.batch_transform is None:
+            return self.collate_batch(batch)
+        # collate into heap, only the transformed batch is packed into
+        # shared memory slot, which may be larger than collated batch
+        alloc, self._collate_alloc = self._collate_alloc, None
+        try:
+            batch = self.collate_batch(batch)
+        finally:
+            self._collate_alloc = alloc
+        return self.batch_transform(batch)
 
     def terminate(self):
         '''
@@ -212,7 +340,48 @@ class Dataset(object):
             for w in self.workers:
                 w.p.terminate()
     
-    def _worker_main(self, worker_id, buffer, status):
+    # attributes which can only take effect by restarting workers
+    _worker_init_attrs = {"num_workers", "buffer_size", "keep_numpy_array",
+        "shm_slots", "persistent_workers", "cache_size", "cache_file"}
+
+    # attributes only used by main process, index list and batch
+    # offsets are shared with workers through shared memory
+    _main_only_attrs = {"sampler", "batch_size", "shuffle", "drop_last",
+        "prefetch", "endless", "stop_grad", "auto_workers", "auto_memory"}
+
+    def _update_workers(self, kw):
+        ''' Send new attributes to idle persistent workers. '''
+        kw = { k:v for k,v in kw.items() if k not in self._main_only_attrs }
+        try:
+            pickle.dumps(kw)
+        except Exception:
+            # e.g. lambda transform, restart workers instead
+            self.reset()
+            return
+        self._stop_all_workers()
+        epoch = self._next_epoch_state()
+        if self.real_len > len(self.index_list):
+            # shared index list is not large enough,
+            # workers are restarted with this epoch
+            self.reset()
+            self._resume = (epoch, 0)
+            return
+        with self.gid.get_lock():
+            for ctrl in self._ctrl_buffers:
+                ctrl.send(kw)
+            self._ctrl_version.value += 1
+            self._set_index_list(epoch)
+
+    def _recv_attrs(self, worker_id, version):
+        ''' Apply attributes sent by _update_workers (worker side). '''
+        while version < self._ctrl_version.value:
+            kw = self._ctrl_buffers[worker_id].recv()
+            for k,v in kw.items():
+                setattr(self, k, v)
+            version += 1
+        return version
+
+    def _worker_main(self, worker_id, buffer, status, slots=None):
         import jittor_utils
         jittor_utils.cc.init_subprocess()
         jt.jt_init_subprocess()
@@ -224,60 +393,10 @@ class Dataset(object):
         # it seems like the static value of parallel compiler
         # is not correctly init.
         jt.flags.use_parallel_op_compiler = 0
-        import time
+        if slots is not None:
+            self._collate_alloc = slots.alloc
         try:
-            gid_obj = self.gid.get_obj()
-            gid_lock = self.gid.get_lock()
-            start = time.time()
-            while True:
-                # get id
-                with gid_lock:
-                    while buffer.is_stop() or self.idqueue.is_stop() or \
-                        gid_obj.value >= self.batch_len:
-                        self.num_idle.value += 1
-                        self.num_idle_c.notify()
-                        self.gidc.wait()
-                        self.num_idle.value -= 1
-                    cid = gid_obj.value
-                    batch_index_list = self.index_list_numpy[
-                        cid*self.real_batch_size:
-                        min(self.real_len, (cid+1)*self.real_batch_size)
-                    ].copy()
-                    gid_obj.value += 1
-                with self.idqueue_lock:
-                    self.idqueue.push(worker_id)
-                now = time.time()
-                other_time = now - start
-                start = now
-
-                # load and transform data
-                batch = []
-                if mp_log_v:
-                    print(f"#{worker_id} {os.getpid()} load batch", cid*self.real_batch_size, min(self.real_len, (cid+1)*self.real_batch_size))
-                for i in batch_index_list:
-                    batch.append(self[i])
-                batch = self.collate_batch(batch)
-                now = time.time()
-                data_time = now - start
-                start = now
-
-                # send data to main process
-                if mp_log_v:
-                    print(f"#{worker_id} {os.getpid()} send", type(batch).__name__, [ type(b).__name__ for b in batch ], buffer)
-                try:
-                    buffer.send(batch)
-                except:
-                    if buffer.is_stop():
-                        continue
-                    raise
-                now = time.time()
-                send_time = now - start
-                start = now
-                status[0], status[1], status[2], status[3], status[4] = \
-                    other_time, data_time, send_time, \
-                    other_time + data_time + send_time, \
-                    img_open_hook.duration
-                img_open_hook.duration = 0.0
+            self._worker_loop(worker_id, buffer, status, slots)
         except:
             import traceback
             line = traceback.format_exc()
@@ -285,6 +404,88 @@ class Dataset(object):
             os.kill(os.getppid(), signal.SIGINT)
             exit(0)
 
+    def _pack_batch(self, batch, slots):
+        ''' Collate and transform batch in worker, return the object
+        sent through ring buffer. '''
+        if slots is None:
+            return self._collate_and_transform(batch)
+        # collate into shared memory slot, only
+        # descriptors are sent through ring buffer
+        slots.begin()
+        batch = slots.pack(self._collate_and_transform(batch))
+        slots.end()
+        return batch
+
+    def _worker_loop(self, worker_id, buffer, status, slots):
+        gid_obj = self.gid.get_obj()
+        gid_lock = self.gid.get_lock()
+        ctrl_version = 0
+        start = time.time()
+        while True:
+            # get id
+            with gid_lock:
+                ctrl_version = self._wait_for_id(worker_id, buffer, ctrl_version)
+                cid = gid_obj.value
+                l = self.index_offsets_numpy[cid]
+                r = self.index_offsets_numpy[cid+1]
+                batch_index_list = self.index_list_numpy[l:r].copy()
+                epoch_seed = self.epoch_seed.value
+                gid_obj.value += 1
+            with self.idqueue_lock:
+                self.idqueue.push(worker_id)
+                self.num_pushed.value += 1
+            now = time.time()
+            other_time = now - start
+            start = now
+
+            # load and transform data, seed depends on batch rather
+            # than worker, so random augmentation is reproducible
+            _set_batch_seed((epoch_seed ^ (cid*1167)) ^ 1234)
+            batch = []
+            if mp_log_v:
+                print(f"#{worker_id} {os.getpid()} load batch", l, r)
+            for i in batch_index_list:
+                batch.append(self._get_sample(i))
+            batch = self._pack_batch(batch, slots)
+            now = time.time()
+            data_time = now - start
+            start = now
+
+            # send data to main process
+            if mp_log_v:
+                print(f"#{worker_id} {os.getpid()} send", type(batch).__name__, [ type(b).__name__ for b in batch ], buffer)
+            try:
+                buffer.send(batch)
+            except:
+                if buffer.is_stop():
+                    continue
+                raise
+            now = time.time()
+            send_time = now - start
+            start = now
+            self._set_status(status, other_time, data_time, send_time)
+
+    def _wait_for_id(self, worker_id, buffer, ctrl_version):
+        ''' Wait until there is a batch id to take, gid lock should be held,
+        return the version of attributes received by worker. '''
+        while buffer.is_stop() or self.idqueue.is_stop() or \
+            self.gid.get_obj().value >= self.num_batches.value:
+            self.num_idle.value += 1
+            self.num_idle_c.notify()
+            self.gidc.wait()
+            self.num_idle.value -= 1
+            if self.persistent_workers:
+                ctrl_version = self._recv_attrs(worker_id, ctrl_version)
+        return ctrl_version
+
+    @staticmethod
+    def _set_status(status, other_time, data_time, send_time):
+        status[0], status[1], status[2], status[3], status[4] = \
+            other_time, data_time, send_time, \
+            other_time + data_time + send_time, \
+            img_open_hook.duration
+        img_open_hook.duration = 0.0
+
     def display_worker_status(self):
         ''' Display dataset worker status, when dataset.num_workers > 0, it will display infomation blow:
 
@@ -314,6 +515,8 @@ Meaning of the outputs:
 * to_jittor: time of batch data to jittor variable
 * recv_raw_call: total number of underlying recv_raw called
 * last 10 workers: id of last 10 workers which main proc load from.
+* cache: sample cache status, if cache_size is set.
+* auto_workers: total waiting and batch time of this epoch, if auto_workers is set.
 * table meaning
     * ID: worker id
     * wait: worker wait time
@@ -333,10 +536,16 @@ Example::
         if not hasattr(self, "workers"):
             return
         msg = [""]
-        msg.append(f"progress:{self.batch_id}/{self.batch_len}")
+        batch_len = "?" if self.batch_len is None else self.batch_len
+        msg.append(f"progress:{self.batch_id}/{batch_len}")
         msg.append(f"batch(s): {self.batch_time:.3f}\twait(s):{self.wait_time:.3f}")
         msg.append(f"recv(s): {self.recv_time:.3f}\tto_jittor(s):{self.to_jittor_time:.3f}")
         msg.append(f"last 10 workers: {self.last_ids}")
+        if self._cache is not None:
+            msg.append(f"cache: {self._cache}")
+        if self.auto_workers and self._loader_stats is not None:
+            stats = self._loader_stats
+            msg.append(f"auto_workers: wait(s) {stats['stall']:.3f} batch(s) {stats['step']:.3f} max batch bytes {stats['bytes']}")
         msg.append(f"ID\twait(s)\topen(s)\tload(s)\tsend(s)\ttotal(s)")
         for i in range(self.num_workers):
             w = self.workers[i]
@@ -344,15 +553,60 @@ Example::
             msg.append(f"#{i}\t{s[0]:.3f}\t{s[4]:.3f}\t{s[1]:.3f}\t{s[2]:.3f}\t{s[3]:.3f}\t{w.buffer}")
         LOG.i('\n'.join(msg))
 
+    def _autoscale_workers(self):
+        ''' Choose num_workers and buffer_size of next epoch by the time
+        main process waits for batches, return new (num_workers,
+        buffer_size) if workers should be restarted. Workers are added when main process waits, removed
+        when loading speed of fewer workers is still 25% faster than
+        training, buffer_size is set to hold about 4 batches. '''
+        stats = self._loader_stats
+        n = self.num_workers
+        num_batches = stats["batches"]
+        if num_batches < 2 * n or stats["step"] <= 0:
+            # too few batches to measure
+            return None
+        step = stats["step"] / num_batches
+        load = stats["load"] / num_batches
+        stall_ratio = stats["stall"] / (stats["stall"] + stats["step"])
+        if stall_ratio > 0.02:
+            # loading is slower than training by (stall+step)/step
+            new_n = max(n+1, int(np.ceil(n * (1 + stats["stall"] / stats["step"]))))
+            new_n = min(new_n, 2*n)
+        else:
+            new_n = min(n, int(np.ceil(1.25 * load / step)))
+        new_n = max(1, min(new_n, self.auto_workers))
+
+        buffer_size = self.buffer_size
+        if not self.shm_slots and stats["bytes"]:
+            need = 1 << int(np.ceil(np.log2(max(stats["bytes"] * 4, 1<<20))))
+            # resize only if size changes by 4 times
+            if need * 4 <= buffer_size or need > buffer_size:
+                buffer_size = need
+        if self.auto_memory:
+            # keep at least 2 batches in each buffer
+            min_size = max(stats["bytes"] * 2, 1<<20)
+            if new_n * buffer_size > self.auto_memory:
+                buffer_size = max(self.auto_memory // new_n, min_size)
+            new_n = max(1, min(new_n, self.auto_memory // buffer_size))
+
+        if new_n == n and buffer_size == self.buffer_size:
+            return None
+        LOG.i(f"auto_workers: num_workers {n}->{new_n}, buffer_size "
+              f"{self.buffer_size}->{buffer_size}, wait {stall_ratio:.1%}, "
+              f"batch(s) {step:.4f}, load(s) {load:.4f}")
+        return new_n, buffer_size
+
     def _stop_all_workers(self):
         # stop workers
         for w in self.workers:
             w.buffer.stop()
+            if w.slots is not None:
+                w.slots.stop()
         self.idqueue.stop()
         # wait until all workers idle
         if self.num_idle.value < self.num_workers:
             with self.gid.get_lock():
-                self.gid.get_obj().value = self.batch_len
+                self.gid.get_obj().value = self.num_batches.value
                 if mp_log_v:
                     print("idle num", self.num_idle.value)
                 while self.num_idle.value < self.num_workers:
@@ -362,20 +616,51 @@ Example::
         # clean workers' buffer
         for w in self.workers:
             w.buffer.clear()
+            if w.slots is not None:
+                w.slots.clear()
         self.idqueue.clear()
-        self.gid_obj.value = 0
-            
-    def _init_workers(self, index_list):
+        self.gid.get_obj().value = 0
+        self._next_epoch = None
+        self._workers_dirty = False
+
+    def _set_index_list(self, epoch, first_batch=0):
+        ''' Share index list and batch offsets of epoch with workers,
+        workers start from first_batch, gid lock should be held. '''
+        index_list = epoch["index_list"]
+        batch_offsets = epoch["batch_offsets"]
+        n = len(index_list)
+        assert n <= len(self.index_list), \
+            f"Index list is too large({n}>{len(self.index_list)}), " \
+            "please reset dataset."
+        self.index_list_numpy[:n] = index_list
+        self.index_offsets_numpy[:len(batch_offsets)] = batch_offsets
+        self.num_batches.value = len(batch_offsets) - 1
+        self.num_pushed.value = first_batch
+        self.epoch_seed.value = epoch["epoch_seed"]
+        self.gid.get_obj().value = first_batch
+        # the epoch which main process does not start to receive yet
+        self._next_epoch = (epoch, first_batch)
+
+    def _init_workers(self, epoch, first_batch=0):
         jt.migrate_all_to_cpu()
         jt.clean()
         jt.gc()
-        self.index_list = mp.Array('i', self.real_len, lock=False)
+        capacity = max(len(epoch["index_list"]), self.total_len or 0)
+        self.index_list = mp.Array('i', capacity, lock=False)
+        # batch k is index_list[index_offsets[k]:index_offsets[k+1]]
+        self.index_offsets = mp.Array('i', capacity+1, lock=False)
+        # number of batches of index list
+        self.num_batches = mp.Value('i', 0, lock=False)
+        # number of batches whose worker id is pushed into idqueue
+        self.num_pushed = mp.Value('i', 0, lock=False)
+        # seed of batches of index list
+        self.epoch_seed = mp.Value('i', 0, lock=False)
         workers = []
         # get worker id
         self.idqueue = jt.RingBuffer(2048)
         self.idqueue_lock = mp.Lock()
         # global token index
-        self.gid = mp.Value('i', self.batch_len)
+        self.gid = mp.Value('i', 0)
         self.gid.value = 0
         # global token index condition
         self.gidc = mp.Condition(self.gid.get_lock())
@@ -383,12 +668,22 @@ Example::
         self.num_idle = mp.Value('i', 0, lock=False)
         # number of idle workers condition
         self.num_idle_c = mp.Condition(self.gid.get_lock())
-        self.index_list_numpy = np.ndarray(dtype='int32', shape=self.real_len, buffer=self.index_list)
-        self.index_list_numpy[:] = index_list
+        self.index_list_numpy = np.ndarray(dtype='int32', shape=capacity, buffer=self.index_list)
+        self.index_offsets_numpy = np.ndarray(dtype='int32', shape=capacity+1, buffer=self.index_offsets)
+        self._workers_dirty = False
+        self._set_index_list(epoch, first_batch)
+        if self.persistent_workers:
+            # control channels of workers, used by _update_workers
+            self._ctrl_buffers = [ jt.RingBuffer(16*1024*1024) 
+                for i in range(self.num_workers) ]
+            for ctrl in self._ctrl_buffers:
+                ctrl.keep_numpy_array(True)
+            self._ctrl_version = mp.Value('i', 0, lock=False)
         for i in range(self.num_workers):
             w = Worker(target=self._worker_main, args=(i,), 
                        buffer_size=self.buffer_size,
-                       keep_numpy_array=self.keep_numpy_array)
+                       keep_numpy_array=self.keep_numpy_array,
+                       shm_slots=self.shm_slots)
             workers.append(w)
         self.workers = workers
 
@@ -398,13 +693,20 @@ Example::
         self._stop_all_workers()
         self.terminate()
         del self.index_list
-        del self.idmap
+        del self.index_offsets
+        del self.num_batches
+        del self.num_pushed
+        del self.epoch_seed
         del self.gid
         del self.gidc
         del self.num_idle
         del self.num_idle_c
         del self.workers
         del self.index_list_numpy
+        del self.index_offsets_numpy
+        if hasattr(self, "_ctrl_buffers"):
+            del self._ctrl_buffers
+            del self._ctrl_version
 
     def __del__(self):
         if mp_log_v:
@@ -419,6 +721,39 @@ Example::
             self.total_len = len(self)
         return self.total_len
 
+    def _get_shuffle_list(self):
+        ''' Return shuffled index list of this epoch, dataset can override
+        it for locality aware shuffle. '''
+        # using _shuffle_rng to generate multiprocess
+        # consist shuffle list
+        # index_list = get_random_list(self.total_len)
+        return self._shuffle_rng.permutation(range(self.total_len))
+
+    def _get_batch_index_list(self, batches):
+        ''' Index list of batch sampler, each batch may have different size. '''
+        # scatter each batch for all mpi process like fixed size batches
+        if jt.in_mpi:
+            world_size = mpi.world_size()
+            world_rank = mpi.world_rank()
+            rank_batches = []
+            for b in batches:
+                real_batch_size = (len(b)-1)//world_size+1
+                l = real_batch_size * world_rank
+                r = l + real_batch_size
+                if r > len(b): r = len(b)
+                if l >= r: l = r-1
+                rank_batches.append(b[l:r])
+            batches = rank_batches
+        sizes = [ len(b) for b in batches ]
+        # batch k is index_list[batch_offsets[k]:batch_offsets[k+1]]
+        self.batch_offsets = np.cumsum([0]+sizes)
+        self.real_len = int(self.batch_offsets[-1])
+        self.real_batch_size = max(sizes, default=0)
+        self.batch_len = len(batches)
+        if self.real_len == 0:
+            return np.zeros((0,), "int32")
+        return np.int32(np.concatenate(batches))
+
     def _get_index_list(self):
         if self.total_len is None:
             self.total_len = len(self)
@@ -427,16 +762,15 @@ Example::
         if self.sampler:
             index_list = list(self.sampler.__iter__())
             total_len = len(index_list)
-            # check is not batch sampler
-            if len(index_list):
-                assert not isinstance(index_list[0], (list,tuple)), "Batch sampler not support yet."
+            # batch sampler yields index list of each batch
+            self._sampler_batches = len(index_list) > 0 and \
+                isinstance(index_list[0], (list,tuple,np.ndarray))
+            if self._sampler_batches:
+                return self._get_batch_index_list(index_list)
         elif self.shuffle == False:
             index_list = get_order_list(self.total_len)
         else:
-            # using _shuffle_rng to generate multiprocess
-            # consist shuffle list
-            # index_list = get_random_list(self.total_len)
-            index_list = self._shuffle_rng.permutation(range(self.total_len))
+            index_list = self._get_shuffle_list()
         
         # scatter index_list for all mpi process
         # scatter rule:
@@ -485,11 +819,90 @@ Example::
             assert total_len // self.batch_size == \
                 self.real_len // self.real_batch_size, f"Number of batches({total_len // self.batch_size}!={self.real_len // self.real_batch_size}) not match, total_len: {total_len}, batch_size: {self.batch_size}, real_len: {self.real_len}, real_batch_size: {self.real_batch_size}"
         else:
-            self.real_len = self.total_len
+            self.real_len = total_len
             self.real_batch_size = self.batch_size
-        self.batch_len = self.__batch_len__()
+        if self.drop_last:
+            self.batch_len = total_len // self.batch_size
+        else:
+            self.batch_len = (total_len-1) // self.batch_size + 1
+        # batch k is index_list[batch_offsets[k]:batch_offsets[k+1]]
+        self.batch_offsets = np.minimum(
+            np.arange(self.batch_len+1) * self.real_batch_size, self.real_len)
         return index_list
 
+    def _next_epoch_state(self):
+        ''' Generate index list of next epoch, return it with the seed of
+        its batches and the rng states after generating it. '''
+        if self._seed_rng is None:
+            self._seed_rng = np.random.default_rng(jt.get_seed())
+        index_list = np.int32(self._get_index_list())
+        state = {
+            "index_list": index_list,
+            "batch_offsets": np.int64(self.batch_offsets),
+            "epoch_seed": int(self._seed_rng.integers(0, 2**31-1)),
+            "shuffle_rng": self._shuffle_rng.bit_generator.state,
+            "seed_rng": self._seed_rng.bit_generator.state,
+        }
+        if hasattr(self.sampler, "state_dict"):
+            # custom sampler with its own random state
+            state["sampler"] = self.sampler.state_dict()
+        return state
+
+    def state_dict(self):
+        '''
+        Return the iteration state of dataset, including epoch id, id of the
+        next batch to yield, the index list of current epoch and the states
+        of random generators, iteration can be resumed by load_state_dict.
+
+        Example::
+
+            state = dataset.state_dict()
+            ...
+            dataset.load_state_dict(state)
+            for x, y in dataset:
+                ... # continue from the batch after the last yielded one
+        '''
+        state = {
+            "epoch_id": self.epoch_id,
+            "batch_id": self._batch_pos,
+        }
+        if self._resume is not None:
+            # loaded but not iterated yet
+            state.update(self._resume[0])
+            state["batch_id"] = self._resume[1]
+        elif self._epoch_state is not None:
+            state.update(self._epoch_state)
+        return state
+
+    def load_state_dict(self, state):
+        '''
+        Load iteration state returned by state_dict, the next iteration
+        starts from the saved batch with the same index list. Random
+        augmentation of each batch is reproduced when workers are used.
+        '''
+        self.epoch_id = state["epoch_id"]
+        self._epoch_state = None
+        self._batch_pos = 0
+        self._resume = None
+        if hasattr(self, "workers"):
+            # drop the batches workers already loaded
+            self._stop_all_workers()
+        if "index_list" not in state:
+            return
+        self._shuffle_rng.bit_generator.state = state["shuffle_rng"]
+        if self._seed_rng is None:
+            self._seed_rng = np.random.default_rng()
+        self._seed_rng.bit_generator.state = state["seed_rng"]
+        if "sampler" in state:
+            self.sampler.load_state_dict(state["sampler"])
+        epoch = { k:state[k] for k in ["index_list", "batch_offsets",
+            "epoch_seed", "shuffle_rng", "seed_rng", "sampler"] if k in state }
+        first_batch = state["batch_id"]
+        if first_batch >= len(epoch["batch_offsets"]) - 1:
+            # saved at the end of epoch, start from next epoch
+            return
+        self._resume = (epoch, first_batch)
+
     def _epochs(self):
         if self.endless:
             while True:
@@ -498,93 +911,242 @@ Example::
         else:
             yield
         
+    def _recv_batches(self, batch_ids, stop=None):
+        ''' Receive batches of an epoch from workers, yield batch and
+        function to release the slot of batch(or None). If stop event
+        is given, wait for data without blocking other threads. '''
+        gid_lock = self.gid.get_lock()
+        self._recv_start = time.time()
+        for i in batch_ids:
+            if self._next_epoch is None and \
+                self.num_pushed.value >= self.num_batches.value:
+                # all batches of this epoch are taken by workers and
+                # their ids are in idqueue, let workers prefetch the
+                # next epoch, ids of next epoch cannot be mixed in
+                with gid_lock:
+                    self._set_index_list(self._next_epoch_state())
+                    self.gidc.notify_all()
+            item = self._recv_batch(i, stop)
+            if item is None:
+                return
+            yield item
+
+    def _recv_batch(self, i, stop=None):
+        ''' Receive the i-th batch from the worker which takes it, return
+        (batch, release), batch is None if worker sends None. Return None
+        if stop event is set. '''
+        def wait_for(buffer):
+            # recv of ring buffer blocks with GIL held
+            while buffer.total_push() <= buffer.total_pop():
+                if stop.is_set():
+                    return False
+                time.sleep(0.0005)
+            return True
+        start = self._recv_start
+        # get which worker has this batch
+        if stop is not None and not wait_for(self.idqueue):
+            return None
+        worker_id = self.idqueue.pop()
+
+        now = time.time()
+        self.wait_time = now - start
+        start = now
+
+        self.last_ids[i%10] = worker_id
+        w = self.workers[worker_id]
+        if mp_log_v:
+            print(f"#{worker_id} {os.getpid()} recv buffer", w.buffer)
+        if stop is not None and not wait_for(w.buffer):
+            return None
+        pos = w.buffer.total_pop()
+        batch = w.buffer.recv()
+
+        now = time.time()
+        self.recv_time = now - start
+        start = now
+        stats = self._loader_stats
+        if stats is not None:
+            # load time of the last batch sent by this worker
+            stats["load"] += w.status[1]
+            stats["bytes"] = max(stats["bytes"], w.buffer.total_pop()-pos)
+
+        if batch is None:
+            self._recv_start = start
+            return None, None
+        if mp_log_v:
+            print(f"#{worker_id} {os.getpid()} recv", type(batch).__name__, [ type(b).__name__ for b in batch ])
+        release = None
+        if w.slots is not None:
+            # prefetched numpy arrays cannot hold slots
+            copy = stop is not None and self.keep_numpy_array
+            batch = w.slots.unpack(batch, copy)
+            if self.keep_numpy_array and not copy:
+                release = w.slots.release
+        batch = self.to_jittor(batch)
+        # numpy arrays are copied into jittor vars,
+        # slot can be reused after to_jittor
+        if w.slots is not None and release is None:
+            w.slots.release()
+
+        now = time.time()
+        self.to_jittor_time = now - start
+        self._recv_start = now
+        return batch, release
+
+    def _prefetch_batches(self, batch_ids):
+        ''' Receive and convert batches ahead in a background thread. '''
+        q = queue.Queue(self.prefetch)
+        stop = threading.Event()
+        def put(item):
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+        def run():
+            try:
+                for item in self._recv_batches(batch_ids, stop):
+                    put(item)
+                # end of epoch
+                put((None, None))
+            except BaseException as e:
+                put((e, None))
+        t = threading.Thread(target=run, daemon=True)
+        t.start()
+        try:
+            while True:
+                batch, release = q.get()
+                if batch is None:
+                    return
+                if isinstance(batch, BaseException):
+                    raise batch
+                yield batch, release
+        finally:
+            stop.set()
+            t.join()
+
+    def _batch_ids(self, epoch, first_batch):
+        ''' Ids of batches received in epoch. '''
+        return range(first_batch, len(epoch["batch_offsets"])-1)
+
     def __iter__(self):
         if self._disable_workers:
             self.num_workers = 0
-        index_list = self._get_index_list()
+        # (epoch state, first batch) loaded by load_state_dict
+        resume, self._resume = self._resume, None
+        if self.cache_size and self._cache is None:
+            if type(self).load_sample is Dataset.load_sample:
+                # __getitem__ may return randomly augmented samples
+                LOG.w(f"{type(self).__name__} does not override load_sample, "
+                    "samples are not cached.")
+                self.cache_size = 0
+            else:
+                # created before workers, so all workers share it
+                self._cache = SampleCache(self.cache_size, self.__real_len__(),
+                    self.cache_file)
+        # startup of workers is not counted as waiting time
+        skip_stall = not hasattr(self, "workers")
         
         if not hasattr(self, "workers") and self.num_workers:
-            self._init_workers(index_list)
+            self._init_workers(*(resume or (self._next_epoch_state(),)))
             self.last_ids = [-1] * 10
+            resume = None
         
         if self.num_workers:
-            start = time.time()
             self.batch_time = 0
-            gid_obj = self.gid.get_obj()
             gid_lock = self.gid.get_lock()
 
+            if self._workers_dirty:
+                # last iteration is broken, drop unreceived batches
+                self._stop_all_workers()
+
             for _ in self._epochs():
                 with gid_lock:
+                    if resume is not None:
+                        self._set_index_list(*resume)
+                        resume = None
+                    elif self._next_epoch is None:
+                        # all batches are received, start a new epoch
+                        self._set_index_list(self._next_epoch_state())
+                    epoch, first_batch = self._next_epoch
+                    self._next_epoch = None
                     if self.num_idle.value:
                         self.gidc.notify_all()
 
-                for i in range(self.batch_len):
-                    if self.num_idle.value:
-                        with gid_lock:
-                            if self.num_idle.value and \
-                                gid_obj.value >= self.batch_len:
-                                index_list = self._get_index_list()
-                                self.index_list_numpy[:] = index_list
-                                gid_obj.value = 0
-                                self.gidc.notify_all()
-
-                    # get which worker has this batch
-                    worker_id = self.idqueue.pop()
-
-                    now = time.time()
-                    self.wait_time = now - start
-                    start = now
-
-                    self.last_ids[i%10] = worker_id
+                self._epoch_state = epoch
+                self._batch_pos = first_batch
+                if self.auto_workers:
+                    self._loader_stats = stats = dict(stall=0.0, step=0.0,
+                        load=0.0, bytes=0, batches=0)
+                batch_ids = self._batch_ids(epoch, first_batch)
+                if self.prefetch:
+                    batches = self._prefetch_batches(batch_ids)
+                else:
+                    batches = self._recv_batches(batch_ids)
+                end = time.time()
+                for i, (batch, release) in enumerate(batches, first_batch):
                     self.batch_id = i
-                    w = self.workers[worker_id]
-                    if mp_log_v:
-                        print(f"#{worker_id} {os.getpid()} recv buffer", w.buffer)
-                    batch = w.buffer.recv()
-
-                    now = time.time()
-                    self.recv_time = now - start
-                    start = now
-
-                    if mp_log_v:
-                        print(f"#{worker_id} {os.getpid()} recv", type(batch).__name__, [ type(b).__name__ for b in batch ])
-                    batch = self.to_jittor(batch)
-                    
-                    now = time.time()
-                    self.to_jittor_time = now - start
-                    start = now
-
-                    yield batch
-
-                    now = time.time()
-                    self.batch_time = now - start
-                    start = now
+                    self._batch_pos = i + 1
+                    start = time.time()
+                    if self.auto_workers:
+                        if not skip_stall:
+                            stats["stall"] += start - end
+                        skip_stall = False
+                    try:
+                        yield batch
+                    except GeneratorExit:
+                        self._workers_dirty = True
+                        batches.close()
+                        raise
+
+                    # numpy arrays are views of slot, valid until next batch
+                    if release is not None:
+                        release()
+
+                    end = time.time()
+                    self.batch_time = end - start
+                    if self.auto_workers:
+                        stats["step"] += self.batch_time
+                        stats["batches"] += 1
 
                     if CHECK_MEMORY and self.batch_id % CHECK_MEMORY == 0:
                         jt.display_memory_info()
+
+                scale = self.auto_workers and self._autoscale_workers()
+                if scale:
+                    # restart workers with the prefetched epoch
+                    resume = self._next_epoch
+                    self.reset()
+                    self.num_workers, self.buffer_size = scale
+                    if not self.endless:
+                        self._resume = resume
+                        continue
+                    # continue endless epochs with new workers
+                    self._init_workers(*(resume or (self._next_epoch_state(),)))
+                    self.last_ids = [-1] * 10
+                    resume = None
+                    gid_lock = self.gid.get_lock()
+                    skip_stall = True
         else:
             for _ in self._epochs():
-                self.batch_id = 0
-                batch_data = []
-                for idx in index_list:
-                    batch_data.append(self[int(idx)])
-                    if len(batch_data) == self.real_batch_size:
-                        batch_data = self.collate_batch(batch_data)
-                        tmp = batch_data
-                        batch_data = self.to_jittor(batch_data)
-                        # breakpoint()
-                        yield batch_data
-                        self.batch_id += 1
-                        if CHECK_MEMORY and self.batch_id % CHECK_MEMORY == 0:
-                            jt.display_memory_info()
-                        batch_data = []
-
-                # depend on drop_last
-                if not self.drop_last and len(batch_data) > 0:
-                    batch_data = self.collate_batch(batch_data)
+                epoch, first_batch = resume or (self._next_epoch_state(), 0)
+                resume = None
+                self._epoch_state = epoch
+                self._batch_pos = first_batch
+                index_list = epoch["index_list"]
+                batch_offsets = epoch["batch_offsets"]
+                for i in range(first_batch, len(batch_offsets)-1):
+                    self.batch_id = i
+                    self._batch_pos = i + 1
+                    batch_data = []
+                    for idx in index_list[batch_offsets[i]:batch_offsets[i+1]]:
+                        batch_data.append(self._get_sample(int(idx)))
+                    batch_data = self._collate_and_transform(batch_data)
                     batch_data = self.to_jittor(batch_data)
-                    self.batch_id += 1
                     yield batch_data
+                    if CHECK_MEMORY and self.batch_id % CHECK_MEMORY == 0:
+                        jt.display_memory_info()
 
 def DataLoader(dataset: Dataset, *args, **kargs):
     return dataset.set_attrs(*args, **kargs)
@@ -637,12 +1199,19 @@ class ImageFolder(Dataset):
         LOG.i(f"Found {len(self.classes)} classes and {len(self.imgs)} images.")
         self.set_attrs(total_len=len(self.imgs))
         
-    def __getitem__(self, k):
+    def load_sample(self, k):
         with open(self.imgs[k][0], 'rb') as f:
             img = Image.open(f).convert('RGB')
-            if self.transform:
-                img = self.transform(img)
-            return img, self.imgs[k][1]
+        return img, self.imgs[k][1]
+
+    def transform_sample(self, sample):
+        img, label = sample
+        if self.transform:
+            img = self.transform(img)
+        return img, label
+
+    def __getitem__(self, k):
+        return self.transform_sample(self.load_sample(k))
 
 class VarDataset(Dataset):
     """ Dataset using Var directly, TensorDataset is alias of VarDataset, Example::
@@ -686,4 +1255,192 @@ class VarDataset(Dataset):
                 x.assign(x.squeeze(-1))
         return b
 
-TensorDataset = VarDataset
\ No newline at end of file
+TensorDataset = VarDataset
+
+
+class IterableDataset(Dataset):
+    '''
+    Base class of streaming dataset, samples are yielded by stream()
+    instead of __getitem__, so neither total_len nor an index list is
+    needed, and unbounded streams can be loaded by workers.
+
+    The stream is sharded for every worker, there are num_workers shards.
+    If auto_shard is True, shard k takes every num_shards-th sample
+    starting from k. Otherwise stream() should only yield samples of its
+    own shard, by using self.shard_id and self.num_shards, e.g. reading
+    different files.
+
+    In MPI, every process reads the same shards and scatters each batch
+    like Dataset does, so all processes get the same number of batches,
+    which all-reduce in optimizer requires. Expensive decoding should be
+    done in transform_sample, which is only applied to samples of the
+    current process.
+
+    Attrs(besides attrs of Dataset):
+
+        * shuffle_buffer(int): buffer size of shuffle, samples are shuffled by buffer when shuffle is True, default(1024).
+        * auto_shard(bool): shard stream by skipping samples, default(True).
+
+    Example::
+
+        class LineDataset(IterableDataset):
+            def __init__(self, paths):
+                super().__init__()
+                self.paths = paths
+
+            def stream(self):
+                # shard by files
+                for path in self.paths[self.shard_id::self.num_shards]:
+                    with open(path) as f:
+                        for line in f:
+                            yield line.strip()
+
+        dataset = LineDataset(paths).set_attrs(batch_size=256, 
+            num_workers=4, shuffle=True, auto_shard=False)
+        for lines in dataset:
+            ......
+    '''
+    def __init__(self, shuffle_buffer=1024, auto_shard=True, **kw):
+        super().__init__(**kw)
+        self.shuffle_buffer = shuffle_buffer
+        self.auto_shard = auto_shard
+        self.shard_id = 0
+        self.num_shards = 1
+
+    def stream(self):
+        ''' Yield samples of dataset, should be overridden. '''
+        raise NotImplementedError
+
+    def __getitem__(self, index):
+        raise TypeError("IterableDataset does not support indexing")
+
+    def __len__(self):
+        raise TypeError("IterableDataset does not have length")
+
+    def state_dict(self):
+        ''' Only epoch id is saved, position of stream is not resumable. '''
+        return { "epoch_id": self.epoch_id }
+
+    def _next_epoch_state(self):
+        # each batch id of worker is a shard of the stream
+        n = max(self.num_workers, 1)
+        self.real_len = n
+        # number of batches is unknown
+        self.batch_len = None
+        return {
+            "index_list": np.arange(n, dtype="int32"),
+            "batch_offsets": np.arange(n+1),
+            # shuffle buffer of all MPI processes should be the same
+            "epoch_seed": int(self._shuffle_rng.integers(0, 2**31-1)),
+        }
+
+    def _batch_ids(self, epoch, first_batch):
+        # number of batches is unknown
+        return itertools.count()
+
+    def _recv_batches(self, batch_ids, stop=None):
+        # workers send None at the end of each shard, next epoch
+        # is not prefetched until all shards end
+        self._recv_start = time.time()
+        num_ended = 0
+        for i in batch_ids:
+            item = self._recv_batch(i, stop)
+            if item is None:
+                return
+            if item[0] is None:
+                num_ended += 1
+                if num_ended == self.num_batches.value:
+                    return
+                continue
+            yield item
+
+    def _shard_batches(self, shard, num_shards, epoch_seed):
+        ''' Yield list of samples of each batch in shard. '''
+        self.shard_id = shard
+        self.num_shards = num_shards
+        samples = self.stream()
+        if self.auto_shard and num_shards > 1:
+            samples = itertools.islice(samples, shard, None, num_shards)
+        if self.shuffle and self.shuffle_buffer > 1:
+            samples = buffered_shuffle(samples, self.shuffle_buffer,
+                np.random.default_rng((epoch_seed ^ (shard*1167)) ^ 1234))
+        def scatter(batch):
+            # scatter batch for all mpi process, same as Dataset
+            if jt.in_mpi:
+                world_size = mpi.world_size()
+                world_rank = mpi.world_rank()
+                real_batch_size = (len(batch)-1) // world_size + 1
+                l = real_batch_size * world_rank
+                r = min(l + real_batch_size, len(batch))
+                if l >= r: l = r-1
+                batch = batch[l:r]
+            return [ self.transform_sample(x) for x in batch ]
+        batch = []
+        for x in samples:
+            batch.append(x)
+            if len(batch) == self.batch_size:
+                yield scatter(batch)
+                batch = []
+        if len(batch) and not self.drop_last:
+            yield scatter(batch)
+
+    def _worker_loop(self, worker_id, buffer, status, slots):
+        gid_obj = self.gid.get_obj()
+        gid_lock = self.gid.get_lock()
+        ctrl_version = 0
+        def send(batch):
+            # main process receives batch by worker id
+            try:
+                with self.idqueue_lock:
+                    self.idqueue.push(worker_id)
+                    self.num_pushed.value += 1
+                buffer.send(batch)
+            except:
+                if buffer.is_stop() or self.idqueue.is_stop():
+                    return False
+                raise
+            return True
+        while True:
+            with gid_lock:
+                ctrl_version = self._wait_for_id(worker_id, buffer, ctrl_version)
+                shard = gid_obj.value
+                num_shards = self.num_batches.value
+                epoch_seed = self.epoch_seed.value
+                gid_obj.value += 1
+            start = time.time()
+            _set_batch_seed((epoch_seed ^ (shard*1167)) ^ 1234)
+            for batch in self._shard_batches(shard, num_shards, epoch_seed):
+                if buffer.is_stop() or self.idqueue.is_stop():
+                    # stopped buffer may still accept data
+                    break
+                now = time.time()
+                other_time = now - start
+                start = now
+                batch = self._pack_batch(batch, slots)
+                now = time.time()
+                data_time = now - start
+                start = now
+                if not send(batch):
+                    break
+                now = time.time()
+                send_time = now - start
+                start = now
+                self._set_status(status, other_time, data_time, send_time)
+            else:
+                # end of shard
+                send(None)
+
+    def __iter__(self):
+        if self._disable_workers:
+            self.num_workers = 0
+        if self.num_workers:
+            yield from super().__iter__()
+            return
+        for _ in self._epochs():
+            epoch = self._next_epoch_state()
+            for i, batch in enumerate(self._shard_batches(
+                0, 1, epoch["epoch_seed"])):
+                self.batch_id = i
+                self._batch_pos = i + 1
+                batch = self._collate_and_transform(batch)
+                yield self.to_jittor(batch)
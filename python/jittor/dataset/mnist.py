@@ -76,11 +76,18 @@ class MNIST(Dataset):
         # this function must be called
         self.set_attrs(total_len = self.total_len)
 
-    def __getitem__(self, index):
+    def load_sample(self, index):
         img = Image.fromarray(self.mnist['images'][index]).convert('RGB')
+        return img, self.mnist['labels'][index]
+
+    def transform_sample(self, sample):
+        img, label = sample
         if self.transform:
             img = self.transform(img)
-        return trans.to_tensor(img), self.mnist['labels'][index]
+        return trans.to_tensor(img), label
+
+    def __getitem__(self, index):
+        return self.transform_sample(self.load_sample(index))
 
     def download_url(self):
         '''
@@ -172,11 +179,18 @@ class EMNIST(Dataset):
         # this function must be called
         self.set_attrs(total_len = self.total_len)
 
-    def __getitem__(self, index):
+    def load_sample(self, index):
         img = Image.fromarray(self.mnist['images'][index]).convert('RGB')
+        return img, self.mnist['labels'][index]
+
+    def transform_sample(self, sample):
+        img, label = sample
         if self.transform:
             img = self.transform(img)
-        return trans.to_tensor(img), self.mnist['labels'][index]
+        return trans.to_tensor(img), label
+
+    def __getitem__(self, index):
+        return self.transform_sample(self.load_sample(index))
 
     def download_url(self):
         '''
@@ -0,0 +1,255 @@
+# ***************************************************************
+# Copyright (c) 2022 Jittor. All Rights Reserved. 
+# Maintainers: 
+#     Dun Liang <randonlang@gmail.com>. 
+# 
+# This file is subject to the terms and conditions defined in
+# file 'LICENSE.txt', which is part of this source code package.
+# ***************************************************************
+'''
+Packed record file format, each shard file is::
+
+    | magic(8B) | record 0 | record 1 | ... | offsets(int64 x n+1) | footer |
+
+footer is ``(index_offset:int64, num_records:int64, magic(8B))``, record k
+is stored in ``[offsets[k], offsets[k+1])``, and contains a pickled sample.
+Shards are read by mmap, random access of a record costs O(1) without
+opening any other file.
+'''
+import os
+import io
+import mmap
+import glob
+import pickle
+import numpy as np
+from PIL import Image
+from .dataset import Dataset, ImageFolder
+from jittor_utils import LOG
+
+MAGIC = b"JTREC001"
+FOOTER_SIZE = 8 + 8 + len(MAGIC)
+
+
+class RecordWriter:
+    '''
+    Write samples into packed record shards, a new shard is started
+    when current shard exceeds shard_size bytes.
+
+    Args::
+
+        [in] prefix(str): output prefix, shards are named as prefix-00000.jtrec, prefix-00001.jtrec, ...
+        [in] shard_size(int): max bytes of each shard, default(1GB).
+
+    Example::
+
+        from jittor.dataset import RecordWriter
+        with RecordWriter("/data/train") as w:
+            for img_path, label in samples:
+                with open(img_path, 'rb') as f:
+                    w.write((f.read(), label))
+    '''
+    def __init__(self, prefix, shard_size=1<<30):
+        self.prefix = prefix
+        self.shard_size = shard_size
+        self.paths = []
+        self.f = None
+        dirname = os.path.dirname(prefix)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+
+    def _open_shard(self):
+        path = f"{self.prefix}-{len(self.paths):05d}.jtrec"
+        self.paths.append(path)
+        self.f = open(path, "wb")
+        self.f.write(MAGIC)
+        self.offsets = [len(MAGIC)]
+
+    def _close_shard(self):
+        if self.f is None: return
+        index_offset = self.offsets[-1]
+        self.f.write(np.int64(self.offsets).tobytes())
+        self.f.write(np.int64([index_offset, len(self.offsets)-1]).tobytes())
+        self.f.write(MAGIC)
+        self.f.close()
+        self.f = None
+
+    def write_bytes(self, data):
+        ''' Write a raw record. '''
+        if self.f is None:
+            self._open_shard()
+        elif self.offsets[-1] + len(data) > self.shard_size and len(self.offsets) > 1:
+            self._close_shard()
+            self._open_shard()
+        self.f.write(data)
+        self.offsets.append(self.offsets[-1] + len(data))
+
+    def write(self, sample):
+        ''' Write a sample, sample is pickled. '''
+        self.write_bytes(pickle.dumps(sample, pickle.HIGHEST_PROTOCOL))
+
+    def close(self):
+        self._close_shard()
+        return self.paths
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_record_index(path):
+    ''' Return offsets of records in a shard, length is num_records+1. '''
+    with open(path, "rb") as f:
+        f.seek(-FOOTER_SIZE, os.SEEK_END)
+        footer = f.read(FOOTER_SIZE)
+        assert footer[16:] == MAGIC, f"{path} is not a record file"
+        index_offset, n = np.frombuffer(footer[:16], dtype="int64")
+        f.seek(index_offset)
+        return np.frombuffer(f.read(int(n+1)*8), dtype="int64")
+
+
+class RecordDataset(Dataset):
+    '''
+    Dataset reads samples from packed record shards written by RecordWriter.
+
+    Args::
+
+        [in] paths(str or list): shard paths, or prefix of shards.
+        [in] transform(callable): transform applied to each sample.
+        [in] shuffle_shards(bool or int): if true, shuffle shard order and shuffle samples inside each shard, rather than shuffle globally, if it is an int k, samples of every k interleaved shards are shuffled together, default(True).
+
+    Shard local shuffle reads shards sequentially, which is much faster than
+    global shuffle on disk, but a batch only contains samples of one shard
+    (or k shards). Samples should be written in random order, as
+    pack_image_folder does, otherwise a batch may only contain few classes,
+    which hurts batch norm and SGD. Larger k gives better randomness with
+    less locality.
+
+    Example::
+
+        from jittor.dataset import RecordDataset
+        dataset = RecordDataset("/data/train").set_attrs(batch_size=256, shuffle=True)
+        for data in dataset:
+            ......
+    '''
+    def __init__(self, paths, transform=None, shuffle_shards=True):
+        super().__init__()
+        if isinstance(paths, str):
+            paths = [paths] if os.path.isfile(paths) else \
+                sorted(glob.glob(paths+"-*.jtrec"))
+        assert len(paths), "No record file found"
+        self.paths = list(paths)
+        self.transform = transform
+        self.shuffle_shards = shuffle_shards
+        self.offsets = [ read_record_index(p) for p in self.paths ]
+        sizes = [ len(o)-1 for o in self.offsets ]
+        # global index -> (shard id, local index)
+        self.shard_start = np.cumsum([0]+sizes)
+        self.mmaps = None
+        LOG.i(f"Found {len(self.paths)} shards and {self.shard_start[-1]} records.")
+        self.set_attrs(total_len=int(self.shard_start[-1]))
+
+    def __getstate__(self):
+        # mmap cannot be pickled, reopen in subprocess
+        state = self.__dict__.copy()
+        state["mmaps"] = None
+        return state
+
+    def _open(self):
+        self.mmaps = []
+        for p in self.paths:
+            with open(p, "rb") as f:
+                self.mmaps.append(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def get_record(self, k):
+        ''' Return raw bytes of record k. '''
+        if self.mmaps is None:
+            self._open()
+        sid = int(np.searchsorted(self.shard_start, k, side="right")) - 1
+        k -= self.shard_start[sid]
+        offsets = self.offsets[sid]
+        return self.mmaps[sid][offsets[k]:offsets[k+1]]
+
+    def decode(self, record):
+        ''' Decode raw bytes into sample, override it for custom format. '''
+        return pickle.loads(record)
+
+    def load_sample(self, k):
+        return self.decode(self.get_record(k))
+
+    def transform_sample(self, sample):
+        if self.transform:
+            sample = self.transform(sample)
+        return sample
+
+    def __getitem__(self, k):
+        return self.transform_sample(self.load_sample(k))
+
+    def _get_shuffle_list(self):
+        if not self.shuffle_shards:
+            return super()._get_shuffle_list()
+        rng = self._shuffle_rng
+        k = int(self.shuffle_shards)
+        shards = rng.permutation(len(self.paths))
+        index_list = []
+        for i in range(0, len(shards), k):
+            group = [ np.arange(self.shard_start[sid], self.shard_start[sid+1])
+                for sid in shards[i:i+k] ]
+            index_list.append(rng.permutation(np.concatenate(group)))
+        return np.concatenate(index_list)
+
+
+class ImageRecordDataset(RecordDataset):
+    '''
+    Image classify dataset reads (image bytes, label) records, which can be
+    packed from an ImageFolder by pack_image_folder.
+
+    Example::
+
+        from jittor.dataset.record import pack_image_folder, ImageRecordDataset
+        pack_image_folder("./data/train", "./data/train_rec/train")
+        dataset = ImageRecordDataset("./data/train_rec/train", transform=transform)
+        for imgs, labels in dataset:
+            ......
+    '''
+    def load_sample(self, k):
+        img_bytes, label = self.decode(self.get_record(k))
+        img = Image.open(io.BytesIO(img_bytes)).convert('RGB')
+        return img, label
+
+    def transform_sample(self, sample):
+        img, label = sample
+        if self.transform:
+            img = self.transform(img)
+        return img, label
+
+
+def pack_image_folder(root, prefix, shard_size=1<<30, shuffle=True, seed=0):
+    ''' Pack images of ImageFolder(root) into record shards, return shard
+    paths. Images are written in random order if shuffle is true, so that
+    each shard contains all classes for shard local shuffle. '''
+    folder = ImageFolder(root)
+    imgs = folder.imgs
+    if shuffle:
+        order = np.random.default_rng(seed).permutation(len(imgs))
+        imgs = [ imgs[i] for i in order ]
+    with RecordWriter(prefix, shard_size) as w:
+        for path, label in imgs:
+            with open(path, 'rb') as f:
+                w.write((f.read(), label))
+    return w.paths
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Pack an image folder into jittor record shards.")
+    parser.add_argument("root", help="image folder root, root/label/img.jpg")
+    parser.add_argument("prefix", help="output prefix of shards")
+    parser.add_argument("--shard_size", type=int, default=1<<30, help="max bytes of each shard")
+    parser.add_argument("--no_shuffle", action="store_true", help="write images in folder order")
+    parser.add_argument("--seed", type=int, default=0, help="seed of image order")
+    args = parser.parse_args()
+    paths = pack_image_folder(args.root, args.prefix, args.shard_size,
+        not args.no_shuffle, args.seed)
+    LOG.i(f"Write {len(paths)} shards: {paths}")
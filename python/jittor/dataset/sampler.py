@@ -58,9 +58,12 @@ class RandomSampler(Sampler):
 
     def __iter__(self):
         n = self.dataset.__real_len__()
+        # rng of dataset is saved by dataset.state_dict,
+        # and consistent among mpi processes
+        rng = self.dataset._shuffle_rng
         if self.rep:
-            return iter(np.random.randint(low=0, high=n, size=(self.num_samples,), dtype=np.int64).tolist())
-        return iter(np.random.permutation(n).tolist())
+            return iter(rng.integers(low=0, high=n, size=(self.num_samples,), dtype=np.int64).tolist())
+        return iter(rng.permutation(n).tolist())
 
 
 class SubsetRandomSampler(Sampler):
@@ -81,14 +84,30 @@ class SubsetRandomSampler(Sampler):
         assert indice[0] >= 0 and indice[1] < dataset.__real_len__() and indice[0] < indice[1]
 
     def __iter__(self):
-        return (int(i) + self.indices[0] for i in np.random.permutation(self.indices[1] - self.indices[0]))
+        rng = self.dataset._shuffle_rng
+        return (int(i) + self.indices[0] for i in rng.permutation(self.indices[1] - self.indices[0]))
 
     def __len__(self):
         return self.indices[1] - self.indices[0]
 
 
 class BatchSampler(Sampler):
+    '''
+    Wraps another sampler to yield a list of indexes of each batch,
+    batches are loaded by dataset workers as they are, so
+    batch sampler can yield batches with different sizes.
+
+    Example::
+
+        dataset = YourDataset().set_attrs(num_workers=4)
+        BatchSampler(RandomSampler(dataset), 32, drop_last=False)
+        for batch in dataset:
+            ......
+    '''
     def __init__(self, sampler, batch_size, drop_last):
+        # MUST set sampler here
+        if hasattr(sampler, "dataset"):
+            sampler.dataset.sampler = self
         self.sampler = sampler
         self.batch_size = batch_size
         self.drop_last = drop_last
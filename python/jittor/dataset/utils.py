@@ -13,6 +13,9 @@ import numpy as np
 from collections.abc import Sequence, Mapping
 from PIL import Image
 import time
+import ctypes
+import multiprocessing as mp
+import pickle
 
 def get_random_list(n):
     return list(np.random.permutation(range(n)))
@@ -20,9 +23,40 @@ def get_random_list(n):
 def get_order_list(n):
     return [i for i in range(n)]
 
+def buffered_shuffle(samples, size, rng):
+    ''' Shuffle a stream of samples approximately by a buffer of given
+    size, each sample is swapped out by a random sample in buffer. '''
+    buf = []
+    for x in samples:
+        if len(buf) < size:
+            buf.append(x)
+            continue
+        i = rng.integers(size)
+        buf[i], x = x, buf[i]
+        yield x
+    for i in rng.permutation(len(buf)):
+        yield buf[i]
 
-def collate_batch(batch):
-    r"""Puts each data field into a tensor with outer dimension batch size"""
+
+def _stack_to(arrays, alloc):
+    # stack arrays into buffer provided by alloc if possible,
+    # alloc return None when buffer is not enough.
+    out = None
+    if alloc is not None:
+        elem = arrays[0]
+        out = alloc((len(arrays),)+elem.shape, elem.dtype)
+    return np.stack(arrays, 0, out=out)
+
+def collate_batch(batch, alloc=None):
+    r"""Puts each data field into a tensor with outer dimension batch size
+
+    Args::
+
+        [in] batch(list): list of samples.
+        [in] alloc(callable): optional, alloc(shape, dtype) returns a
+            numpy array used as the output of stacked numpy arrays,
+            or None if no buffer is available.
+    """
     real_size = len(batch)
     elem = batch[0]
     elem_type = type(elem)
@@ -30,7 +64,7 @@ def collate_batch(batch):
         temp_data = jt.stack([data for data in batch], 0)
         return temp_data
     if elem_type is np.ndarray:
-        temp_data = np.stack([data for data in batch], 0)
+        temp_data = _stack_to(batch, alloc)
         return temp_data
     elif np.issubdtype(elem_type, np.integer):
         return np.int32(batch)
@@ -41,15 +75,15 @@ def collate_batch(batch):
     elif isinstance(elem, str):
         return batch
     elif isinstance(elem, Mapping):
-        return {key: collate_batch([d[key] for d in batch]) for key in elem}
+        return {key: collate_batch([d[key] for d in batch], alloc) for key in elem}
     elif isinstance(elem, tuple):
         transposed = zip(*batch)
-        return tuple(collate_batch(samples) for samples in transposed)
+        return tuple(collate_batch(samples, alloc) for samples in transposed)
     elif isinstance(elem, Sequence):
         transposed = zip(*batch)
-        return [collate_batch(samples) for samples in transposed]
+        return [collate_batch(samples, alloc) for samples in transposed]
     elif isinstance(elem, Image.Image):
-        temp_data = np.stack([np.array(data) for data in batch], 0)
+        temp_data = _stack_to([np.array(data) for data in batch], alloc)
         return temp_data
     else:
         raise TypeError(f"Not support type <{elem_type.__name__}>")
@@ -66,3 +100,289 @@ class HookTimer:
         self.duration += time.time() - start
         return rt
 
+
+
+class SlotArray:
+    ''' Descriptor of a numpy array stored in SharedSlots. '''
+    __slots__ = ["offset", "shape", "dtype"]
+    def __init__(self, offset, shape, dtype):
+        self.offset = offset
+        self.shape = shape
+        self.dtype = dtype
+
+    def __reduce__(self):
+        return (SlotArray, (self.offset, self.shape, self.dtype))
+
+
+class SharedSlots:
+    '''
+    Fixed number of preallocated shared memory slots, used by dataset
+    worker to collate numpy arrays directly into memory which main process
+    can read without copying. Only the array descriptors are sent through
+    ring buffer.
+
+    Slots are used in round robin order, worker acquires a slot by begin(),
+    collates batch into it by alloc(), and main process gives it back by
+    release() in the same order as batches are received.
+
+    Args::
+
+        [in] size(int): total size of all slots in bytes.
+        [in] num_slots(int): number of slots.
+    '''
+    align = 64
+
+    def __init__(self, size, num_slots):
+        assert num_slots > 0
+        self.num_slots = num_slots
+        self.slot_size = size // num_slots // self.align * self.align
+        assert self.slot_size > 0, f"Slot size too small: {size}/{num_slots}"
+        self.raw = mp.RawArray(ctypes.c_uint8, self.slot_size * num_slots)
+        # number of slots acquired by worker and released by main process
+        self.head = mp.RawValue(ctypes.c_longlong, 0)
+        self.tail = mp.RawValue(ctypes.c_longlong, 0)
+        self.cv = mp.Condition()
+        self.used = 0
+        self.slot_id = -1
+
+    @property
+    def buffer(self):
+        if not hasattr(self, "_buffer"):
+            self._buffer = np.frombuffer(self.raw, dtype=np.uint8)
+        return self._buffer
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("_buffer", None)
+        return state
+
+    def __repr__(self):
+        return f"Slots(used={self.head.value-self.tail.value}/{self.num_slots} size={self.slot_size})"
+
+    def begin(self):
+        ''' Wait for a free slot and start a new batch in it (worker side). '''
+        with self.cv:
+            while self.head.value - self.tail.value >= self.num_slots:
+                self.cv.wait()
+            self.slot_id = self.head.value % self.num_slots
+            self.head.value += 1
+        self.used = 0
+
+    def alloc(self, shape, dtype):
+        ''' Allocate an array in current slot, return None if slot is full. '''
+        if self.slot_id < 0:
+            return None
+        dtype = np.dtype(dtype)
+        if dtype.hasobject:
+            return None
+        size = int(np.prod(shape)) * dtype.itemsize
+        if self.used + size > self.slot_size:
+            return None
+        offset = self.slot_id * self.slot_size + self.used
+        self.used += (size + self.align - 1) // self.align * self.align
+        return np.ndarray(shape, dtype, buffer=self.buffer, offset=offset)
+
+    def _offset_of(self, arr):
+        base = self.buffer.ctypes.data
+        ptr = arr.ctypes.data
+        if arr.flags.c_contiguous and base <= ptr < base + self.buffer.nbytes:
+            return ptr - base
+        return -1
+
+    def pack(self, batch):
+        ''' Replace numpy arrays in batch by SlotArray descriptors (worker side),
+        arrays not in current slot are copied into it if possible. '''
+        if type(batch) is np.ndarray:
+            offset = self._offset_of(batch)
+            if offset < 0:
+                out = self.alloc(batch.shape, batch.dtype)
+                if out is None:
+                    return batch
+                out[...] = batch
+                offset = self._offset_of(out)
+            return SlotArray(offset, batch.shape, batch.dtype.str)
+        if type(batch) in (list, tuple):
+            return type(batch)(self.pack(b) for b in batch)
+        if type(batch) is dict:
+            return {k:self.pack(v) for k,v in batch.items()}
+        return batch
+
+    def end(self):
+        self.slot_id = -1
+
+    def unpack(self, batch, copy=False):
+        ''' Replace SlotArray descriptors by numpy views of slot memory
+        (main process side), views are valid until the slot is released,
+        if copy is True, arrays are copied out of slot. '''
+        if type(batch) is SlotArray:
+            arr = np.ndarray(batch.shape, batch.dtype, 
+                buffer=self.buffer, offset=batch.offset)
+            return arr.copy() if copy else arr
+        if type(batch) in (list, tuple):
+            return type(batch)(self.unpack(b, copy) for b in batch)
+        if type(batch) is dict:
+            return {k:self.unpack(v, copy) for k,v in batch.items()}
+        return batch
+
+    def release(self):
+        ''' Give back the oldest slot (main process side). '''
+        with self.cv:
+            self.tail.value += 1
+            self.cv.notify()
+
+    def stop(self):
+        ''' Release all slots, wake up waiting worker. '''
+        with self.cv:
+            self.tail.value = self.head.value
+            self.cv.notify_all()
+
+    def clear(self):
+        with self.cv:
+            self.head.value = self.tail.value = 0
+
+
+class SampleCache:
+    '''
+    Cache of decoded samples in shared memory, shared by main process and
+    all dataset workers. Samples are pickled into a circular arena, each
+    record has a 16 bytes header (record size, sample index). Records are
+    evicted by clock algorithm: the allocation hand moves forward and
+    overwrites old records, records which are hit since the hand passed
+    them last time get a second chance.
+
+    Args::
+
+        [in] size(int): size of arena in bytes.
+        [in] num_samples(int): number of samples of dataset.
+        [in] path(str): optional, back the arena by a memory mapped file
+            instead of anonymous shared memory, so cache larger than
+            memory is paged out to local disk.
+    '''
+    align = 16
+
+    def __init__(self, size, num_samples, path=None):
+        self.size = size // self.align * self.align
+        assert self.size > 0, f"Cache size too small: {size}"
+        self.num_samples = num_samples
+        self.path = path
+        if path is None:
+            self.raw = mp.RawArray(ctypes.c_uint8, self.size)
+        else:
+            self.raw = None
+            with open(path, "wb") as f:
+                f.truncate(self.size)
+        # offset of record of each sample, -1 if not cached
+        self.offsets = mp.RawArray(ctypes.c_longlong, num_samples)
+        self.offsets_numpy[:] = -1
+        # sample hit after the hand passed it
+        self.refs = mp.RawArray(ctypes.c_uint8, num_samples)
+        # allocation hand, and end of records written
+        self.head = mp.RawValue(ctypes.c_longlong, 0)
+        self.tail = mp.RawValue(ctypes.c_longlong, 0)
+        self.hits = mp.RawValue(ctypes.c_longlong, 0)
+        self.misses = mp.RawValue(ctypes.c_longlong, 0)
+        self.lock = mp.Lock()
+
+    @property
+    def offsets_numpy(self):
+        return np.frombuffer(self.offsets, dtype=np.int64)
+
+    @property
+    def buffer(self):
+        if not hasattr(self, "_buffer"):
+            if self.path is None:
+                self._buffer = np.frombuffer(self.raw, dtype=np.uint8)
+            else:
+                # each process maps the file lazily
+                self._buffer = np.memmap(self.path, dtype=np.uint8, mode="r+")
+            self._words = self._buffer.view(np.int64)
+        return self._buffer
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("_buffer", None)
+        state.pop("_words", None)
+        return state
+
+    def __repr__(self):
+        return f"SampleCache(size={self.size} used={self.tail.value} hits={self.hits.value} misses={self.misses.value})"
+
+    def get(self, idx):
+        ''' Return (True, sample) if sample idx is cached, else (False, None). '''
+        buffer = self.buffer
+        with self.lock:
+            offset = self.offsets[idx]
+            if offset < 0:
+                self.misses.value += 1
+                return False, None
+            self.hits.value += 1
+            self.refs[idx] = 1
+            size = self._words[offset//8]
+            data = buffer[offset+self.align:offset+size].tobytes()
+        return True, pickle.loads(data)
+
+    def put(self, idx, sample):
+        ''' Cache sample idx, return False if it is too large. '''
+        try:
+            data = pickle.dumps(sample, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            # sample cannot be cached
+            return False
+        need = (len(data) + 2*self.align - 1) // self.align * self.align
+        if need > self.size:
+            return False
+        buffer = self.buffer
+        with self.lock:
+            if self.offsets[idx] >= 0:
+                # cached by other worker
+                return True
+            offset = self._alloc(need)
+            if offset < 0:
+                return False
+            self._words[offset//8] = need
+            self._words[offset//8+1] = idx
+            buffer[offset+self.align:offset+self.align+len(data)] = \
+                np.frombuffer(data, dtype=np.uint8)
+            self.offsets[idx] = offset
+        return True
+
+    def _alloc(self, need):
+        # lock should be held, return offset of a free record
+        words = self._words
+        pos = self.head.value
+        tail = self.tail.value
+        # the hand passes at most twice of arena
+        scanned = 0
+        while scanned <= 2*self.size:
+            if pos + need > self.size:
+                # not enough space before end of arena, wrap around
+                scanned += self.size - pos
+                pos = 0
+                continue
+            # records in [pos, end) will be overwritten
+            end = pos
+            while end < pos + need and end < tail:
+                size, idx = words[end//8], words[end//8+1]
+                if idx >= 0 and self.refs[idx]:
+                    # second chance, skip this record
+                    self.refs[idx] = 0
+                    break
+                end += size
+            else:
+                # evict records
+                p = pos
+                while p < end:
+                    idx = words[p//8+1]
+                    if idx >= 0:
+                        self.offsets[idx] = -1
+                    p += words[p//8]
+                if end > pos + need:
+                    # remaining space becomes an empty record
+                    words[(pos+need)//8] = end - pos - need
+                    words[(pos+need)//8+1] = -1
+                self.tail.value = max(tail, pos + need)
+                self.head.value = pos + need
+                return pos
+            scanned += end + size - pos
+            pos = end + size
+        return -1
@@ -58,7 +58,7 @@ class VOC(Dataset):
             self.label_path.append(_label_path)
         self.set_attrs(total_len = len(self.image_path))
 
-    def __getitem__(self, index):
+    def load_sample(self, index):
         _img = Image.open(self.image_path[index])
         _label = Image.open(self.label_path[index])
         _img = _img.resize((513, 513))
@@ -68,3 +68,6 @@ class VOC(Dataset):
         _img = _img.transpose(2,0,1)
         return _img, _label
 
+    def __getitem__(self, index):
+        return self.transform_sample(self.load_sample(index))
+
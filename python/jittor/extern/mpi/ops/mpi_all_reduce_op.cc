@@ -68,15 +68,34 @@ void MpiAllReduceOp::jit_prepare(JK& jk) {
 
 #else // JIT
 #ifdef JIT_cpu
+// mpi has no float16 type, sum float16 as 16 bits
+static void fp16_sum(void* in, void* inout, int* len, MPI_Datatype* dtype) {
+    auto* a = (float16*)in;
+    auto* b = (float16*)inout;
+    for (int i=0; i<*len; i++)
+        b[i] = float16(float32(a[i]) + float32(b[i]));
+}
+
+static MPI_Op get_fp16_sum() {
+    static MPI_Op op = [](){
+        MPI_Op op;
+        MPI_Op_create(fp16_sum, 1, &op);
+        return op;
+    }();
+    return op;
+}
+
 void MpiAllReduceOp::jit_run() {
     @define(T_MPI,
         @if(@strcmp(@Tx,float)==0 || @strcmp(@Tx,float32)==0, MPI_FLOAT)
         @if(@strcmp(@Tx,int)==0 || @strcmp(@Tx,int32)==0, MPI_INT)
         @if(@strcmp(@Tx,float64)==0 || @strcmp(@Tx,double)==0, MPI_DOUBLE)
         @if(@strcmp(@Tx,int64)==0, MPI_DOUBLE_INT)
+        @if(@strcmp(@Tx,float16)==0, MPI_UINT16_T)
     )
     @define(OP_MPI,
-        @if(@strcmp(@OP,add)==0, MPI_SUM)
+        @if(@strcmp(@Tx,float16)==0, get_fp16_sum(),
+        @if(@strcmp(@OP,add)==0, MPI_SUM))
     )
     auto* __restrict__ xp = x->ptr<Tx>();
     auto* __restrict__ yp = y->ptr<Tx>();
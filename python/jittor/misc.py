@@ -2106,3 +2106,44 @@ def multinomial(weights: jt.Var, num_samples: int, replacement: bool=False) -> j
         return indices
 
 
+def bucket_size(n: int, buckets=None) -> int:
+    ''' Returns the smallest bucket not less than n, buckets are powers of 2 by default. Sizes larger than all buckets are not changed.
+
+    :param n: the size.
+    :param buckets: sorted list of bucket sizes.
+
+    Example::
+
+        assert jt.bucket_size(5) == 8
+        assert jt.bucket_size(5, [4, 16, 64]) == 16
+    '''
+    if buckets is None:
+        return 1 << max(n-1, 0).bit_length()
+    for b in buckets:
+        if b >= n:
+            return b
+    return n
+
+def pad_to_bucket(x: jt.Var, dim: int=0, buckets=None, value=0) -> jt.Var:
+    ''' Pads dimension dim of x with value to the nearest bucket size, so inputs of variable length share a few shapes, and kernels compiled with shapes are reused. The padded part can be cropped from the output by slicing.
+
+    :param x: the input var.
+    :param dim: the dimension to pad.
+    :param buckets: sorted list of bucket sizes, powers of 2 by default.
+    :param value: the padding value.
+
+    Example::
+
+        x = jt.ones(5, 3)
+        y = jt.pad_to_bucket(x, 0)
+        assert y.shape == [8, 3]
+        out = model(y)[:5]
+    '''
+    if dim < 0: dim += x.ndim
+    n = x.shape[dim]
+    size = bucket_size(n, buckets)
+    if size == n:
+        return x
+    shape = list(x.shape)
+    shape[dim] = size
+    return x.reindex(shape, [ f"i{i}" for i in range(x.ndim) ], overflow_value=value)
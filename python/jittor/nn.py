@@ -2111,6 +2111,7 @@ class UpsamplingNearest2d(Upsample):
         Upsample.__init__(self, scale_factor, 'nearest')
 
 class Sequential(Module):
+    _checkpoint_every = None
     def __init__(self, *args):
         self.layers = collections.OrderedDict()
         for mod in args:
@@ -2136,9 +2137,35 @@ class Sequential(Module):
     def items(self):
         return self.layers.items()
     def execute(self, x):
+        if self._checkpoint_every:
+            layers = list(self.layers.values())
+            every = self._checkpoint_every
+            for i in range(0, len(layers), every):
+                seg = layers[i:i+every]
+                params = [ p for m in seg if isinstance(m, Module)
+                    for p in m.parameters() ]
+                x = jt.checkpoint(lambda x, seg=seg: self._run(seg, x), x, params=params)
+            return x
         for k, layer in self.layers.items():
             x = layer(x)
         return x
+    def _run(self, layers, x):
+        for layer in layers:
+            x = layer(x)
+        return x
+    def checkpoint(self, enable=True, every=None):
+        ''' Recomputes intermediates in backward instead of keeping them,
+        see jt.checkpoint. If every is set, every segment of every layers
+        is checkpointed, otherwise the whole Sequential is one segment.
+
+        Example::
+
+            seq = nn.Sequential(*blocks).checkpoint(every=2)
+        '''
+        if every is None:
+            return super().checkpoint(enable)
+        self._checkpoint_every = every if enable else None
+        return self
     def dfs(self, parents, k, callback, callback_leave):
         n_children = len(self.layers)
         ret = callback(parents, k, self, n_children)
@@ -17,15 +17,42 @@ import numpy as np
 class Optimizer(object):
     """ Basic class of Optimizer.
 
+    SGD, RMSprop, Adam and AdamW support flatten mode(flatten=True),
+    states of params with the same dtype in a param group are stored in
+    one flat buffer, and params are updated by one fused kernel of each
+    dtype instead of several ops for each param, which reduces kernel
+    launch and graph building time of models with many small params.
+    In flatten mode, pg["values"] and pg["m"] hold the flat buffers,
+    states of params which stop grad are still updated by their grads.
+
+    In mpi, grads are all reduced in buckets of at most bucket_size_mb
+    MB(default 25), grads in a bucket are flattened and reduced by one
+    mpi call, set optimizer.bucket_size_mb = 0 to reduce each grad
+    separately. Set optimizer.comm_hook to reduce grads by a compression
+    hook, such as FP16CompressHook, TopKCompressHook or PowerSGDHook.
+
+    Hyper parameters such as lr and betas, and the step count, are read
+    by update kernels from small device Vars, so lr schedulers which
+    change pg["lr"] every step never recompile the update kernels.
+
     Example::
 
         optimizer = nn.SGD(model.parameters(), lr)
         optimizer.step(loss)
+
+        optimizer = nn.Adam(model.parameters(), lr, flatten=True)
+        optimizer.step(loss)
+
+        optimizer = nn.SGD(model.parameters(), lr)
+        optimizer.comm_hook = nn.PowerSGDHook(rank=4)
+        optimizer.step(loss)
     """
-    def __init__(self, params, lr, param_sync_iter=10000):
+    def __init__(self, params, lr, param_sync_iter=10000, bucket_size_mb=25):
         self.param_groups = []
         self.lr = lr
         self.param_sync_iter = param_sync_iter
+        # size of buckets of grads all reduced together in mpi
+        self.bucket_size_mb = bucket_size_mb
 
         assert len(params) > 0, "Length of parameters should not be zero"
         if not isinstance(params[0], dict):
@@ -38,17 +65,117 @@ class Optimizer(object):
         # so we can omit 0+x
         self.__zero_grad = True
         self._grad_map = {}
+        self.flatten = False
+        self._flat_layouts = {}
+        # scale of grads applied in step by fused clip_grad_norm
+        self._grad_scale = None
+        # device Vars of hyper parameters and n_step, see _hyper
+        self._hyper_vars = {}
+        self._n_step = None
+        # reduces grads of each bucket across mpi ranks
+        self.comm_hook = CommHook()
 
     def add_param_group(self, group):
         self.param_groups.append(group)
 
-    def clip_grad_norm(self, max_norm:float, norm_type:int=2):
+    def _flat_layout(self, pg):
+        ''' Group params of param group by dtype for flatten mode, return
+        list of (dtype, param indexes, offsets), j-th param of a dtype is
+        flat[offsets[j]:offsets[j+1]] of its flat buffer. '''
+        layout = self._flat_layouts.get(id(pg))
+        if layout is None:
+            buckets = {}
+            for i, p in enumerate(pg["params"]):
+                buckets.setdefault(str(p.dtype), []).append(i)
+            layout = []
+            for dtype, ids in buckets.items():
+                sizes = [ int(np.prod(pg["params"][i].shape)) for i in ids ]
+                layout.append((dtype, ids, np.cumsum([0]+sizes).tolist()))
+            self._flat_layouts[id(pg)] = layout
+        return layout
+
+    def _zero_states(self, pg):
+        ''' Create zero states of params of param group, such as momentum,
+        in flatten mode, one flat buffer is created for each dtype. '''
+        if self.flatten:
+            return [ jt.zeros((offsets[-1],), dtype).stop_grad()
+                for dtype, ids, offsets in self._flat_layout(pg) ]
+        return [ jt.zeros(p.shape, p.dtype).stop_grad() for p in pg["params"] ]
+
+    def _flat_params(self, pg):
+        ''' Yield flat params and grads of each dtype of param group,
+        in the same order as states created by _zero_states. '''
+        def flat(vs):
+            if len(vs) == 1:
+                return vs[0].flatten()
+            return jt.concat([ v.flatten() for v in vs ])
+        grads = self._step_grads(pg)
+        for dtype, ids, offsets in self._flat_layout(pg):
+            yield flat([ pg["params"][i] for i in ids ]), \
+                  flat([ grads[i] for i in ids ])
+
+    def _flat_update(self, pg, k, p):
+        ''' Update params of k-th dtype of param group by flat params. '''
+        # compute the whole flat buffer by one kernel
+        p.stop_fuse()
+        dtype, ids, offsets = self._flat_layout(pg)[k]
+        params = pg["params"]
+        for j, i in enumerate(ids):
+            if params[i].is_stop_grad(): continue
+            params[i].update(p[offsets[j]:offsets[j+1]].reshape(params[i].shape))
+
+    def _step_grads(self, pg):
+        ''' Grads of param group used by step, grads are scaled lazily
+        if clip_grad_norm is fused, so the scale is fused into the update
+        kernel. '''
+        if self._grad_scale is None:
+            return pg["grads"]
+        return [ g * self._grad_scale for g in pg["grads"] ]
+
+    def _hyper(self, pg, *names):
+        ''' Hyper parameters of param group, such as lr, as scalar Vars
+        read from one small device Var, tuples such as betas are
+        flattened. The device Var is rewritten only when values are
+        changed, e.g. by a lr scheduler, and values are inputs of update
+        kernels instead of constants, so changing them never recompiles
+        kernels. '''
+        values = []
+        for name in names:
+            v = pg.get(name, getattr(self, name))
+            values.extend(v if isinstance(v, (tuple, list)) else [v])
+        values = [ float(v) for v in values ]
+        key = (id(pg), names)
+        cached = self._hyper_vars.get(key)
+        if cached is None or cached[0] != values:
+            # a var of shape [1] is fused as a constant, keep at least 2
+            var = jt.array(np.array(values + [0.0], "float32")).stop_grad()
+            cached = self._hyper_vars[key] = (values, var)
+        var = cached[1]
+        return [ var[i] for i in range(len(values)) ]
+
+    def _step_var(self):
+        ''' n_step as a device Var, which is increased on device. '''
+        if self._n_step is not None and self._n_step[0] == self.n_step:
+            return self._n_step[1]
+        if self._n_step is not None and self._n_step[0] + 1 == self.n_step:
+            var = self._n_step[1] + 1
+        else:
+            var = jt.array(np.array([self.n_step, 0], "float32"))[:1]
+        self._n_step = (self.n_step, var.stop_grad())
+        return self._n_step[1]
+
+    def clip_grad_norm(self, max_norm:float, norm_type:int=2, fused:bool=False):
         r"""Clips gradient norm of this optimizer.
-        The norm is computed over all gradients together.
+        The norm is computed over all gradients together, by reducing
+        norms of each gradient, without concatenating them.
 
         Args:
             max_norm (float or int): max norm of the gradients
-            norm_type (int): 1-norm or 2-norm
+            norm_type (int): 1-norm, 2-norm, p-norm or float("inf")
+            fused (bool): if True, gradients are not scaled in place, the
+                scale is applied inside the update kernel of the next
+                step, which saves a pass over all gradients. Gradients
+                read before step, such as by opt_grad, are not clipped.
 
         Example::
 
@@ -67,20 +194,38 @@ class Optimizer(object):
 
         """
         if self.__zero_grad: return
-        grads = []
+        norms = []
         for pg in self.param_groups:
             for p, g in zip(pg["params"], pg["grads"]):
                 if p.is_stop_grad(): continue
-                grads.append(g.flatten())
-        if len(grads) == 0: return
-        total_norm = jt.norm(jt.concat(grads), norm_type)
+                if norm_type == float("inf"):
+                    norms.append(g.abs().max())
+                elif norm_type == 1:
+                    norms.append(g.abs().sum())
+                elif norm_type == 2:
+                    norms.append(g.sqr().sum())
+                else:
+                    norms.append(g.abs().pow(norm_type).sum())
+        if len(norms) == 0: return
+        total_norm = norms[0]
+        for n in norms[1:]:
+            if norm_type == float("inf"):
+                total_norm = jt.maximum(total_norm, n)
+            else:
+                total_norm = total_norm + n
+        if norm_type != float("inf") and norm_type != 1:
+            total_norm = total_norm.pow(1.0 / norm_type)
         clip_coef = jt.minimum(max_norm / (total_norm + 1e-6), 1.0)
+        if fused:
+            if self._grad_scale is not None:
+                clip_coef = clip_coef * self._grad_scale
+            self._grad_scale = clip_coef
+            return
         for pg in self.param_groups:
             for p, g in zip(pg["params"], pg["grads"]):
                 if p.is_stop_grad(): continue
                 g.update(g*clip_coef)
 
-    
     @property
     def defaults(self):
         import copy
@@ -123,6 +268,7 @@ class Optimizer(object):
 
     def zero_grad(self):
         self.__zero_grad = True
+        self._grad_scale = None
 
     def backward(self, loss, retain_graph=False):
         '''
@@ -174,19 +320,20 @@ class Optimizer(object):
 
         # sync grads and model if in mpi
         if jt.in_mpi:
-            dep = []
-            def add_dep(v):
-                nonlocal dep
-                v._add_dependency(dep)
-                dep = [v]
-
-            for g in grads:
-                g.assign(g.mpi_all_reduce("mean"))
-                add_dep(g._input(0))
+            hook = self.comm_hook
+            hook.dep = []
+            if self.bucket_size_mb:
+                buckets = self._grad_buckets(grads)
+            else:
+                buckets = [ [i] for i in range(len(grads)) ]
+            for ids in buckets:
+                reduced = hook([ grads[i] for i in ids ], tuple(ids))
+                for i, g in zip(ids, reduced):
+                    grads[i] = g
             if self.n_step % self.param_sync_iter == 0:
                 for p in params:
                     p.assign(p.mpi_broadcast())
-                    add_dep(p)
+                    hook.add_dep(p)
         self.n_step += 1
 
         # set up grads in param_groups
@@ -205,6 +352,26 @@ class Optimizer(object):
                     pid += 1
         self.__zero_grad = False
         
+    def _grad_buckets(self, grads):
+        ''' Split grads into buckets of the same dtype and at most
+        bucket_size_mb, in reversed order, because grads of last layers
+        are computed first in backward. Return list of grad indexes. '''
+        limit = self.bucket_size_mb * 1024 * 1024
+        buckets = []
+        # dtype -> (grad indexes, bytes) of the filling bucket
+        filling = {}
+        for i in reversed(range(len(grads))):
+            g = grads[i]
+            dtype = str(g.dtype)
+            nbytes = int(np.prod(g.shape)) * np.dtype(dtype).itemsize
+            if dtype not in filling or filling[dtype][1] + nbytes > limit:
+                filling[dtype] = ([], 0)
+                buckets.append(filling[dtype][0])
+            ids, size = filling[dtype]
+            ids.append(i)
+            filling[dtype] = (ids, size + nbytes)
+        return buckets
+
     def pre_step(self, loss, retain_graph=False):
         """ something should be done before step, such as calc gradients, mpi sync, and so on.
 
@@ -238,8 +405,8 @@ class Optimizer(object):
     def step(self, loss=None, retain_graph=False):
         self.pre_step(loss, retain_graph)
         for pg in self.param_groups:
-            lr = pg.get("lr", self.lr)
-            for p, g in zip(pg["params"], pg["grads"]):
+            lr, = self._hyper(pg, "lr")
+            for p, g in zip(pg["params"], self._step_grads(pg)):
                 if p.is_stop_grad(): continue
                 p.update(p - g * lr)
         self.post_step()
@@ -282,23 +449,20 @@ class SGD(Optimizer):
         optimizer = nn.SGD(model.parameters(), lr, momentum=0.9)
         optimizer.step(loss)
     """
-    def __init__(self, params, lr, momentum=0, weight_decay=0, dampening=0, nesterov=False):
+    def __init__(self, params, lr, momentum=0, weight_decay=0, dampening=0, nesterov=False, flatten=False):
         super().__init__(params, lr)
         self.momentum = momentum
         self.weight_decay = weight_decay
         self.dampening = dampening
         self.nesterov = nesterov
+        self.flatten = flatten
 
         # initialize required arguments
         for pg in self.param_groups:
-            values = pg["values"] = []
-            for p in pg["params"]:
-                values.append(jt.zeros(p.shape, p.dtype).stop_grad())
+            pg["values"] = self._zero_states(pg)
 
     def add_param_group(self, group):
-        values = group["values"] = []
-        for p in group["params"]:
-            values.append(jt.zeros(p.shape, p.dtype).stop_grad())
+        group["values"] = self._zero_states(group)
         self.param_groups.append(group)
 
     def step(self, loss=None, retain_graph=False):
@@ -306,14 +470,22 @@ class SGD(Optimizer):
         jt.flags.node_order = 1
         for pg in self.param_groups:
             # get arguments from each param_groups
-            lr = pg.get("lr", self.lr)
-            momentum = pg.get("momentum", self.momentum)
-            weight_decay = pg.get("weight_decay", self.weight_decay)
-            dampening = pg.get("dampening", self.dampening)
+            lr, momentum, weight_decay, dampening = self._hyper(pg,
+                "lr", "momentum", "weight_decay", "dampening")
             nesterov = pg.get("nesterov", self.nesterov)
 
             # optimize main body
-            for p, g, v in zip(pg["params"], pg["grads"], pg["values"]):
+            if self.flatten:
+                for k, (p, g) in enumerate(self._flat_params(pg)):
+                    v = pg["values"][k]
+                    dp = p * weight_decay + g
+                    v.update(momentum * v + dp * (1 - dampening))
+                    if nesterov:
+                        self._flat_update(pg, k, p - (dp + momentum * v) * lr)
+                    else:
+                        self._flat_update(pg, k, p - v * lr)
+                continue
+            for p, g, v in zip(pg["params"], self._step_grads(pg), pg["values"]):
                 if p.is_stop_grad(): continue
                 dp = p * weight_decay + g
                 v.update(momentum * v + dp * (1 - dampening))
@@ -335,31 +507,32 @@ class RMSprop(Optimizer):
         optimizer = nn.RMSprop(model.parameters(), lr)
         optimizer.step(loss)
     """
-    def __init__(self, params, lr=1e-2, eps=1e-8, alpha=0.99):
+    def __init__(self, params, lr=1e-2, eps=1e-8, alpha=0.99, flatten=False):
         super().__init__(params, lr)
         self.eps = eps
         self.alpha = alpha
+        self.flatten = flatten
         
         # initialize required arguments for each param_groups
         for pg in self.param_groups:
-            values = pg["values"] = []
-            for p in pg["params"]:
-                values.append(jt.zeros(p.shape, p.dtype).stop_grad())
+            pg["values"] = self._zero_states(pg)
 
     def add_param_group(self, group):
-        values = group["values"] = []
-        for p in group["params"]:
-            values.append(jt.zeros(p.shape, p.dtype).stop_grad())
+        group["values"] = self._zero_states(group)
         self.param_groups.append(group)
 
     def step(self, loss=None, retain_graph=False):
         self.pre_step(loss, retain_graph)
         for pg in self.param_groups:
             # get arguments from each param_groups
-            lr = pg.get("lr", self.lr)
-            eps = pg.get("eps", self.eps)
-            alpha = pg.get("alpha", self.alpha)
-            for p, g, v in zip(pg["params"], pg["grads"], pg["values"]):
+            lr, eps, alpha = self._hyper(pg, "lr", "eps", "alpha")
+            if self.flatten:
+                for k, (p, g) in enumerate(self._flat_params(pg)):
+                    v = pg["values"][k]
+                    v.update(alpha * v + (1-alpha) * g * g)
+                    self._flat_update(pg, k, p - lr * g / (jt.sqrt(v) + eps))
+                continue
+            for p, g, v in zip(pg["params"], self._step_grads(pg), pg["values"]):
                 if p.is_stop_grad(): continue
                 v.update(alpha * v + (1-alpha) * g * g)
                 p.update(p - lr * g / (jt.sqrt(v) + eps))
@@ -373,45 +546,46 @@ class Adam(Optimizer):
         optimizer = nn.Adam(model.parameters(), lr, eps=1e-8, betas=(0.9, 0.999))
         optimizer.step(loss)
     """
-    def __init__(self, params, lr, eps=1e-8, betas=(0.9, 0.999), weight_decay=0):
+    def __init__(self, params, lr, eps=1e-8, betas=(0.9, 0.999), weight_decay=0, flatten=False):
         super().__init__(params, lr)
         self.eps = eps
         self.betas = betas
         self.weight_decay = weight_decay
+        self.flatten = flatten
         # assert weight_decay==0, "weight_decay is not supported yet"
         
         # initialize required arguments for each param_groups
         for pg in self.param_groups:
-            values = pg["values"] = []
-            m = pg["m"] = []
-            for p in pg["params"]:
-                values.append(jt.zeros(p.shape, p.dtype).stop_grad())
-                m.append(jt.zeros(p.shape, p.dtype).stop_grad())
+            pg["values"] = self._zero_states(pg)
+            pg["m"] = self._zero_states(pg)
 
     def add_param_group(self, group):
-        values = group["values"] = []
-        m = group["m"] = []
-        for p in group["params"]:
-            values.append(jt.zeros(p.shape, p.dtype).stop_grad())
-            m.append(jt.zeros(p.shape, p.dtype).stop_grad())
+        group["values"] = self._zero_states(group)
+        group["m"] = self._zero_states(group)
         self.param_groups.append(group)
 
     def step(self, loss=None, retain_graph=False):
         self.pre_step(loss, retain_graph)
-        n = float(self.n_step)
+        n = self._step_var()
         jt.flags.node_order = 1
         for pg in self.param_groups:
             # get arguments from each param_groups
-            lr = pg.get("lr", self.lr)
-            eps = pg.get("eps", self.eps)
-            weight_decay = pg.get("weight_decay", self.weight_decay)
-            b0, b1 = pg.get("betas", self.betas)
-            for p, g, v, m in zip(pg["params"], pg["grads"], pg["values"], pg["m"]):
+            lr, eps, weight_decay, b0, b1 = self._hyper(pg,
+                "lr", "eps", "weight_decay", "betas")
+            step_size = lr * jt.sqrt(1-b1**n) / (1-b0 ** n)
+            if self.flatten:
+                for k, (p, g) in enumerate(self._flat_params(pg)):
+                    v, m = pg["values"][k], pg["m"][k]
+                    g = p * weight_decay + g
+                    m.update(b0 * m + (1-b0) * g)
+                    v.update(b1 * v + (1-b1) * g * g)
+                    self._flat_update(pg, k, p - m * step_size / (jt.sqrt(v) + eps))
+                continue
+            for p, g, v, m in zip(pg["params"], self._step_grads(pg), pg["values"], pg["m"]):
                 if p.is_stop_grad(): continue
                 g = p * weight_decay + g
                 m.update(b0 * m + (1-b0) * g)
                 v.update(b1 * v + (1-b1) * g * g)
-                step_size = lr * jt.sqrt(1-b1**n) / (1-b0 ** n)
                 p.update(p - m * step_size / (jt.sqrt(v) + eps))
         self.post_step()
 
@@ -424,51 +598,327 @@ class AdamW(Optimizer):
         optimizer = nn.AdamW(model.parameters(), lr, eps=1e-8, betas=(0.9, 0.999))
         optimizer.step(loss)
     """
-    def __init__(self, params, lr, eps=1e-8, betas=(0.9, 0.999), weight_decay=0):
+    def __init__(self, params, lr, eps=1e-8, betas=(0.9, 0.999), weight_decay=0, flatten=False):
         super().__init__(params, lr)
         self.eps = eps
         self.betas = betas
         self.weight_decay = weight_decay
+        self.flatten = flatten
         # assert weight_decay==0, "weight_decay is not supported yet"
         
         # initialize required arguments for each param_groups
         for pg in self.param_groups:
-            values = pg["values"] = []
-            m = pg["m"] = []
-            for p in pg["params"]:
-                values.append(jt.zeros(p.shape, p.dtype).stop_grad())
-                m.append(jt.zeros(p.shape, p.dtype).stop_grad())
+            pg["values"] = self._zero_states(pg)
+            pg["m"] = self._zero_states(pg)
 
     def add_param_group(self, group):
-        values = group["values"] = []
-        m = group["m"] = []
-        for p in group["params"]:
-            values.append(jt.zeros(p.shape, p.dtype).stop_grad())
-            m.append(jt.zeros(p.shape, p.dtype).stop_grad())
+        group["values"] = self._zero_states(group)
+        group["m"] = self._zero_states(group)
         self.param_groups.append(group)
 
     def step(self, loss=None, retain_graph=False):
         self.pre_step(loss, retain_graph)
-        n = float(self.n_step)
+        n = self._step_var()
         for pg in self.param_groups:
             # get arguments from each param_groups
-            lr = pg.get("lr", self.lr)
-            eps = pg.get("eps", self.eps)
-            weight_decay = pg.get("weight_decay", self.weight_decay)
-            b0, b1 = pg.get("betas", self.betas)
-            for p, g, v, m in zip(pg["params"], pg["grads"], pg["values"], pg["m"]):
+            lr, eps, weight_decay, b0, b1 = self._hyper(pg,
+                "lr", "eps", "weight_decay", "betas")
+            bias_correction1 = 1 - b0 ** n
+            sqrt_bias_correction2 = jt.sqrt(1 - b1 ** n)
+            if self.flatten:
+                for k, (p, g) in enumerate(self._flat_params(pg)):
+                    v, m = pg["values"][k], pg["m"][k]
+                    p = p * (1 - lr * weight_decay)
+                    m.update(b0 * m + (1-b0) * g) #exp_avg
+                    v.update(b1 * v + (1-b1) * g * g) #exp_avg_sq
+                    denom = jt.sqrt(v) / sqrt_bias_correction2 + eps
+                    self._flat_update(pg, k, p - lr / bias_correction1 * m / denom)
+                continue
+            for p, g, v, m in zip(pg["params"], self._step_grads(pg), pg["values"], pg["m"]):
                 if p.is_stop_grad(): continue
                 p.update(p * (1 - lr * weight_decay))
-                bias_correction1 = 1 - b0 ** n
-                bias_correction2 = 1 - b1 ** n
                 m.update(b0 * m + (1-b0) * g) #exp_avg
                 v.update(b1 * v + (1-b1) * g * g) #exp_avg_sq
-                denom = jt.sqrt(v) / jt.sqrt(bias_correction2) + eps
+                denom = jt.sqrt(v) / sqrt_bias_correction2 + eps
                 step_size = lr / bias_correction1
                 p.update(p - step_size * m / denom)
         self.post_step()
 
 
+class ShardedOptimizer(Optimizer):
+    """ Shard states of optimizer across mpi ranks(ZeRO stage 1).
+
+    Params of the same dtype in a param group are flattened and split
+    into world_size contiguous shards, each rank creates the inner
+    optimizer only for its shard, so memory of optimizer states such as
+    Adam moments is divided by world_size. After each step, updated
+    shards are broadcast by their owners and written back to params on
+    all ranks. Grads are all reduced by Optimizer.backward as usual.
+
+    Args:
+        optimizer_cls(class): optimizer to shard, such as Adam.
+        params(list): parameters of model, or list of param groups.
+        lr(float): learning rate.
+        args, kw: other arguments of optimizer_cls.
+
+    Example::
+
+        optimizer = jt.optim.ShardedOptimizer(jt.optim.Adam,
+            model.parameters(), 1e-3, betas=(0.9, 0.999))
+        optimizer.step(loss)
+    """
+    def __init__(self, optimizer_cls, params, lr, *args, **kw):
+        super().__init__(params, lr)
+        if jt.in_mpi:
+            self._world_size = jt.mpi.world_size()
+            self._rank = jt.mpi.world_rank()
+        else:
+            self._world_size, self._rank = 1, 0
+        # (param group id, dtype id, shard var, inner param group) of this rank
+        self._shards = []
+        inner_groups = []
+        for gid, pg in enumerate(self.param_groups):
+            for k, (dtype, ids, offsets) in enumerate(self._flat_layout(pg)):
+                lo, hi = self._shard_range(offsets[-1], self._rank)
+                if lo >= hi: continue
+                var = jt.zeros((hi-lo,), dtype)
+                inner_pg = { k:v for k,v in pg.items() if k != "params" }
+                inner_pg["params"] = [var]
+                inner_groups.append(inner_pg)
+                self._shards.append((gid, k, var, inner_pg))
+        self._optimizer = None
+        if len(inner_groups):
+            self._optimizer = optimizer_cls(inner_groups, lr, *args, **kw)
+
+    def _shard_range(self, n, rank):
+        chunk = (n - 1) // self._world_size + 1
+        return min(rank*chunk, n), min((rank+1)*chunk, n)
+
+    def step(self, loss=None, retain_graph=False):
+        self.pre_step(loss, retain_graph)
+        flats = {}
+        for gid, pg in enumerate(self.param_groups):
+            for k, (p, g) in enumerate(self._flat_params(pg)):
+                flats[gid, k] = (p, g)
+        # update shard of this rank by inner optimizer
+        for gid, k, var, inner_pg in self._shards:
+            pg = self.param_groups[gid]
+            p, g = flats[gid, k]
+            lo, hi = self._shard_range(p.shape[0], self._rank)
+            var.update(p[lo:hi])
+            # hyper parameters may be changed by lr scheduler
+            for key, v in pg.items():
+                if key not in ("params", "grads"):
+                    inner_pg[key] = v
+            # keep dtype of shard, which is broadcast to other ranks
+            inner_pg["grads"] = [g[lo:hi].cast(var.dtype)]
+        if self._optimizer is not None:
+            self._optimizer.n_step = self.n_step
+            self._optimizer.step()
+            jt.flags.node_order = 1
+
+        # gather shards from all ranks, broadcast after all reduce
+        # of grads, in the same order in all ranks
+        shard_vars = { (gid, k):var for gid, k, var, _ in self._shards }
+        dep = [ v for pg in flats.values() for v in pg ]
+        for gid, pg in enumerate(self.param_groups):
+            for k, (dtype, ids, offsets) in enumerate(self._flat_layout(pg)):
+                pieces = []
+                for r in range(self._world_size):
+                    lo, hi = self._shard_range(offsets[-1], r)
+                    if lo >= hi: continue
+                    if r == self._rank:
+                        piece = shard_vars[gid, k]
+                    else:
+                        piece = jt.zeros((hi-lo,), dtype)
+                    if jt.in_mpi:
+                        piece = piece.mpi_broadcast(r)
+                        piece._add_dependency(dep)
+                        dep = [piece]
+                    pieces.append(piece)
+                p = pieces[0] if len(pieces) == 1 else jt.concat(pieces)
+                self._flat_update(pg, k, p)
+        self.post_step()
+
+    def state_dict(self):
+        state = super().state_dict()
+        if self._optimizer is not None:
+            state["shard"] = self._optimizer.state_dict()
+        return state
+
+    def load_state_dict(self, state):
+        super().load_state_dict(state)
+        if self._optimizer is not None and "shard" in state:
+            self._optimizer.load_state_dict(state["shard"])
+
+
+class CommHook:
+    """ Communication hook of Optimizer, reduces grads of a bucket to
+    their mean across mpi ranks in Optimizer.backward.
+
+    The default hook all reduces flattened grads of a bucket by one mpi
+    call, subclasses override reduce to compress the communication.
+    Collectives are issued by all_reduce and broadcast, which keep the
+    same order of mpi calls on all ranks, sent_bytes counts payload bytes
+    sent by this rank.
+
+    Example::
+
+        class SignHook(nn.CommHook):
+            def reduce(self, flat, key):
+                sign = self.all_reduce(flat.sign().float16(), "add")
+                return sign.cast(flat.dtype) / jt.world_size
+
+        optimizer.comm_hook = SignHook()
+    """
+    def __init__(self):
+        self.sent_bytes = 0
+        self.dep = []
+
+    def __call__(self, grads, key):
+        ''' Return mean of grads across ranks, grads of a bucket have the
+        same dtype, key identifies the bucket across steps. '''
+        if len(grads) == 1:
+            g = grads[0]
+            return [self.reduce(g.flatten(), key).reshape(g.shape)]
+        flat = self.reduce(jt.concat([ g.flatten() for g in grads ]), key)
+        result = []
+        offset = 0
+        for g in grads:
+            size = int(np.prod(g.shape))
+            result.append(flat[offset:offset+size].reshape(g.shape))
+            offset += size
+        return result
+
+    def reduce(self, flat, key):
+        ''' Return mean of 1-D flat grads across ranks. '''
+        return self.all_reduce(flat)
+
+    def add_dep(self, v):
+        ''' Make v run after the previous collective. '''
+        v._add_dependency(self.dep)
+        self.dep = [v]
+        return v
+
+    def _count(self, x):
+        self.sent_bytes += int(np.prod(x.shape)) * np.dtype(str(x.dtype)).itemsize
+
+    def all_reduce(self, x, op="mean"):
+        self._count(x)
+        return self.add_dep(x.mpi_all_reduce(op))
+
+    def broadcast(self, x, root):
+        if root == jt.rank:
+            self._count(x)
+        return self.add_dep(x.mpi_broadcast(root))
+
+
+class FP16CompressHook(CommHook):
+    """ All reduce grads in float16, which halves the bytes of float32
+    grads, grads are divided by world size before casting to avoid
+    overflow of the sum. """
+    def reduce(self, flat, key):
+        half = (flat / jt.world_size).float16()
+        return self.all_reduce(half, "add").cast(flat.dtype)
+
+
+class TopKCompressHook(CommHook):
+    """ Only send the largest ratio of grads of each bucket, values and
+    indexes are gathered from all ranks. The unsent part is accumulated
+    into an error feedback buffer and added to grads of the next step.
+
+    Args:
+        ratio (float): ratio of grads sent of each bucket, default 0.01.
+    """
+    def __init__(self, ratio=0.01):
+        super().__init__()
+        self.ratio = ratio
+        self.errors = {}
+
+    def reduce(self, flat, key):
+        n = flat.shape[0]
+        k = max(1, int(n * self.ratio))
+        if key not in self.errors:
+            self.errors[key] = jt.zeros((n,), flat.dtype).stop_grad()
+        err = self.errors[key]
+        flat = flat + err
+        _, index = jt.topk(flat.abs(), k)
+        value = flat[index]
+        err.update(flat.scatter(0, index, jt.zeros((k,), flat.dtype)))
+        # mpi has no all gather, gather by a broadcast of each rank
+        total = jt.zeros((n,), flat.dtype)
+        for r in range(jt.world_size):
+            if r == jt.rank:
+                v, i = value, index
+            else:
+                v, i = jt.zeros((k,), flat.dtype), jt.zeros((k,), index.dtype)
+            total = total.scatter(0, self.broadcast(i, r),
+                self.broadcast(v, r), reduce="add")
+        return total / jt.world_size
+
+
+class PowerSGDHook(CommHook):
+    """ Reduce each grad of at least 2 dims by a low rank approximation
+    computed by one step of power iteration, grad M of shape (n, m) is
+    sent as P of shape (n, rank) and Q of shape (m, rank)::
+
+        P = all_reduce(M Q), orthogonalize P
+        Q = all_reduce(M^T P), M ~ P Q^T
+
+    Q is reused by the next step, and the approximation error is added to
+    grads of the next step. Grads which are too small to compress are all
+    reduced together.
+
+    Args:
+        rank (int): rank of the approximation, default 1.
+    """
+    def __init__(self, rank=1):
+        super().__init__()
+        self.rank = rank
+        self.errors = {}
+        self.qs = {}
+
+    def __call__(self, grads, key):
+        result = [None] * len(grads)
+        rest = []
+        for j, g in enumerate(grads):
+            m = int(np.prod(g.shape[1:]))
+            if g.ndim >= 2 and g.shape[0] * m > (g.shape[0] + m) * self.rank:
+                result[j] = self._power_sgd(g, (key, j))
+            else:
+                rest.append(j)
+        if rest:
+            reduced = super().__call__([ grads[j] for j in rest ], key)
+            for j, g in zip(rest, reduced):
+                result[j] = g
+        return result
+
+    def _power_sgd(self, g, key):
+        mat = g.reshape(g.shape[0], -1)
+        n, m = mat.shape
+        if key not in self.qs:
+            # the same initial Q on all ranks
+            q = np.random.RandomState(0).randn(m, self.rank)
+            self.qs[key] = jt.array(q).cast(g.dtype).stop_grad()
+            self.errors[key] = jt.zeros((n, m), g.dtype).stop_grad()
+        q, err = self.qs[key], self.errors[key]
+        mat = mat + err
+        p = self.all_reduce(jt.matmul(mat, q))
+        # Gram-Schmidt orthogonalize columns of P
+        cols = []
+        for i in range(self.rank):
+            c = p[:, i]
+            for prev in cols:
+                c = c - (c * prev).sum() * prev
+            cols.append(c / (jt.sqrt((c * c).sum()) + 1e-8))
+        p = jt.stack(cols, 1)
+        q_new = self.all_reduce(jt.matmul(mat.transpose(), p))
+        approx = jt.matmul(p, q_new.transpose())
+        err.update(mat - approx)
+        q.update(q_new)
+        return approx.reshape(g.shape)
+
+
 class LRScheduler:
     def __init__(self,optimizer, last_epoch=-1):
         assert isinstance(optimizer,Optimizer)
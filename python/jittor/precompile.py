@@ -0,0 +1,55 @@
+# ***************************************************************
+# Copyright (c) 2022 Jittor. All Rights Reserved.
+# Maintainers: Dun Liang <randonlang@gmail.com>.
+# This file is subject to the terms and conditions defined in
+# file 'LICENSE.txt', which is part of this source code package.
+# ***************************************************************
+# Record jit kernels used by a script into a manifest, and compile
+# them ahead of time into the cache path of another node.
+#
+# Usage:
+#     python3 -m jittor.precompile manifest.json [manifest2.json ...]
+import sys
+import json
+import jittor as jt
+import jittor_utils as jit_utils
+from jittor_utils import LOG
+
+def precompile_kernels(*paths):
+    ''' Compile kernels of manifests recorded by jt.record_kernels into
+    the cache path in parallel, return number of kernels.
+
+    Args:
+        paths (str): paths of manifest files.
+
+    Kernels are compiled by the compile commands of this node, cached
+    kernels are not compiled again. CUDA kernels are skipped if CUDA
+    is not found.
+    '''
+    kernels = {}
+    for path in paths:
+        with open(path) as f:
+            manifest = json.load(f)
+        if manifest["version"] != jt.__version__:
+            LOG.w(f"Manifest {path} is recorded by jittor {manifest['version']}, "
+                f"kernels may be different in jittor {jt.__version__}.")
+        for k in manifest["kernels"]:
+            kernels[k["jit_key"]] = k
+    cmds = []
+    for k in kernels.values():
+        if k["is_cuda"] and not jt.flags.nvcc_path:
+            continue
+        cmds.append(jt.prepare_jit_kernel(k["jit_key"], k["src"],
+            k["is_cuda"], k["extra_flags"]))
+    if len(cmds) < len(kernels):
+        LOG.w(f"{len(kernels)-len(cmds)} CUDA kernels are skipped, CUDA is not found.")
+    jit_utils.run_cmds(cmds, jt.flags.cache_path, jt.flags.jittor_path,
+        "Precompiling kernels")
+    LOG.i(f"{len(cmds)} kernels are precompiled: {jt.flags.cache_path}")
+    return len(cmds)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(f"Usage: {sys.executable} -m jittor.precompile manifest.json [manifest2.json ...]")
+        sys.exit(1)
+    precompile_kernels(*sys.argv[1:])
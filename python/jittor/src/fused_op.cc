@@ -193,11 +193,16 @@ void FusedOp::do_jit_prepare(JK& jk) {
         jk << "«index_t:int32";
     if (loop_options->size()) {
         if (get_loop_option("compile_shapes")) {
+            // shapes of dynamic dims are not compiled
+            int dynamic_dims = get_loop_option("dynamic_dims");
             jk << "«shapes:";
             for (auto& vi : vars) {
                 jk << '[';
-                for (auto a : vi.var->shape)
-                    jk << a << ',';
+                for (int i=0; i<vi.var->shape.size(); i++)
+                    if (dynamic_dims>>i&1)
+                        jk << "?,";
+                    else
+                        jk << vi.var->shape[i] << ',';
                 jk << "],";
             }
         }
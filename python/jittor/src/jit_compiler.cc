@@ -13,6 +13,8 @@
 #include <dlfcn.h>
 #endif
 #include <mutex>
+#include <sstream>
+#include <thread>
 
 #include "jit_compiler.h"
 #include "op.h"
@@ -20,6 +22,8 @@
 #include "utils/flags.h"
 #include "fused_op.h"
 #include "utils/str_utils.h"
+#include "utils/cross_platform.h"
+#include "misc/hash.h"
 JPU(header)
 
 namespace jittor {
@@ -33,6 +37,7 @@ DEFINE_FLAG(string, nvcc_flags, "", "Flags of CUDA C++ compiler");
 DEFINE_FLAG(string, python_path, "", "Path of python interpreter");
 DEFINE_FLAG(string, cache_path, "", "Cache path of jittor");
 DEFINE_FLAG(int, rewrite_op, 1, "Rewrite source file of jit operator or not");
+DEFINE_FLAG(int, use_kernel_bundle, 1, "Load cached jit operators from kernel bundles built by python -m jittor.utils.kernel_bundle");
 
 vector<string> shsplit(const string& s) {
     auto s1 = split(s, " ");
@@ -192,7 +197,7 @@ void run_cmd(string cmd, string cwd="") {
     system_with_check(cmd.c_str());
 }
 
-static string get_symbol_name(const string& jit_key) {
+static string get_symbol_name(const string& jit_key, const string& method="jit_run") {
     int i=0;
     while (i<jit_key.size() && jit_key[i]>=0 && jit_key[i]<=127) i++;
     string op_name = i ? jit_key.substr(0, i) : "fused";
@@ -200,15 +205,106 @@ static string get_symbol_name(const string& jit_key) {
     // _ZN7jittorXyyyyyy7jit_runEv
     // jittor::yyyyyy::jit_run
     #ifdef _MSC_VER
-    op_name = "?jit_run@"+op_name+"Op@jittor@@QEAAXXZ";
+    op_name = "?"+method+"@"+op_name+"Op@jittor@@QEAAXXZ";
     #else
-    op_name = "_ZN6jittor"+S(op_name.size()+2)+op_name+"Op7jit_runEv";
+    op_name = "_ZN6jittor"+S(op_name.size()+2)+op_name+"Op"+S(method.size())+method+"Ev";
     #endif
     return op_name;
 }
 
-jit_op_entry_t compile(const string& jit_key, const string& src, const bool is_cuda_op, const string& extra_flags) {
-    LOGvv << "Compile op" << jit_key;
+// Kernel bundles are shared libraries of many cached jit ops, built by
+// python -m jittor.utils.kernel_bundle in cache_path/kernel_bundle.
+// The index file lists headers used by kernels with their size and
+// mtime, then one line of each kernel: name of its library, bundle
+// and hash64 of its compile command and source in hex. jit_run of the
+// kernel is renamed as jit_run_<hash> in the bundle. The bundle is
+// used only if headers and the command and source are not changed.
+struct BundleEntry {
+    string bundle;
+    string hash;
+};
+static unordered_map<string, BundleEntry> bundle_index;
+static bool bundle_index_loaded = false;
+
+static void load_bundle_index() {
+    bundle_index_loaded = true;
+    auto dir = join(cache_path, "kernel_bundle");
+    std::istringstream ss(read_all(join(dir, "index")));
+    string line;
+    bool in_kernels = false;
+    unordered_map<string, BundleEntry> index;
+    while (std::getline(ss, line)) {
+        if (line == "# kernels") {
+            in_kernels = true;
+            continue;
+        }
+        if (!line.size() || line[0] == '#') continue;
+        auto fields = split(line, "\t");
+        if (fields.size() != 3) continue;
+        if (in_kernels) {
+            index[fields[0]] = {join(dir, fields[1]), fields[2]};
+            continue;
+        }
+        FileStat st;
+        if (!get_file_stat(fields[0], st) || S(st.size) != fields[1]
+            || S(st.mtime_ns) != fields[2]) {
+            LOGv << "Kernel bundle is outdated, header changed:" << fields[0];
+            return;
+        }
+    }
+    LOGv << "Kernel bundle loaded:" << index.size() << "kernels";
+    bundle_index = move(index);
+}
+
+static jit_op_entry_t load_from_bundle(const string& jit_key, const string& jit_lib_path,
+    const string& cmd, const string& src, const string& extra_flags) {
+    static std::mutex mtx;
+    {
+        std::lock_guard<std::mutex> lock(mtx);
+        if (!bundle_index_loaded)
+            load_bundle_index();
+    }
+    if (!bundle_index.size() || extra_flags.find("GLOBAL_VAR") != string::npos)
+        return nullptr;
+    auto name = split(jit_lib_path, "/").back();
+    auto iter = bundle_index.find(name);
+    if (iter == bundle_index.end()) return nullptr;
+    std::stringstream hash;
+    hash << std::hex << hash64(cmd + "\n" + src);
+    if (hash.str() != iter->second.hash) return nullptr;
+    if (!file_exist(iter->second.bundle)) return nullptr;
+    LOGvv << "Load jit op from kernel bundle:" << iter->second.bundle;
+    return load_jit_lib(iter->second.bundle,
+        get_symbol_name(jit_key, "jit_run_"+hash.str()));
+}
+
+// Write source of a jit op if it is changed. It is written to a temp
+// file and renamed, so compilers of other processes never read a
+// partial source.
+static void write_jit_src(const string& path, const string& src) {
+    if (file_exist(path) && (!rewrite_op || read_all(path) == src))
+        return;
+    #ifdef _WIN32
+    write(path, src);
+    #else
+    auto tid = std::hash<std::thread::id>()(std::this_thread::get_id());
+    string tmp = path + "." + S(getpid()) + "." + S(tid) + ".tmp";
+    write(tmp, src);
+    if (rename(tmp.c_str(), path.c_str()) != 0) {
+        remove(tmp.c_str());
+        write(path, src);
+    }
+    #endif
+}
+
+static std::mutex record_mutex;
+static bool recording_kernels = false;
+static vector<vector<string>> kernel_records;
+
+// Build compile command of a jit op, src and extra_flags are modified
+// by extensions, and paths of its source and library are returned.
+static string get_compile_cmd(const string& jit_key, string& src, const bool is_cuda_op,
+    string& extra_flags, string& jit_src_path2, string& jit_lib_path, string& symbol_name) {
     // compiler do not allowed filename too long
     CHECK(cc_path.size());
     string jit_src_path;
@@ -216,23 +312,19 @@ jit_op_entry_t compile(const string& jit_key, const string& src, const bool is_c
         jit_src_path = Op::get_filename_from_jit_key(jit_key, ".cu");
     else
         jit_src_path = Op::get_filename_from_jit_key(jit_key, ".cc");
-    string* src2 = (string*)&src;
-    string* extra_flags2 = (string*)&extra_flags;
-    JPU(op_compiler(jit_src_path, *src2, is_cuda_op, *extra_flags2));
+    JPU(op_compiler(jit_src_path, src, is_cuda_op, extra_flags));
     #ifdef _WIN32
-    string jit_lib_path = Op::get_filename_from_jit_key(jit_key, ".dll");
-    string jit_src_path2 = _to_winstr(jit_src_path);
+    jit_lib_path = Op::get_filename_from_jit_key(jit_key, ".dll");
+    jit_src_path2 = _to_winstr(jit_src_path);
     #else
-    string jit_lib_path = Op::get_filename_from_jit_key(jit_key, ".so");
-    string& jit_src_path2 = jit_src_path;
+    jit_lib_path = Op::get_filename_from_jit_key(jit_key, ".so");
+    jit_src_path2 = jit_src_path;
     #endif
     string other_src;
     LOGvvv << "Generate" << jit_src_path >> "\n" >> src;
-    if (rewrite_op || !file_exist(jit_src_path2))
-        write(jit_src_path2, src);
     string cmd;
     
-    auto symbol_name = get_symbol_name(jit_key);
+    symbol_name = get_symbol_name(jit_key);
 #ifndef _MSC_VER
     if (is_cuda_op) {
         cmd = "\"" + nvcc_path + "\""
@@ -268,10 +360,52 @@ jit_op_entry_t compile(const string& jit_key, const string& src, const bool is_c
             + symbol_name + "\"";
     }
 #endif
+    return cmd;
+}
+
+jit_op_entry_t compile(const string& jit_key, const string& src, const bool is_cuda_op, const string& extra_flags) {
+    LOGvv << "Compile op" << jit_key;
+    if (recording_kernels) {
+        std::lock_guard<std::mutex> lock(record_mutex);
+        if (recording_kernels)
+            kernel_records.push_back({jit_key, src, S(int(is_cuda_op)), extra_flags});
+    }
+    string* src2 = (string*)&src;
+    string* extra_flags2 = (string*)&extra_flags;
+    string jit_src_path2, jit_lib_path, symbol_name;
+    auto cmd = get_compile_cmd(jit_key, *src2, is_cuda_op, *extra_flags2,
+        jit_src_path2, jit_lib_path, symbol_name);
+    if (use_kernel_bundle) {
+        auto jit_entry = load_from_bundle(jit_key, jit_lib_path, cmd, src, extra_flags);
+        if (jit_entry) return jit_entry;
+    }
+    write_jit_src(jit_src_path2, src);
     cache_compile(cmd, cache_path, jittor_path);
     auto jit_entry = load_jit_lib(jit_lib_path, symbol_name, extra_flags);
     return jit_entry;
 }
 
 } // jit_compiler
+
+void start_record_kernels() {
+    std::lock_guard<std::mutex> lock(jit_compiler::record_mutex);
+    jit_compiler::kernel_records.clear();
+    jit_compiler::recording_kernels = true;
+}
+
+vector<vector<string>> stop_record_kernels() {
+    std::lock_guard<std::mutex> lock(jit_compiler::record_mutex);
+    jit_compiler::recording_kernels = false;
+    return move(jit_compiler::kernel_records);
+}
+
+string prepare_jit_kernel(const string& jit_key, const string& src, bool is_cuda_op, const string& extra_flags) {
+    string src2 = src, extra_flags2 = extra_flags;
+    string jit_src_path2, jit_lib_path, symbol_name;
+    auto cmd = jit_compiler::get_compile_cmd(jit_key, src2, is_cuda_op, extra_flags2,
+        jit_src_path2, jit_lib_path, symbol_name);
+    jit_compiler::write_jit_src(jit_src_path2, src2);
+    return cmd;
+}
+
 } // jittor
\ No newline at end of file
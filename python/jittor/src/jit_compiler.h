@@ -17,4 +17,18 @@ jit_op_entry_t compile(
     const string& extra_flags="");
 
 } // jit_compiler
+
+/** start recording jit kernels compiled by this process */
+// @pyjt(start_record_kernels)
+void start_record_kernels();
+
+/** stop recording, return recorded kernels, each one is
+[jit_key, src, is_cuda, extra_flags] */
+// @pyjt(stop_record_kernels)
+vector<vector<string>> stop_record_kernels();
+
+/** write source of a jit kernel into cache_path, return its compile command */
+// @pyjt(prepare_jit_kernel)
+string prepare_jit_kernel(const string& jit_key, const string& src, bool is_cuda_op, const string& extra_flags);
+
 } // jittor
\ No newline at end of file
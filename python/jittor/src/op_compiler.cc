@@ -1075,7 +1075,10 @@ jit_op_entry_t OpCompiler::compile(const string& jit_key, const string& src) {
 }
 
 jit_op_entry_t OpCompiler::do_compile(Op* op) {
+    #ifdef _WIN32
+    // jit ops are locked by cache_compile except on windows
     jittor::lock_guard lg;
+    #endif
     OpCompiler oc(op);
     string* src = &oc.src;
     for (auto op_type : op_types)
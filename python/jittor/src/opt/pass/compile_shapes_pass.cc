@@ -14,6 +14,7 @@ namespace jittor {
 
 void CompileShapesPass::run() {
     if (!op->get_loop_option("compile_shapes")) return;
+    int dynamic_dims = op->get_loop_option("dynamic_dims");
     for (auto& c : ir->children) {
         if (c->type != "define") continue;
         auto& rvalue = c->get_attr("rvalue");
@@ -33,6 +34,9 @@ void CompileShapesPass::run() {
         pm->oc->get_op_var_by_name(name, op_id, opvar_id, op, var);
         int shapeid = std::stoi(rvalue.substr(i+1, rvalue.size()-i-2));
         ASSERT(shapeid < (int)var->shape.size());
+        // dim is dynamic, keep it as a runtime parameter
+        if (dynamic_dims>>shapeid&1)
+            continue;
         rvalue = S(var->shape[shapeid]);
     }
 }
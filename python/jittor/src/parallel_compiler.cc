@@ -211,7 +211,10 @@ void parallel_compile_all_ops(vector<int>& queue, vector<int>& range, FusedOp& f
 
     // backup number
     auto bk_var = Var::number_of_lived_vars, bk_op = Op::number_of_lived_ops;
+    #ifdef _WIN32
+    // jit ops are locked by cache_compile except on windows
     jittor::lock_guard lg;
+    #endif
     auto func = [&](int tid) {
         auto& entrys = op_entrys.at(tid);
         entrys.clear();
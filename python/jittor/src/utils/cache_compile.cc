@@ -6,14 +6,28 @@
 // ***************************************************************
 #include <fstream>
 #include <streambuf>
+#include <mutex>
+#include <ctime>
+#include <sstream>
+#include <thread>
+#include <chrono>
+#include <sys/stat.h>
 #ifdef _WIN32
 #include <filesystem>
+#else
+#include <errno.h>
+#include <fcntl.h>
+#include <sys/file.h>
 #endif
 #include "misc/hash.h"
 #include "utils/cache_compile.h"
 #include "utils/str_utils.h"
+#include "utils/cross_platform.h"
 
 namespace jittor {
+
+DEFINE_FLAG(int, compile_slots, 0, "Max number of compilers run by processes sharing a cache path at the same time, default is the number of cpus");
+
 namespace jit_compiler {
 
 #ifndef TEST
@@ -159,7 +173,8 @@ size_t skip_comments(const string& src, size_t i) {
 
 map<string,string> jt_env;
 
-void process(string src, vector<string>& input_names, string& cmd) {
+// find quoted includes and JT macros tested by #ifdef of source
+void scan_source(const string& src, vector<string>& input_names, vector<string>& jt_macros) {
     for (size_t i=0; i<src.size(); i++) {
         i = skip_comments(src, i);
         if (i>=src.size()) break;
@@ -182,35 +197,176 @@ void process(string src, vector<string>& input_names, string& cmd) {
                     input_names.push_back(inc);
                 }
             }
-            if (l-k>2 && src[k] == 'J' && src[k+1] == 'T' && j-i==6 && src.substr(i,j-i) == "#ifdef") {
-                auto inc = strip(src.substr(k, l-k));
-                auto env = getenv(inc.c_str());
-                if (env && string(env)!="0") {
-                    auto senv = string(env);
-                    if (!jt_env.count(inc)) {
-                        LOGe << "Load JT env ok:" << inc << senv;
-                        jt_env[inc] = senv;
-                    }
-                    string dflag = " -D"+inc+"="+senv;
-                    if (cmd.find(dflag) == string::npos) {
-                        // -D flags should insert before -o flag
-                        #ifdef _MSC_VER
-                        string patt = " -Fo: ";
-                        #else
-                        string patt = " -o ";
-                        #endif
-                        auto cmds = split(cmd, patt, 2);
-                        if (cmds.size() == 2) {
-                            cmd = cmds[0] + dflag + patt + cmds[1];
-                        }
-                    }
-                }
-            }
+            if (l-k>2 && src[k] == 'J' && src[k+1] == 'T' && j-i==6 && src.substr(i,j-i) == "#ifdef")
+                jt_macros.push_back(strip(src.substr(k, l-k)));
             i=l;
         }
     }
 }
 
+// add -D flag of JT macro to cmd if it is set in env
+void apply_jt_env(const string& inc, string& cmd) {
+    auto env = getenv(inc.c_str());
+    if (env && string(env)!="0") {
+        auto senv = string(env);
+        if (!jt_env.count(inc)) {
+            LOGe << "Load JT env ok:" << inc << senv;
+            jt_env[inc] = senv;
+        }
+        string dflag = " -D"+inc+"="+senv;
+        if (cmd.find(dflag) == string::npos) {
+            // -D flags should insert before -o flag
+            #ifdef _MSC_VER
+            string patt = " -Fo: ";
+            #else
+            string patt = " -o ";
+            #endif
+            auto cmds = split(cmd, patt, 2);
+            if (cmds.size() == 2) {
+                cmd = cmds[0] + dflag + patt + cmds[1];
+            }
+        }
+    }
+}
+
+void process(string src, vector<string>& input_names, string& cmd) {
+    vector<string> jt_macros;
+    scan_source(src, input_names, jt_macros);
+    for (auto& inc : jt_macros)
+        apply_jt_env(inc, cmd);
+}
+
+struct SourceInfo {
+    FileStat st;
+    string hash;
+    vector<string> includes, jt_macros;
+};
+
+#ifndef TEST
+bool get_file_stat(const string& fname, FileStat& fs) {
+    struct stat st;
+    if (stat(fname.c_str(), &st) != 0) return false;
+    fs.dev = st.st_dev;
+    fs.ino = st.st_ino;
+    fs.size = st.st_size;
+    #if defined(__APPLE__)
+    fs.mtime_ns = st.st_mtimespec.tv_sec * 1000000000ll + st.st_mtimespec.tv_nsec;
+    #elif defined(_WIN32)
+    fs.mtime_ns = st.st_mtime * 1000000000ll;
+    #else
+    fs.mtime_ns = st.st_mtim.tv_sec * 1000000000ll + st.st_mtim.tv_nsec;
+    #endif
+    return true;
+}
+#else
+bool get_file_stat(const string& fname, FileStat& fs) {
+    // files of test are in memory, no stat
+    return false;
+}
+#endif
+
+// hashes and includes of sources read by cache_compile, validated by
+// stat of file, so unchanged headers are read and hashed only once.
+// They are also saved in cache_path, shared by processes, except
+// sources of jit ops, which are compiled only once.
+static std::mutex source_infos_mutex;
+static unordered_map<string, SourceInfo> source_infos;
+static string source_infos_path, jit_src_dir;
+static bool source_infos_dirty = false;
+
+// file of source infos, one file per line, fields separated by tab:
+// name dev ino size mtime_ns hash n_includes includes... jt_macros...
+static void load_source_infos(const string& cache_path) {
+    std::lock_guard<std::mutex> lock(source_infos_mutex);
+    if (!cache_path.size() || source_infos_path.size()) return;
+    source_infos_path = join(cache_path, "source_infos");
+    jit_src_dir = join(cache_path, "jit");
+    std::istringstream ss(read_all(source_infos_path));
+    string line;
+    while (std::getline(ss, line)) {
+        auto fields = split(line, "\t");
+        if (fields.size() < 7) continue;
+        SourceInfo info;
+        try {
+            info.st.dev = std::stoull(fields[1]);
+            info.st.ino = std::stoull(fields[2]);
+            info.st.size = std::stoull(fields[3]);
+            info.st.mtime_ns = std::stoll(fields[4]);
+            info.hash = fields[5];
+            size_t n = std::stoull(fields[6]);
+            if (7+n > fields.size()) continue;
+            info.includes.assign(fields.begin()+7, fields.begin()+7+n);
+            info.jt_macros.assign(fields.begin()+7+n, fields.end());
+        } catch (...) {
+            continue;
+        }
+        source_infos.emplace(fields[0], std::move(info));
+    }
+}
+
+static void save_source_infos() {
+    std::lock_guard<std::mutex> lock(source_infos_mutex);
+    if (!source_infos_dirty || !source_infos_path.size()) return;
+    source_infos_dirty = false;
+    string s;
+    for (auto& kv : source_infos) {
+        auto& info = kv.second;
+        FileStat st;
+        // removed files are not saved
+        if (kv.first.find_first_of("\t\n") != string::npos ||
+            startswith(kv.first, jit_src_dir) ||
+            !get_file_stat(kv.first, st)) continue;
+        s += kv.first;
+        for (auto x : {info.st.dev, info.st.ino, info.st.size, (uint64)info.st.mtime_ns})
+            s += "\t" + S(x);
+        s += "\t" + info.hash + "\t" + S(info.includes.size());
+        for (auto& inc : info.includes) s += "\t" + inc;
+        for (auto& inc : info.jt_macros) s += "\t" + inc;
+        s += "\n";
+    }
+    // write to a temp file and rename, other processes never read a
+    // partial file
+    string tmp = source_infos_path + "." + S(getpid()) + ".tmp";
+    write(tmp, s);
+    if (rename(tmp.c_str(), source_infos_path.c_str()) != 0)
+        remove(tmp.c_str());
+}
+
+// get hash, includes and JT macros of a source file, object files are
+// only hashed, return false if file read failed
+static bool get_source_info(const string& fname, bool scan, SourceInfo& info) {
+    FileStat st;
+    bool has_stat = get_file_stat(fname, st);
+    if (has_stat) {
+        std::lock_guard<std::mutex> lock(source_infos_mutex);
+        auto iter = source_infos.find(fname);
+        if (iter != source_infos.end() && iter->second.st == st) {
+            info = iter->second;
+            return true;
+        }
+    }
+    auto src = read_all(fname);
+    #ifdef _WIN32
+    src = _to_winstr(src);
+    #endif
+    if (!src.size()) return false;
+    info.st = st;
+    info.hash = S(hash64(src));
+    info.includes.clear();
+    info.jt_macros.clear();
+    if (scan)
+        scan_source(src, info.includes, info.jt_macros);
+    // a file modified within the resolution of mtime may be modified
+    // again with the same stat, it is not cached
+    if (has_stat && st.mtime_ns < ((int64)time(nullptr)-2) * 1000000000ll) {
+        std::lock_guard<std::mutex> lock(source_infos_mutex);
+        source_infos[fname] = info;
+        if (!jit_src_dir.size() || !startswith(fname, jit_src_dir))
+            source_infos_dirty = true;
+    }
+    return true;
+}
+
 static inline void check_win_file(const string& name) {
 #ifdef _WIN32
     // win32 not allowed so file change when load
@@ -226,6 +382,56 @@ static inline void check_win_file(const string& name) {
 #endif
 }
 
+// Exclusive lock of a file, released when destroyed. Locks of
+// different objects exclude each other, even in the same process.
+// If the file system does not support locking, nothing is locked.
+struct FileLock {
+    int fd = -1;
+    // return false if wait is false and the file is locked by others
+    bool lock(const string& fname, bool wait=true) {
+        #if !defined(_WIN32) && !defined(TEST)
+        fd = open(fname.c_str(), O_RDWR | O_CREAT | O_CLOEXEC, 0666);
+        if (fd < 0) return true;
+        if (flock(fd, LOCK_EX | (wait ? 0 : LOCK_NB)) != 0) {
+            bool busy = errno == EWOULDBLOCK;
+            close(fd);
+            fd = -1;
+            return !busy;
+        }
+        #endif
+        return true;
+    }
+    ~FileLock() {
+        #if !defined(_WIN32) && !defined(TEST)
+        if (fd >= 0) close(fd);
+        #endif
+    }
+};
+
+static string get_lock_dir(const string& cache_path) {
+    auto dir = join(cache_path, "locks");
+    #if !defined(_WIN32) && !defined(TEST)
+    mkdir(dir.c_str(), 0777);
+    #endif
+    return dir;
+}
+
+// Hold one of compile_slots slots while running a compiler, processes
+// sharing a cache path wait for a free slot.
+static void lock_compile_slot(const string& lock_dir, FileLock& slot) {
+    int n = compile_slots;
+    if (n <= 0) n = std::max(1u, std::thread::hardware_concurrency());
+    int start = (getpid() + std::hash<std::thread::id>()(std::this_thread::get_id())) % n;
+    int sleep_ms = 1;
+    while (1) {
+        for (int i=0; i<n; i++)
+            if (slot.lock(join(lock_dir, "compile_slot_"+S((start+i)%n)), false))
+                return;
+        std::this_thread::sleep_for(std::chrono::milliseconds(sleep_ms));
+        sleep_ms = std::min(sleep_ms*2, 100);
+    }
+}
+
 static inline bool is_full_path(const string& name) {
 #ifdef _WIN32
     return name.size()>=2 && (name[1]==':' || (name[0]=='\\' && name[1]=='\\'));
@@ -247,10 +453,9 @@ bool cache_compile(string cmd, const string& cache_path_, const string& jittor_p
     map<string,vector<string>> extra;
     string output_name;
     find_names(cmd, input_names, output_name, extra);
+    load_source_infos(cache_path);
     string output_cache_key;
     bool ran = false;
-    if (file_exist(output_name))
-        output_cache_key = read_all(output_name+".key");
     string cache_key;
     unordered_set<string> processed;
     auto src_path = join(jittor_path, "src");
@@ -262,19 +467,18 @@ bool cache_compile(string cmd, const string& cache_path_, const string& jittor_p
         if (input_names[i] == "dynamic_lookup")
             continue;
         processed.insert(input_names[i]);
-        auto src = read_all(input_names[i]);
-        #ifdef _WIN32
-        src = _to_winstr(src);
-        #endif
         auto back = input_names[i].back();
         // *.lib
         if (back == 'b') continue;
-        ASSERT(src.size()) << "Source read failed:" << input_names[i] << "cmd:" << cmd;
-        auto hash = S(hash64(src));
-        vector<string> new_names;
-        // *.obj, *.o, *.pyd
-        if (back != 'j' && back != 'o' && back != 'd')
-            process(src, new_names, cmd);
+        SourceInfo info;
+        // *.obj, *.o, *.pyd are not scanned
+        bool scan = back != 'j' && back != 'o' && back != 'd';
+        bool read_ok = get_source_info(input_names[i], scan, info);
+        ASSERT(read_ok) << "Source read failed:" << input_names[i] << "cmd:" << cmd;
+        for (auto& inc : info.jt_macros)
+            apply_jt_env(inc, cmd);
+        const auto& hash = info.hash;
+        const auto& new_names = info.includes;
         for (auto& name : new_names) {
             string full_name;
             if (name.substr(0, 4) == "jit/" || name.substr(0, 4) == "gen/")
@@ -305,6 +509,20 @@ bool cache_compile(string cmd, const string& cache_path_, const string& jittor_p
         cache_key += "\n";
     }
     cache_key = cmd + "\n" + cache_key;
+    save_source_infos();
+    // Processes compiling the same output wait for the first one, and
+    // find the output cached. Outputs are hashed into a fixed number of
+    // lock files, different outputs are compiled at the same time.
+    string lock_dir;
+    FileLock output_lock, slot;
+    if (cache_path.size()) {
+        lock_dir = get_lock_dir(cache_path);
+        output_lock.lock(join(lock_dir, "output_"+S(hash64(output_name)%1024)));
+    }
+    if (file_exist(output_name))
+        output_cache_key = read_all(output_name+".key");
+    if (output_cache_key != cache_key && lock_dir.size())
+        lock_compile_slot(lock_dir, slot);
     if (output_cache_key.size() == 0) {
         LOGvv << "Cache key of" << output_name << "not found.";
         LOGvvv << "Run cmd:" << cmd;
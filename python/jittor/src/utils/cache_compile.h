@@ -14,6 +14,16 @@ string read_all(const string& fname);
 void write(const string& fname, const string& src);
 bool file_exist(const string& fname);
 string join(string a, string b);
+
+struct FileStat {
+    uint64 dev=0, ino=0, size=0;
+    int64 mtime_ns=0;
+    bool operator==(const FileStat& o) const {
+        return dev==o.dev && ino==o.ino && size==o.size && mtime_ns==o.mtime_ns;
+    }
+};
+// stat of file, return false if it does not exist
+bool get_file_stat(const string& fname, FileStat& fs);
 bool cache_compile(string cmd, const string& cache_path="", const string& jittor_path="");
 
 } // jit_compiler
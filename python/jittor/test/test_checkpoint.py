@@ -0,0 +1,81 @@
+# ***************************************************************
+# Copyright (c) 2022 Jittor. All Rights Reserved.
+# Maintainers:
+#     Dun Liang <randonlang@gmail.com>.
+#
+# This file is subject to the terms and conditions defined in
+# file 'LICENSE.txt', which is part of this source code package.
+# ***************************************************************
+import unittest
+import jittor as jt
+import numpy as np
+from jittor import nn
+
+def get_model():
+    jt.set_global_seed(0)
+    return nn.Sequential(*[ nn.Sequential(nn.Linear(16, 16), nn.ReLU())
+        for i in range(6) ])
+
+class TestCheckpoint(unittest.TestCase):
+    def test_function(self):
+        x = jt.array([1.0, 2.0])
+        w = jt.array([3.0, 4.0])
+        y, z = jt.checkpoint(lambda a: (a * a * w, a.int32()), x, params=[w])
+        assert z.dtype == "int32"
+        dx, dw = jt.grad(y.sum(), [x, w])
+        np.testing.assert_allclose(dx.numpy(), [6, 16])
+        np.testing.assert_allclose(dw.numpy(), [1, 4])
+
+    def test_module(self):
+        x = jt.array(np.random.rand(8, 16).astype("float32"))
+        result = []
+        for mode in ["none", "every", "module", "function"]:
+            model = get_model()
+            if mode == "every":
+                model.checkpoint(every=4)
+            elif mode == "module":
+                for m in model:
+                    m.checkpoint()
+            if mode == "function":
+                y = jt.checkpoint(model, x)
+            else:
+                y = model(x)
+            loss = (y * y).sum()
+            grads = jt.grad(loss, model.parameters())
+            result.append([ g.numpy() for g in grads ])
+        for r in result[1:]:
+            for a, b in zip(result[0], r):
+                np.testing.assert_allclose(a, b, rtol=1e-5, atol=1e-6)
+
+    def test_optimizer(self):
+        x = jt.array(np.random.rand(8, 16).astype("float32"))
+        result = []
+        for ck in [False, True]:
+            model = get_model()
+            model.checkpoint(ck, every=2)
+            opt = nn.SGD(model.parameters(), 0.01)
+            for i in range(3):
+                opt.step(model(x).sqr().sum())
+            result.append([ p.numpy() for p in model.parameters() ])
+        for a, b in zip(*result):
+            np.testing.assert_allclose(a, b, rtol=1e-5, atol=1e-6)
+
+    def test_no_grad(self):
+        model = get_model().checkpoint()
+        with jt.no_grad():
+            y = model(jt.rand(2, 16))
+        assert y.shape == [2, 16]
+
+    def test_dropout(self):
+        x = jt.ones(1000)
+        w = jt.ones(1000)
+        y = jt.checkpoint(lambda a, b: nn.dropout(a, 0.5, is_train=True) * b,
+            x, w, params=[w])
+        # recompute uses the dropout mask of forward
+        dw = jt.grad(y.sum(), w)
+        np.testing.assert_allclose(dw.numpy(), y.numpy())
+        assert 0 < (y.numpy() == 0).sum() < 1000
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+# ***************************************************************
+# Copyright (c) 2022 Jittor. All Rights Reserved.
+# Maintainers:
+#     Dun Liang <randonlang@gmail.com>.
+#
+# This file is subject to the terms and conditions defined in
+# file 'LICENSE.txt', which is part of this source code package.
+# ***************************************************************
+import unittest
+import os
+import tempfile
+import jittor as jt
+import numpy as np
+from jittor import nn
+
+class TestCheckpointWriter(unittest.TestCase):
+    def test_writer(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            model = nn.Sequential(nn.Linear(32, 64), nn.Linear(64, 32))
+            opt = nn.Adam(model.parameters(), 0.1)
+            writer = jt.CheckpointWriter()
+            path = os.path.join(tmp, "model.pkl")
+            model.save(path, writer)
+            expect = { k:v.numpy() for k,v in model.state_dict().items() }
+            # changes after save are not in the checkpoint
+            model[0].weight.update(model[0].weight * 2)
+            writer.wait()
+            # two weights are written as blobs
+            assert writer.n_written == 2, writer.n_written
+            state = jt.load(path)
+            for k, v in expect.items():
+                np.testing.assert_allclose(state[k], v)
+
+            # only the changed weight is written
+            n_written, n_reused = writer.n_written, writer.n_reused
+            model.save(os.path.join(tmp, "model2.pkl"), writer)
+            writer.wait()
+            assert writer.n_written == n_written + 1
+            assert writer.n_reused == n_reused + 1
+            model2 = nn.Sequential(nn.Linear(32, 64), nn.Linear(64, 32))
+            model2.load(os.path.join(tmp, "model2.pkl"))
+            for a, b in zip(model.parameters(), model2.parameters()):
+                np.testing.assert_allclose(a.numpy(), b.numpy())
+            writer.save(opt.state_dict(), os.path.join(tmp, "opt.pkl"))
+            writer.wait()
+            opt.load_state_dict(jt.load(os.path.join(tmp, "opt.pkl")))
+
+            # corrupted blobs are detected
+            blob_dir = os.path.join(tmp, ".blobs")
+            for name in os.listdir(blob_dir):
+                fname = os.path.join(blob_dir, name)
+                np.save(fname, np.load(fname)+1)
+            with self.assertRaises(ValueError):
+                jt.load(path)
+
+    def test_writer_error(self):
+        writer = jt.CheckpointWriter()
+        writer.save({"a": jt.ones(2000)}, "/dev/null/a/b.pkl")
+        with self.assertRaises(OSError):
+            writer.wait()
+        writer.wait()
+
+class TestTensorFile(unittest.TestCase):
+    def test_save_load(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "model.jtt")
+            model = nn.Sequential(nn.Conv(3, 8, 3), nn.BatchNorm(8), nn.Linear(8, 4))
+            tensors = dict(model.state_dict())
+            tensors["scalar"] = np.array(3.0)
+            tensors["empty"] = np.zeros((0, 3), "int32")
+            tensors["half"] = np.arange(5).astype("float16")
+            jt.save_tensors(tensors, path)
+            state = jt.load(path)
+            assert isinstance(state, jt.ckpt.LazyTensors)
+            assert list(state.keys()) == list(tensors.keys())
+            for k, v in tensors.items():
+                a = state[k]
+                v = v.numpy() if isinstance(v, jt.Var) else v
+                assert a.dtype == v.dtype and a.shape == v.shape, k
+                np.testing.assert_allclose(a, v)
+                # tensor data is aligned
+                assert a.ctypes.data % 64 == 0 or a.size == 0, k
+
+            model2 = nn.Sequential(nn.Conv(3, 8, 3), nn.BatchNorm(8), nn.Linear(8, 4))
+            model2.load(path)
+            for a, b in zip(model.parameters(), model2.parameters()):
+                np.testing.assert_allclose(a.numpy(), b.numpy())
+
+    def test_selective_and_shards(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            a, b = os.path.join(tmp, "a.jtt"), os.path.join(tmp, "b.jtt")
+            jt.save_tensors({"x.w": jt.ones(3), "x.b": np.zeros(2)}, a)
+            jt.save_tensors({"y.w": jt.rand(4,16)}, b)
+            state = jt.load_tensors(a, keys=["x.w"])
+            assert list(state) == ["x.w"]
+            state = jt.load_tensors([a, b], keys=lambda k: k.endswith(".w"))
+            assert sorted(state) == ["x.w", "y.w"] and state["y.w"].shape == (4,16)
+            with self.assertRaises(KeyError):
+                jt.load_tensors(a, keys=["z"])
+
+            # corrupted tensor is detected when it is accessed
+            with open(b, "r+b") as f:
+                f.seek(-4, 2)
+                f.write(b"abcd")
+            state = jt.load_tensors([a, b])
+            state["x.w"]
+            with self.assertRaises(ValueError):
+                state["y.w"]
+            jt.load_tensors(b, verify=False)["y.w"]
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -6,6 +6,7 @@
 # ***************************************************************
 import unittest
 import jittor as jt
+import numpy as np
 import os
 from .test_log import find_log_with_re
 from .test_fused_op import retry
@@ -26,6 +27,34 @@ class TestCompileOptions(unittest.TestCase):
             c.sync()
         assert len(report)==2 and "compile_shapes:1" in report[1][0]
 
+    def test_dynamic_dims(self):
+        def run(n, **options):
+            a = jt.ones(n, 7) * n
+            with jt.flag_scope(compile_options=dict(compile_shapes=1, **options)):
+                b = (a.exp() + 1).sum(1)
+            with jt.log_capture_scope(log_silent=1, log_v=0,
+                log_vprefix="fused_op.cc=100") as logs:
+                b.sync()
+            np.testing.assert_allclose(b.numpy(), np.full(n, (np.exp(n)+1)*7), rtol=1e-5)
+            return len(find_log_with_re(logs, "Jit op key not found"))
+        run(3)
+        assert run(5) == 1
+        # batch size is a runtime parameter of kernels
+        run(3, dynamic_dims=1)
+        assert run(5, dynamic_dims=1) == 0
+        assert run(9, dynamic_dims=1) == 0
+
+    def test_pad_to_bucket(self):
+        assert jt.bucket_size(1) == 1
+        assert jt.bucket_size(5) == 8
+        assert jt.bucket_size(8) == 8
+        assert jt.bucket_size(5, [4, 16]) == 16
+        assert jt.bucket_size(20, [4, 16]) == 20
+        x = jt.array(np.arange(6).reshape(3, 2))
+        y = jt.pad_to_bucket(x, -2, value=-1)
+        np.testing.assert_allclose(y.numpy(), [[0,1],[2,3],[4,5],[-1,-1]])
+        assert jt.pad_to_bucket(x, 1) is x
+
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
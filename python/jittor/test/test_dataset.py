@@ -142,6 +142,325 @@ class TestDataset2(unittest.TestCase):
     def test_dataset_use_jittor_cuda(self):
         self.test_dataset_use_jittor()
 
+    def test_shm_slots(self):
+        class ImageDataset(Dataset):
+            def __init__(self):
+                super().__init__()
+                self.set_attrs(total_len=100)
+
+            def __getitem__(self, k):
+                return np.full((8,8,3), k, dtype="uint8"), k, { "a":np.float32([k,k+1]) }
+
+        for keep in [False, True]:
+            dataset = ImageDataset().set_attrs(batch_size=16, num_workers=2,
+                shm_slots=2, buffer_size=1024*1024, keep_numpy_array=keep)
+            for _ in range(2):
+                ids = []
+                for img, label, d in dataset:
+                    img, label, a = [ np.array(x) if keep else x.numpy() 
+                        for x in (img, label, d["a"]) ]
+                    assert img.shape[1:] == (8,8,3) and img.dtype == np.uint8
+                    np.testing.assert_equal(img[:,0,0,0], label)
+                    np.testing.assert_equal(a[:,1], label+1)
+                    ids += list(label)
+                assert sorted(ids) == list(range(100))
+            dataset.terminate()
+
+    def test_shm_slots_batch_transform(self):
+        class ImageDataset(Dataset):
+            def __init__(self):
+                super().__init__()
+                self.set_attrs(total_len=64)
+
+            def __getitem__(self, k):
+                return np.full((8,8,3), k, dtype="uint8"), k
+
+        # a slot only fits float32 output of batch transform,
+        # buffer is split into 2 slots and ring buffer
+        dataset = ImageDataset().set_attrs(batch_size=16, num_workers=2,
+            shm_slots=2, buffer_size=13824*3, keep_numpy_array=True,
+            batch_transform=transform.BatchCompose([
+                transform.BatchImageNormalize([0,0,0], [1,1,1])]))
+        for img, label in dataset:
+            assert img.shape == (16,3,8,8) and img.dtype == np.float32
+            np.testing.assert_allclose(img[:,0,0,0]*255, label, rtol=1e-5)
+            assert any(np.shares_memory(img, w.slots.buffer) for w in dataset.workers)
+        dataset.terminate()
+
+    def test_prefetch(self):
+        for keep in [False, True]:
+            dataset = YourDataset5().set_attrs(batch_size=8, num_workers=2,
+                prefetch=2, shm_slots=2, keep_numpy_array=keep)
+            for _ in range(2):
+                n = 0
+                for d in dataset:
+                    a = d['a'] if keep else d['a'].numpy()
+                    np.testing.assert_allclose(a, [[1,2,3]]*8)
+                    n += 1
+                assert n == 20
+            for i, d in enumerate(dataset):
+                if i == 3: break
+            assert len(list(dataset)) == 20
+            dataset.terminate()
+
+    def test_state_dict(self):
+        class RandDataset(Dataset):
+            def __init__(self):
+                super().__init__()
+                self.set_attrs(total_len=50)
+
+            def __getitem__(self, k):
+                return k, np.random.rand()
+
+        def items(x, y):
+            # random augmentation is reproducible only in workers
+            if not num_workers: y = y * 0
+            return [ (int(k), float(r)) for k, r in zip(x.numpy(), y.numpy()) ]
+
+        def run(dataset):
+            return sorted(sum([ items(x, y) for x, y in dataset ], []))
+
+        for num_workers in [0, 2]:
+            jt.set_global_seed(3)
+            dataset = RandDataset().set_attrs(batch_size=4, shuffle=True,
+                num_workers=num_workers)
+            expect = [run(dataset), run(dataset)]
+            dataset.terminate()
+
+            jt.set_global_seed(3)
+            dataset = RandDataset().set_attrs(batch_size=4, shuffle=True,
+                num_workers=num_workers)
+            seen = []
+            for i, (x, y) in enumerate(dataset):
+                seen += items(x, y)
+                if i == 4: break
+            state = dataset.state_dict()
+            assert state["batch_id"] == 5
+            dataset.terminate()
+
+            jt.set_global_seed(5)
+            dataset = RandDataset().set_attrs(batch_size=4, shuffle=True,
+                num_workers=num_workers)
+            dataset.load_state_dict(state)
+            assert sorted(seen + run(dataset)) == expect[0]
+            assert run(dataset) == expect[1]
+            dataset.terminate()
+
+    def test_state_dict_sampler(self):
+        from jittor.dataset import RandomSampler, Sampler
+        class CountSampler(Sampler):
+            # sampler with its own state
+            def __init__(self, dataset):
+                super().__init__(dataset)
+                self.count = 0
+            def __len__(self):
+                return self.dataset.__real_len__()
+            def __iter__(self):
+                self.count += 1
+                n = len(self)
+                return iter(np.roll(np.arange(n), self.count).tolist())
+            def state_dict(self):
+                return self.count
+            def load_state_dict(self, count):
+                self.count = count
+
+        def run(dataset):
+            return [ int(k) for x, in dataset for k in x.numpy() ]
+
+        for sampler in [RandomSampler, CountSampler]:
+            for num_workers in [0, 2]:
+                dataset = jt.dataset.VarDataset(jt.arange(30)) \
+                    .set_attrs(batch_size=4, num_workers=num_workers)
+                sampler(dataset)
+                run(dataset)
+                state = dataset.state_dict()
+                expect = [run(dataset), run(dataset)]
+                dataset.terminate()
+
+                dataset = jt.dataset.VarDataset(jt.arange(30)) \
+                    .set_attrs(batch_size=4, num_workers=num_workers)
+                sampler(dataset)
+                dataset.load_state_dict(state)
+                assert [run(dataset), run(dataset)] == expect
+                dataset.terminate()
+
+    def test_auto_workers(self):
+        import time
+        class SlowDataset(Dataset):
+            def __init__(self):
+                super().__init__()
+                self.set_attrs(total_len=64)
+
+            def __getitem__(self, k):
+                time.sleep(0.005)
+                return k
+
+        # loading is slower than training
+        dataset = SlowDataset().set_attrs(batch_size=4, num_workers=1,
+            auto_workers=4, buffer_size=64*1024*1024)
+        for _ in range(3):
+            ids = sorted(int(k) for x in dataset for k in x.numpy())
+            assert ids == list(range(64))
+        assert dataset.num_workers > 1
+        # ring buffer is shrunk to hold a few batches
+        assert dataset.buffer_size == 1<<20
+        dataset.terminate()
+
+        # training is slower than loading
+        dataset = SlowDataset().set_attrs(batch_size=4, num_workers=4,
+            auto_workers=4, endless=True)
+        ids = []
+        it = iter(dataset)
+        for i, x in enumerate(it):
+            time.sleep(0.05)
+            ids += x.numpy().tolist()
+            if i == 16*3-1: break
+        assert sorted(ids) == sorted(list(range(64))*3)
+        assert dataset.num_workers < 4
+        # workers are restarted without nesting generators
+        assert it.gi_yieldfrom is None
+        dataset.terminate()
+
+    def test_iterable_dataset(self):
+        from jittor.dataset import IterableDataset
+        class StreamDataset(IterableDataset):
+            def stream(self):
+                for i in range(103):
+                    yield i, np.float32([i, i+1])
+
+        class ShardDataset(IterableDataset):
+            def stream(self):
+                for i in range(self.shard_id, 103, self.num_shards):
+                    yield i, np.float32([i, i+1])
+
+        for num_workers, shm_slots, prefetch in [(0,0,0), (2,0,0), (3,2,2)]:
+            for cls, auto_shard in [(StreamDataset, True), (ShardDataset, False)]:
+                dataset = cls().set_attrs(batch_size=8, num_workers=num_workers,
+                    shm_slots=shm_slots, prefetch=prefetch, auto_shard=auto_shard)
+                for shuffle in [False, True]:
+                    dataset.set_attrs(shuffle=shuffle, shuffle_buffer=16)
+                    ids = []
+                    for x, y in dataset:
+                        assert x.shape[0] <= 8
+                        np.testing.assert_allclose(y.numpy()[:,1], x.numpy()+1)
+                        ids += list(x.numpy())
+                    assert sorted(ids) == list(range(103))
+                    if not shuffle and num_workers == 0:
+                        assert ids == list(range(103))
+                for i, (x, y) in enumerate(dataset):
+                    if i == 2: break
+                dataset.display_worker_status()
+                # number of batches of stream is unknown
+                assert dataset.batch_len is None
+                assert len(sum([ list(x.numpy()) for x, y in dataset ], [])) == 103
+                dataset.set_attrs(drop_last=True)
+                for x, y in dataset:
+                    assert x.shape[0] == 8
+                dataset.terminate()
+
+    def test_sample_cache(self):
+        class ImageDataset(Dataset):
+            def __init__(self):
+                super().__init__()
+                self.set_attrs(total_len=100)
+
+            def load_sample(self, k):
+                return np.full((8,8,3), k, dtype="uint8"), k
+
+            def transform_sample(self, sample):
+                img, k = sample
+                # random augmentation is not cached
+                return img, k, np.random.rand()
+
+            def __getitem__(self, k):
+                return self.transform_sample(self.load_sample(k))
+
+        for num_workers in [0, 2]:
+            dataset = ImageDataset().set_attrs(batch_size=16, shuffle=True,
+                num_workers=num_workers, cache_size=1024*1024)
+            rands = {}
+            for epoch in range(3):
+                ids = []
+                for img, label, r in dataset:
+                    np.testing.assert_equal(img.numpy()[:,0,0,0], label.numpy())
+                    ids += list(label.numpy())
+                    for k, x in zip(label.numpy(), r.numpy()):
+                        rands.setdefault(int(k), set()).add(float(x))
+                assert sorted(ids) == list(range(100))
+            assert all(len(v) == 3 for v in rands.values())
+            # workers may load a sample twice, and prefetch the next epoch
+            assert dataset._cache.misses.value >= 100
+            assert dataset._cache.hits.value + dataset._cache.misses.value >= 300
+            dataset.terminate()
+
+        # augmented samples of __getitem__ are not cached
+        class AugDataset(Dataset):
+            def __init__(self):
+                super().__init__()
+                self.set_attrs(total_len=32)
+
+            def __getitem__(self, k):
+                return k, np.random.rand()
+
+        dataset = AugDataset().set_attrs(batch_size=8, num_workers=2,
+            cache_size=1024*1024)
+        epochs = [ np.concatenate([ r.numpy() for k, r in dataset ]) for _ in range(2) ]
+        assert dataset._cache is None
+        assert (epochs[0] != epochs[1]).all()
+        dataset.terminate()
+
+        # eviction
+        import tempfile
+        from jittor.dataset.utils import SampleCache
+        with tempfile.TemporaryDirectory() as tmp:
+            for path in [None, os.path.join(tmp, "cache")]:
+                cache = SampleCache(10000, 100, path)
+                for i in np.random.randint(0, 100, 1000):
+                    hit, x = cache.get(i)
+                    if hit:
+                        np.testing.assert_equal(x, np.full(i+1, i))
+                    else:
+                        assert cache.put(i, np.full(i+1, i))
+                assert 0 < cache.hits.value < 1000
+                assert not cache.put(0, np.zeros(10000, "uint8"))
+
+    def test_persistent_workers(self):
+        class PidDataset(Dataset):
+            def __init__(self):
+                super().__init__()
+                self.scale = 1
+                self.set_attrs(total_len=100)
+
+            def __getitem__(self, k):
+                return k * self.scale, os.getpid()
+
+        for persistent in [True, False]:
+            dataset = PidDataset().set_attrs(batch_size=16, num_workers=2, 
+                persistent_workers=persistent)
+            for x, pid in dataset:
+                pass
+            pids = set(w.p.pid for w in dataset.workers)
+            dataset.set_attrs(batch_size=8, shuffle=True, scale=2)
+            ids = []
+            for x, pid in dataset:
+                assert x.shape[0] <= 8
+                ids += list(x.numpy())
+                assert (set(pid.numpy()) <= pids) == persistent
+            assert sorted(ids) == list(range(0, 200, 2))
+            if persistent:
+                # sampler is not sent to workers
+                from jittor.dataset import RandomSampler
+                dataset.set_attrs(sampler=RandomSampler(dataset))
+                assert set(w.p.pid for w in dataset.workers) == pids
+                ids = []
+                for x, pid in dataset:
+                    ids += list(x.numpy())
+                assert sorted(ids) == list(range(0, 200, 2))
+                # lambda cannot be sent, workers are restarted
+                dataset.set_attrs(scale=lambda: 1)
+                assert not hasattr(dataset, "workers")
+            dataset.terminate()
+
 class TestDatasetSeed(unittest.TestCase):
     def test_np(self):
 
@@ -0,0 +1,59 @@
+# ***************************************************************
+# Copyright (c) 2022 Jittor. All Rights Reserved.
+# Maintainers:
+#     Dun Liang <randonlang@gmail.com>.
+#
+# This file is subject to the terms and conditions defined in
+# file 'LICENSE.txt', which is part of this source code package.
+# ***************************************************************
+import unittest
+import os
+import re
+import sys
+import shutil
+import subprocess as sp
+import jittor as jt
+
+code = '''
+import jittor as jt
+a = jt.code([1], "float32", [jt.array([2.0])],
+    cpu_src="@out(0) = @in0(0) * 3 + 0.125; // test kernel bundle")
+print("result", a.item())
+'''
+
+@unittest.skipIf(os.name == 'nt', "Kernel bundle is not supported on windows")
+class TestKernelBundle(unittest.TestCase):
+    def run_code(self, **envs):
+        env = dict(os.environ, log_vprefix="jit_compiler=100", **envs)
+        r = sp.run([sys.executable, "-c", code], env=env, stdout=sp.PIPE, stderr=sp.STDOUT)
+        out = r.stdout.decode()
+        assert r.returncode == 0, out
+        assert "result 6.125" in out, out
+        return out
+
+    def test_kernel_bundle(self):
+        from jittor.utils.kernel_bundle import build_kernel_bundle
+        out = self.run_code()
+        libs = re.findall("Opening jit lib: .*/jit/(\\S*code\\S*\\.so)", out)
+        assert len(libs) == 1, out
+
+        # keep bundles of the cache path
+        bundle_dir = os.path.join(jt.flags.cache_path, "kernel_bundle")
+        backup = bundle_dir + ".bk"
+        if os.path.isdir(bundle_dir):
+            shutil.rmtree(backup, ignore_errors=True)
+            os.rename(bundle_dir, backup)
+        try:
+            assert build_kernel_bundle(names=libs) == 1
+            out = self.run_code()
+            assert "Load jit op from kernel bundle" in out, out
+            out = self.run_code(use_kernel_bundle="0")
+            assert "Load jit op from kernel bundle" not in out, out
+        finally:
+            shutil.rmtree(bundle_dir, ignore_errors=True)
+            if os.path.isdir(backup):
+                os.rename(backup, bundle_dir)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -11,7 +11,9 @@ import jittor as jt
 from jittor import nn
 from jittor.models import resnet
 import numpy as np
-import sys, os
+import sys, os, io
+import zipfile
+import tempfile
 import random
 import math
 import unittest
@@ -58,6 +60,88 @@ class TestLoadPth(unittest.TestCase):
         # torch_out = torch_model(torch_img)
         print(np.max(np.abs(jt_out.fetch_sync() - torch_out.detach().numpy())))
         assert np.max(np.abs(jt_out.fetch_sync() - torch_out.detach().numpy())) < 1e-3
-    
+
+def save_fake_pth(tensors, path, compression=zipfile.ZIP_STORED):
+    ''' Saves numpy arrays in the zip format of pytorch without torch,
+    tensors is a dict of (storage array, offset, shape, stride). '''
+    import pickle, types
+    from collections import OrderedDict
+    torch = types.ModuleType("torch")
+    utils = types.ModuleType("torch._utils")
+    def _rebuild_tensor_v2(*args): pass
+    _rebuild_tensor_v2.__module__ = "torch._utils"
+    _rebuild_tensor_v2.__qualname__ = "_rebuild_tensor_v2"
+    utils._rebuild_tensor_v2 = _rebuild_tensor_v2
+    storage_types = {}
+    for name in ["FloatStorage", "DoubleStorage", "LongStorage"]:
+        storage_types[name] = type(name, (), {"__module__": "torch"})
+        setattr(torch, name, storage_types[name])
+    dtype_map = {"float32": "FloatStorage", "float64": "DoubleStorage", "int64": "LongStorage"}
+
+    class Storage:
+        def __init__(self, key, data):
+            self.key, self.data = key, data
+    class Tensor:
+        def __init__(self, *args):
+            self.args = args
+        def __reduce__(self):
+            return (_rebuild_tensor_v2, self.args + (False, OrderedDict()))
+    class Pickler(pickle.Pickler):
+        def persistent_id(self, obj):
+            if isinstance(obj, Storage):
+                return ("storage", storage_types[dtype_map[str(obj.data.dtype)]],
+                    obj.key, "cpu", obj.data.size)
+            return None
+
+    storages = {}
+    state = OrderedDict()
+    for k, (data, offset, shape, stride) in tensors.items():
+        if id(data) not in storages:
+            storages[id(data)] = Storage(str(len(storages)), data)
+        state[k] = Tensor(storages[id(data)], offset, shape, stride)
+    sys.modules["torch"], sys.modules["torch._utils"] = torch, utils
+    try:
+        f = io.BytesIO()
+        Pickler(f, 2).dump(state)
+    finally:
+        del sys.modules["torch"], sys.modules["torch._utils"]
+    with zipfile.ZipFile(path, "w", compression) as z:
+        z.writestr("archive/data.pkl", f.getvalue())
+        for st in storages.values():
+            z.writestr("archive/data/"+st.key, st.data.tobytes())
+
+class TestLoadPthMmap(unittest.TestCase):
+    def test_load(self):
+        w = np.random.rand(4, 3).astype("float32")
+        buf = np.arange(10).astype("int64")
+        tensors = {
+            "weight": (w.ravel(), 0, (4, 3), (3, 1)),
+            # transposed view of the same storage
+            "t": (w.ravel(), 0, (3, 4), (1, 3)),
+            "offset": (buf, 2, (2, 3), (3, 1)),
+            "scalar": (np.array([2.5]), 0, (), ()),
+        }
+        expect = {"weight": w, "t": w.T, "offset": buf[2:8].reshape(2, 3),
+            "scalar": np.array(2.5)}
+        from jittor_utils.load_pytorch import load_pytorch
+        with tempfile.TemporaryDirectory() as tmp:
+            for compression in [zipfile.ZIP_DEFLATED, zipfile.ZIP_STORED]:
+                path = os.path.join(tmp, "a.pth")
+                save_fake_pth(tensors, path, compression)
+                state = jt.load(path)
+                for k, v in expect.items():
+                    assert isinstance(state[k], jt.Var)
+                    np.testing.assert_allclose(state[k].numpy(), v)
+
+            state = load_pytorch(path, to_numpy=True)
+            for k, v in expect.items():
+                # zero-copy views of the mmap
+                assert not state[k].flags.owndata
+                np.testing.assert_allclose(state[k], v)
+
+            linear = nn.Linear(3, 4, bias=False)
+            linear.load(path)
+            np.testing.assert_allclose(linear.weight.numpy(), w)
+
 if __name__ == "__main__":
     unittest.main()
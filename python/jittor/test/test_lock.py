@@ -23,6 +23,32 @@ class TestLock(unittest.TestCase):
         print("run cmd twice", cmd)
         assert os.system(f"{cmd} & {cmd} & wait %1 && wait %2") == 0
 
+    def test_compile_same_kernel(self):
+        import random
+        import subprocess as sp
+        c = random.randint(0, 1<<20)
+        # one kernel shared by all processes, one kernel of each process
+        code = f'''
+import sys
+import jittor as jt
+a = jt.code([1], "float32", [jt.array([2.0])],
+    cpu_src="@out(0) = @in0(0) * 3 + {c};")
+b = jt.code([1], "float32", [jt.array([2.0])],
+    cpu_src="@out(0) = @in0(0) * 3 + {c} + " + sys.argv[1] + ";")
+print("result", a.item(), b.item())
+'''
+        env = dict(os.environ, log_vprefix="cache_compile=10", use_kernel_bundle="0")
+        ps = [ sp.Popen([sys.executable, "-c", code, str(i)], env=env,
+            stdout=sp.PIPE, stderr=sp.STDOUT) for i in range(4) ]
+        outs = [ p.communicate()[0].decode() for p in ps ]
+        for i, (p, out) in enumerate(zip(ps, outs)):
+            assert p.returncode == 0, out
+            assert f"result {6+c}.0 {6+c+i}.0" in out, out
+        # processes wait for the same kernel compiled by the first one
+        compiled = [ l for l in "".join(outs).splitlines()
+            if "Cache key of" in l and "/code_" in l ]
+        assert len(compiled) == 5, compiled
+
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
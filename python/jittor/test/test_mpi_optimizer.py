@@ -0,0 +1,114 @@
+# ***************************************************************
+# Copyright (c) 2022 Jittor. All Rights Reserved.
+# Maintainers:
+#     Dun Liang <randonlang@gmail.com>.
+#
+# This file is subject to the terms and conditions defined in
+# file 'LICENSE.txt', which is part of this source code package.
+# ***************************************************************
+import unittest
+import jittor as jt
+import numpy as np
+from jittor import nn
+from jittor.test.test_mpi import run_mpi_test
+mpi = jt.compile_extern.mpi
+
+def get_params():
+    np.random.seed(0)
+    return [ jt.array(np.random.rand(*shape)).cast(dtype)
+        for shape, dtype in [((10,3), "float32"), ((7,), "float64"),
+            ((4,5), "float32"), ((3,), "float32")] ]
+
+def get_loss(params, rank):
+    return sum(((p*p) * (rank+j+1)).sum() for j, p in enumerate(params))
+
+@unittest.skipIf(not jt.in_mpi, "no inside mpirun")
+class TestMpiOptimizer(unittest.TestCase):
+    def test_bucket_all_reduce(self):
+        n = mpi.world_size()
+        expect = [ p.numpy() for p in get_params() ]
+        for _ in range(3):
+            # grad of p is mean of 2*p*(rank+j+1) over ranks
+            expect = [ p - 0.1 * 2 * p * np.mean([ r+j+1 for r in range(n) ])
+                for j, p in enumerate(expect) ]
+        # 1e-4 MB splits grads into several buckets
+        for bucket_size_mb in [0, 1e-4, 25]:
+            params = get_params()
+            opt = nn.SGD(params, 0.1)
+            opt.bucket_size_mb = bucket_size_mb
+            if bucket_size_mb:
+                assert len(opt._grad_buckets(params)) == (3 if bucket_size_mb < 1 else 2)
+            for _ in range(3):
+                opt.step(get_loss(params, mpi.world_rank()))
+            for p, e in zip(params, expect):
+                np.testing.assert_allclose(p.numpy(), e, rtol=1e-5)
+
+    def test_sharded_optimizer(self):
+        result = []
+        for sharded in [False, True]:
+            params = get_params()
+            if sharded:
+                opt = nn.ShardedOptimizer(nn.Adam, params, 0.01)
+                # each rank keeps moments of half of params
+                n = sum(int(np.prod(p.shape)) for p in params)
+                m = sum(int(np.prod(v.shape)) for pg in opt._optimizer.param_groups
+                    for v in pg["m"])
+                assert m <= n // mpi.world_size() + 2, (m, n)
+            else:
+                opt = nn.Adam(params, 0.01)
+            for _ in range(3):
+                opt.step(get_loss(params, mpi.world_rank()))
+            result.append([ p.numpy() for p in params ])
+        for a, b in zip(*result):
+            np.testing.assert_allclose(a, b, rtol=1e-5)
+
+    def test_comm_hooks(self):
+        n = mpi.world_size()
+        expect = [ p.numpy() for p in get_params() ]
+        expect = [ p - 0.1 * 2 * p * np.mean([ r+j+1 for r in range(n) ])
+            for j, p in enumerate(expect) ]
+        hooks = [nn.CommHook(), nn.FP16CompressHook(),
+            nn.TopKCompressHook(1.0), nn.TopKCompressHook(0.1),
+            nn.PowerSGDHook(1)]
+        sent = []
+        for hook in hooks:
+            params = get_params()
+            if isinstance(hook, nn.PowerSGDHook):
+                # grads of rank 1 params are exactly approximated
+                for p in params:
+                    if p.ndim == 2:
+                        p.assign(p[:, :1] * (p[:1, :] + 1))
+                expect_p = [ p - 0.1 * 2 * p * np.mean([ r+j+1 for r in range(n) ])
+                    for j, p in enumerate(p.numpy() for p in params) ]
+            else:
+                expect_p = expect
+            opt = nn.SGD(params, 0.1)
+            opt.comm_hook = hook
+            opt.step(get_loss(params, mpi.world_rank()))
+            sent.append(hook.sent_bytes)
+            if isinstance(hook, nn.TopKCompressHook) and hook.ratio < 1:
+                continue
+            # float16 grads have about 3 significant digits
+            atol = 1e-3 if isinstance(hook, nn.FP16CompressHook) else 1e-5
+            for p, e in zip(params, expect_p):
+                np.testing.assert_allclose(p.numpy(), e, rtol=1e-5, atol=atol)
+        assert sent[1] < sent[0] and sent[3] < sent[0] and sent[4] < sent[0], sent
+
+        # by error feedback, unsent grads are sent in later steps
+        params = get_params()
+        p0 = [ p.numpy() for p in params ]
+        opt = nn.SGD(params, 0.1)
+        opt.comm_hook = nn.TopKCompressHook(0.1)
+        for i in range(20):
+            opt.step(sum(p.sum() for p in params))
+        for p, e in zip(params, p0):
+            assert (p.numpy() < e).all()
+
+
+@unittest.skipIf(not jt.compile_extern.has_mpi, "no mpi found")
+class TestMpiOptimizerEntry(unittest.TestCase):
+    def test(self):
+        run_mpi_test(2, "test_mpi_optimizer")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -34,6 +34,58 @@ class TestOptimizer(unittest.TestCase):
         assert np.allclose(opt.param_groups[0]['grads'][0].norm(), 0.01)
         opt.step()
 
+    def test_clip_grad_norm_fused(self):
+        for norm_type in [1, 2, 3, float("inf")]:
+            for opt_cls, kw in [(nn.SGD, {}), (nn.Adam, {}), (nn.Adam, {"flatten":True})]:
+                result = []
+                for fused in [False, True]:
+                    jt.set_global_seed(0)
+                    ps = [jt.rand(3,4), jt.rand(5), jt.rand(2,dtype="float64")]
+                    opt = opt_cls(ps, 0.1, **kw)
+                    for i in range(2):
+                        opt.backward(sum(((p*p)*(j+1)).sum() for j,p in enumerate(ps)))
+                        opt.clip_grad_norm(0.5, norm_type, fused)
+                        g = opt.param_groups[0]["grads"][0]
+                        norm = np.linalg.norm(g.numpy().ravel(), norm_type)
+                        # grads are not clipped in place by fused clip
+                        assert (norm > 0.5) == fused, (norm, fused)
+                        opt.step()
+                    result.append([ p.numpy() for p in ps ])
+                for a, b in zip(*result):
+                    np.testing.assert_allclose(a, b, rtol=1e-5)
+
+    def test_schedule_no_recompile(self):
+        from jittor.test.test_log import find_log_with_re
+        for opt_cls, kw in [(nn.SGD, {"momentum":0.9}), (nn.Adam, {}),
+            (nn.Adam, {"flatten":True}), (nn.AdamW, {"weight_decay":0.1})]:
+            np.random.seed(0)
+            w = np.random.rand(3, 5).astype("float32")
+            x = jt.array(np.random.rand(4, 5).astype("float32"))
+            lrs = [0.3, 0.1, 0.25, 0.0, 1.0, 2.0, 0.5]
+            p = jt.array(w)
+            opt = opt_cls([p], 1.0, **kw)
+            sched = jt.optim.LambdaLR(opt, lambda i: lrs[i % len(lrs)])
+            for i in range(len(lrs)):
+                with jt.log_capture_scope(log_silent=1,
+                    log_v=0, log_vprefix="op.cc=100") as raw_log:
+                    opt.step((p * x.sum(0)).sqr().sum())
+                    sched.step()
+                    p.sync()
+                logs = find_log_with_re(raw_log, "(Jit op key not found: .*)")
+                # lr 0, 1 and 2 were constants of update kernels
+                if i >= 3:
+                    assert len(logs) == 0, (opt_cls, kw, lrs[i], logs)
+
+            # the same result as lr of python floats
+            q = jt.array(w)
+            opt2 = opt_cls([q], 1.0, **kw)
+            for lr in lrs:
+                opt2.lr = lr
+                opt2._hyper_vars.clear()
+                opt2._n_step = None
+                opt2.step((q * x.sum(0)).sqr().sum())
+            np.testing.assert_allclose(p.numpy(), q.numpy(), rtol=1e-5, atol=1e-6)
+
     def test_state_dict(self):
         a = jt.ones(2)
         opt = jt.optim.SGD([a], 0.1)
@@ -48,6 +100,47 @@ class TestOptimizer(unittest.TestCase):
         g = a.opt_grad(opt)
         np.testing.assert_allclose(g.data, 2)
 
+    def test_flatten(self):
+        opts = [
+            (nn.SGD, dict(momentum=0.9, weight_decay=1e-3, nesterov=True)),
+            (nn.RMSprop, {}),
+            (nn.Adam, dict(weight_decay=1e-3)),
+            (nn.AdamW, dict(weight_decay=0.1)),
+        ]
+        for opt_cls, kw in opts:
+            result = []
+            for flatten in [False, True]:
+                jt.set_global_seed(0)
+                ps = [jt.rand(3,4), jt.rand(5), jt.rand(2,2,2), jt.rand(7,dtype="float64")]
+                opt = opt_cls(ps, 0.01, flatten=flatten, **kw)
+                for i in range(5):
+                    if i == 2: ps[2].stop_grad()
+                    loss = sum((p*p*(j+1)).sum() for j,p in enumerate(ps)
+                        if not p.is_stop_grad())
+                    opt.step(loss)
+                if flatten:
+                    # one buffer of each dtype
+                    assert len(opt.param_groups[0]["values"]) == 2
+                result.append([ p.numpy() for p in ps ])
+            for a, b in zip(*result):
+                np.testing.assert_allclose(a, b, rtol=1e-5, atol=1e-6)
+
+    def test_sharded_optimizer(self):
+        result = []
+        for sharded in [False, True]:
+            jt.set_global_seed(0)
+            pa, pb = jt.rand(3,4), jt.rand(5)
+            groups = [{"params":[pa], "lr":0.1}, {"params":[pb]}]
+            if sharded:
+                opt = nn.ShardedOptimizer(nn.Adam, groups, 0.01, betas=(0.8, 0.9))
+            else:
+                opt = nn.Adam(groups, 0.01, betas=(0.8, 0.9))
+            for i in range(3):
+                opt.step((pa*pa).sum() + (pb*pb*pb).sum())
+            result.append([pa.numpy(), pb.numpy()])
+        for a, b in zip(*result):
+            np.testing.assert_allclose(a, b, rtol=1e-5)
+
 
         
 
@@ -0,0 +1,64 @@
+# ***************************************************************
+# Copyright (c) 2022 Jittor. All Rights Reserved.
+# Maintainers:
+#     Dun Liang <randonlang@gmail.com>.
+#
+# This file is subject to the terms and conditions defined in
+# file 'LICENSE.txt', which is part of this source code package.
+# ***************************************************************
+import unittest
+import os
+import re
+import sys
+import json
+import random
+import tempfile
+import subprocess as sp
+import jittor as jt
+from jittor.precompile import precompile_kernels
+
+code = '''
+import sys
+import jittor as jt
+jt.record_kernels(sys.argv[1])
+a = jt.code([1], "float32", [jt.array([2.0])],
+    cpu_src="@out(0) = @in0(0) * 3 + {};")
+print("result", a.item())
+'''
+
+class TestPrecompile(unittest.TestCase):
+    def run_code(self, code, manifest):
+        env = dict(os.environ, log_vprefix="jit_compiler=100,cache_compile=100",
+            use_kernel_bundle="0")
+        r = sp.run([sys.executable, "-c", code, manifest], env=env,
+            stdout=sp.PIPE, stderr=sp.STDOUT)
+        out = r.stdout.decode()
+        assert r.returncode == 0, out
+        return out
+
+    def test_precompile(self):
+        # a new kernel which is not cached
+        c = random.randint(0, 1<<20)
+        code2 = code.format(c)
+        with tempfile.TemporaryDirectory() as tmp:
+            manifest = os.path.join(tmp, "manifest.json")
+            out = self.run_code(code2, manifest)
+            assert f"result {2*3+c}.0" in out, out
+            with open(manifest) as f:
+                kernels = json.load(f)["kernels"]
+            assert any(str(c) in k["src"] for k in kernels), kernels
+
+            lib = re.findall("Opening jit lib: (\\S*code\\S*\\.so)", out)[0]
+            os.remove(lib)
+            os.remove(lib + ".key")
+            assert precompile_kernels(manifest) == len(kernels)
+            assert os.path.isfile(lib)
+
+            # kernels are not compiled again
+            out = self.run_code(code2, manifest)
+            assert f"result {2*3+c}.0" in out, out
+            assert "Cache key of" not in out, out
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+# ***************************************************************
+# Copyright (c) 2022 Jittor. All Rights Reserved. 
+# Maintainers: 
+#     Dun Liang <randonlang@gmail.com>. 
+# 
+# This file is subject to the terms and conditions defined in
+# file 'LICENSE.txt', which is part of this source code package.
+# ***************************************************************
+import unittest
+import jittor as jt
+import numpy as np
+import os
+from jittor.dataset import RecordDataset, RecordWriter
+
+
+class TestRecordDataset(unittest.TestCase):
+    def setUp(self):
+        self.prefix = os.path.join(jt.flags.cache_path, "test_record", "data")
+        # 10 records per shard
+        with RecordWriter(self.prefix, shard_size=200) as w:
+            for i in range(35):
+                w.write((np.full((2,), i, "int32"), i))
+        self.paths = w.paths
+
+    def test_read(self):
+        assert len(self.paths) > 1
+        dataset = RecordDataset(self.prefix)
+        assert len(dataset) == 35 // 16 + 1
+        for i in [0, 9, 10, 34]:
+            x, y = dataset[i]
+            assert y == i
+            np.testing.assert_equal(x, [i,i])
+        ids = []
+        for x, y in dataset:
+            ids += list(y.numpy())
+        assert ids == list(range(35))
+
+    def test_shard_shuffle(self):
+        dataset = RecordDataset(self.prefix).set_attrs(shuffle=True, batch_size=1)
+        index_list = list(dataset._get_index_list())
+        assert sorted(index_list) == list(range(35))
+        # samples of the same shard are adjacent
+        sid = np.searchsorted(dataset.shard_start, index_list, side="right")
+        assert (np.diff(sid) != 0).sum() == len(self.paths) - 1
+        # interleave every 2 shards
+        dataset = RecordDataset(self.prefix, shuffle_shards=2).set_attrs(
+            shuffle=True, batch_size=1)
+        index_list = list(dataset._get_index_list())
+        assert sorted(index_list) == list(range(35))
+        sid = np.searchsorted(dataset.shard_start, index_list, side="right")
+        # two groups of shards
+        n = sorted(list(sid).index(s) for s in set(sid))[2]
+        assert len(set(sid[:n])) == 2 and not set(sid[:n]) & set(sid[n:])
+
+    def test_multi_workers(self):
+        dataset = RecordDataset(self.prefix).set_attrs(
+            shuffle=True, batch_size=4, num_workers=2)
+        ids = []
+        for x, y in dataset:
+            np.testing.assert_equal(x.numpy()[:,0], y.numpy())
+            ids += list(y.numpy())
+        assert sorted(ids) == list(range(35))
+
+
+if __name__ == "__main__":
+    unittest.main()
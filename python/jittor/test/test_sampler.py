@@ -54,6 +54,30 @@ class TestSampler(unittest.TestCase):
         for batch in batchsampler:
             assert len(batch) == 4
 
+    def test_batch_sampler_workers(self):
+        for num_workers in [0, 2]:
+            testdataset = TestSamplerDataset().set_attrs(num_workers=num_workers)
+            BatchSampler(SequentialSampler(testdataset), 16, drop_last=False)
+            assert len(testdataset) == 3
+            for _ in range(2):
+                sizes = [ len(data) for data in testdataset ]
+                assert sorted(sizes) == [8, 16, 16], sizes
+            # variable size batches, e.g. bucketed by length
+            batches = [[0,1,2], list(range(3,20)), [39], list(range(20,30))]
+            testdataset.set_attrs(sampler=batches)
+            assert len(testdataset) == 4
+            for _ in range(2):
+                data = [ d.numpy().tolist() for d in testdataset ]
+                assert sorted(data) == sorted([ [i**2 for i in b] for b in batches ])
+            testdataset.terminate()
+
+    def test_subset_random_sampler_workers(self):
+        testdataset = TestSamplerDataset().set_attrs(num_workers=2, batch_size=4)
+        SubsetRandomSampler(testdataset, (20, 30))
+        data = sorted(sum([ d.numpy().tolist() for d in testdataset ], []))
+        assert data == [ i**2 for i in range(20, 30) ]
+        testdataset.terminate()
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -954,6 +954,42 @@ class Tester(unittest.TestCase):
             transform.ToTensor(),
         ])(img)
 
+    def test_batch_transform(self):
+        imgs = np.random.randint(0, 256, (4, 20, 30, 3)).astype("uint8")
+        mean, std = [0.485, 0.456, 0.406], [0.229, 0.224, 0.225]
+        out = transform.BatchImageNormalize(mean, std)(imgs)
+        for i in range(4):
+            expect = transform.ImageNormalize(mean, std)(Image.fromarray(imgs[i]))
+            assert_array_almost_equal(out[i], expect, decimal=4)
+
+        # crop the whole image without resizing is identity
+        crop = transform.BatchRandomCropAndResize((20, 30), scale=(1,1), ratio=(1.5,1.5))
+        assert_array_almost_equal(crop(imgs), imgs)
+        flip = transform.BatchRandomHorizontalFlip(p=1)
+        assert_array_almost_equal(flip(imgs), imgs[:,:,::-1])
+        fused = transform.BatchCompose([crop, flip])((imgs, 1))
+        assert_array_almost_equal(fused[0], imgs[:,:,::-1])
+        assert fused[1] == 1
+
+        out = transform.BatchRandomCropAndResize(8)(imgs)
+        assert out.shape == (4, 8, 8, 3) and out.dtype == np.float32
+        assert out.min() >= 0 and out.max() <= 255
+        center = transform.BatchCenterCrop((10, 10))(imgs)
+        for i in range(4):
+            expect = transform.CenterCrop((10, 10))(Image.fromarray(imgs[i]))
+            assert_array_almost_equal(center[i], np.array(expect))
+
+        for name in ["brightness", "contrast", "saturation"]:
+            out = transform.BatchColorJitter(**{name:(0.5,0.5)})(imgs)
+            adjust = getattr(transform, "adjust_"+name)
+            for i in range(4):
+                expect = adjust(Image.fromarray(imgs[i]), 0.5)
+                assert np.abs(out[i] - np.array(expect)).max() <= 2
+        out = transform.BatchColorJitter(hue=(0.5,0.5))(imgs)
+        for i in range(4):
+            expect = transform.adjust_hue(Image.fromarray(imgs[i]), 0.5)
+            assert np.abs(out[i] - np.array(expect)).mean() <= 2
+
     def test_not_pil_image(self):
         img = jt.random((30,40,3))
         result = transform.Compose([
@@ -34,7 +34,41 @@ class TestUtils(unittest.TestCase):
     def test_cache_compile(self):
         cmd = f"cd {cache_path} && g++ {jittor_path}/src/utils/log.cc {jittor_path}/src/utils/tracer.cc {jittor_path}/src/utils/str_utils.cc {jittor_path}/src/utils/cache_compile.cc -lpthread {cc_flags} -o cache_compile && cache_path={cache_path} jittor_path={jittor_path} ./cache_compile"
         self.assertEqual(os.system(cmd), 0)
-        
+
+    def test_cache_compile_source_infos(self):
+        import time, tempfile
+        import jittor_utils as jit_utils
+        import jittor as jt
+        with tempfile.TemporaryDirectory() as tmp:
+            os.makedirs(os.path.join(tmp, "obj_files"))
+            cc = os.path.join(tmp, "cc.sh")
+            with open(cc, "w") as f:
+                f.write('#!/bin/sh\nfor last; do :; done\ntouch "$last"\n')
+            os.chmod(cc, 0o755)
+            src, header = os.path.join(tmp, "a.cc"), os.path.join(tmp, "a.h")
+            def write(fname, s, mtime):
+                with open(fname, "w") as f:
+                    f.write(s)
+                # recently modified files are not cached
+                os.utime(fname, (mtime, mtime))
+            now = time.time()
+            write(src, '#include "a.h"\n', now-100)
+            write(header, "int a;", now-100)
+            cmd = f"{cc} {src} -I{tmp} -o {tmp}/a.o"
+            compile = lambda: jit_utils.cc.cache_compile(cmd, tmp, jt.flags.jittor_path)
+            assert compile()
+            assert not compile()
+            # changes are found by stat
+            write(header, "int b;", now-90)
+            assert compile()
+            assert not compile()
+            write(header, "int bb;", now-90)
+            assert compile()
+            assert not compile()
+            # hashes are saved in cache path of the first call
+            with open(os.path.join(jt.flags.cache_path, "source_infos")) as f:
+                assert header+"\t" in f.read()
+
     def test_log(self):
         return
         cc_flags = f" -g -O3 -DTEST_LOG -DLOG_ASYNC --std=c++14 -I{jittor_path}/test -I{jittor_path}/src -lpthread "
@@ -1468,3 +1468,6 @@ class RandomAffine(object):
         d = dict(self.__dict__)
         d['resample'] = str(d['resample'])
         return s.format(name=self.__class__.__name__, **d)
+
+from .batch import BatchCompose, BatchRandomCropAndResize, BatchRandomHorizontalFlip, \
+    BatchCenterCrop, BatchColorJitter, BatchImageNormalize, batch_crop_and_resize
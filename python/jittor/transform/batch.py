@@ -0,0 +1,316 @@
+# ***************************************************************
+# Copyright (c) 2022 Jittor.
+# All Rights Reserved.
+# Maintainers:
+#     Dun Liang <randonlang@gmail.com>.
+#
+# This file is subject to the terms and conditions defined in
+# file 'LICENSE.txt', which is part of this source code package.
+# ***************************************************************
+'''
+Batch level transforms, which run on a collated NHWC image batch as a
+whole with numpy, rather than one PIL image at a time. Random parameters
+are sampled for each image of the batch.
+
+Pixel values of input batch are in [0, 255], either uint8 or float32,
+geometric transforms output float32 batch, so that the following
+transforms (e.g. BatchImageNormalize) work without rounding to uint8.
+
+Example::
+
+    from jittor import transform
+    dataset = ImageFolder(root).set_attrs(batch_size=256,
+        batch_transform=transform.BatchCompose([
+            transform.BatchRandomCropAndResize(224),
+            transform.BatchRandomHorizontalFlip(),
+            transform.BatchImageNormalize(mean=[0.485, 0.456, 0.406],
+                                          std=[0.229, 0.224, 0.225]),
+        ]))
+'''
+import math
+import numpy as np
+from . import ColorJitter, _setup_size
+
+
+def batch_crop_and_resize(batch, top, left, height, width, size, flip=None):
+    """
+    Crop box [top:top+height, left:left+width] of each image and resize it
+    to size with bilinear interpolation, all images are sampled by one
+    vectorized gather.
+
+    Args::
+
+        [in] batch(np.ndarray): images in shape (N, H, W, C).
+        [in] top, left, height, width(np.ndarray): crop box of each image, in shape (N,).
+        [in] size(tuple): (height, width) of output images.
+        [in] flip(np.ndarray): optional, bool mask of images to be flipped horizontally.
+
+    Returns::
+
+        [out] float32 np.ndarray in shape (N, size[0], size[1], C).
+    """
+    n, h, w = batch.shape[:3]
+    oh, ow = size
+    def coords(start, length, osize, limit):
+        # align pixel centers like PIL
+        step = np.float32(length) / osize
+        c = start[:,None] + (np.arange(osize, dtype="float32")[None,:] + 0.5) * step[:,None] - 0.5
+        c = np.clip(c, 0, limit-1)
+        c0 = np.floor(c).astype("int32")
+        c1 = np.minimum(c0+1, limit-1)
+        return c0, c1, (c - c0)[...,None]
+    y0, y1, wy = coords(np.float32(top), np.float32(height), oh, h)
+    x0, x1, wx = coords(np.float32(left), np.float32(width), ow, w)
+    if flip is not None:
+        x0[flip] = x0[flip][:,::-1]
+        x1[flip] = x1[flip][:,::-1]
+        wx[flip] = wx[flip][:,::-1]
+    ni = np.arange(n)[:,None,None]
+    y0, y1, wy = y0[:,:,None], y1[:,:,None], wy[:,:,None]
+    x0, x1, wx = x0[:,None,:], x1[:,None,:], wx[:,None,:]
+    top_row = batch[ni, y0, x0].astype("float32")
+    top_row += (batch[ni, y0, x1] - top_row) * wx
+    bottom_row = batch[ni, y1, x0].astype("float32")
+    bottom_row += (batch[ni, y1, x1] - bottom_row) * wx
+    top_row += (bottom_row - top_row) * wy
+    return top_row
+
+
+class BatchRandomCropAndResize:
+    """Random crop and resize each image of batch to given size,
+    batch version of RandomCropAndResize.
+
+    Args::
+
+        [in] size(int or tuple): [height, width] of the output image.
+        [in] scale(tuple): range of scale ratio of the area.
+        [in] ratio(tuple): range of aspect ratio.
+
+    Example::
+
+        transform = transform.BatchRandomCropAndResize(224)
+        imgs_ = transform(imgs)
+    """
+    def __init__(self, size, scale:tuple=(0.08, 1.0), ratio:tuple=(3. / 4., 4. / 3.)):
+        self.size = _setup_size(size, error_msg="If size is a sequence, it should have 2 values")
+        assert scale[0] <= scale[1] and ratio[0] <= ratio[1]
+        self.scale = scale
+        self.ratio = ratio
+
+    def get_params(self, n, height, width, tries=10):
+        ''' Return crop box (top, left, h, w) of n images. '''
+        area = height * width
+        target_area = np.random.uniform(*self.scale, size=(n, tries)) * area
+        log_ratio = (math.log(self.ratio[0]), math.log(self.ratio[1]))
+        aspect_ratio = np.exp(np.random.uniform(*log_ratio, size=(n, tries)))
+        w = np.round(np.sqrt(target_area * aspect_ratio)).astype("int32")
+        h = np.round(np.sqrt(target_area / aspect_ratio)).astype("int32")
+        ok = (w > 0) & (w <= width) & (h > 0) & (h <= height)
+        # take the first valid try of each image
+        k = np.argmax(ok, axis=1)
+        ok = ok[np.arange(n), k]
+        w = w[np.arange(n), k]
+        h = h[np.arange(n), k]
+
+        # fallback to central crop
+        in_ratio = float(width) / float(height)
+        if in_ratio < min(self.ratio):
+            fw, fh = width, int(round(width / min(self.ratio)))
+        elif in_ratio > max(self.ratio):
+            fw, fh = int(round(height * max(self.ratio))), height
+        else:
+            fw, fh = width, height
+        w = np.where(ok, w, fw)
+        h = np.where(ok, h, fh)
+        top = np.where(ok,
+            np.floor(np.random.uniform(size=n) * (height - h + 1)), (height - h) // 2)
+        left = np.where(ok,
+            np.floor(np.random.uniform(size=n) * (width - w + 1)), (width - w) // 2)
+        return top, left, h, w
+
+    def __call__(self, batch, flip=None):
+        n, height, width = batch.shape[:3]
+        top, left, h, w = self.get_params(n, height, width)
+        return batch_crop_and_resize(batch, top, left, h, w, self.size, flip)
+
+
+class BatchRandomHorizontalFlip:
+    """
+    Random flip each image of batch horizontally with a probability p,
+    batch version of RandomHorizontalFlip.
+
+    Args::
+
+        [in] p(float): The probability of image flip, default: 0.5.
+    """
+    def __init__(self, p=0.5):
+        self.p = p
+
+    def get_params(self, n):
+        ''' Return bool mask of images to be flipped. '''
+        return np.random.uniform(size=n) < self.p
+
+    def __call__(self, batch):
+        flip = self.get_params(len(batch))
+        batch = batch.copy()
+        batch[flip] = batch[flip][:,:,::-1]
+        return batch
+
+
+class BatchCenterCrop:
+    """
+    Crop the center of each image of batch, batch version of CenterCrop.
+
+    Args::
+
+        [in] size(int or tuple): [height, width] of the output image.
+    """
+    def __init__(self, size):
+        self.size = _setup_size(size, error_msg="If size is a sequence, it should have 2 values")
+
+    def __call__(self, batch):
+        h, w = batch.shape[1:3]
+        oh, ow = self.size
+        top = int(round((h - oh) / 2.))
+        left = int(round((w - ow) / 2.))
+        return batch[:, top:top+oh, left:left+ow]
+
+
+def _gray(batch):
+    return batch[...,0:1] * np.float32(0.299) + \
+        batch[...,1:2] * np.float32(0.587) + \
+        batch[...,2:3] * np.float32(0.114)
+
+def _rgb_to_hsv(rgb):
+    r, g, b = rgb[...,0], rgb[...,1], rgb[...,2]
+    maxc = rgb.max(-1)
+    minc = rgb.min(-1)
+    v = maxc
+    delta = maxc - minc
+    s = delta / np.maximum(maxc, 1e-8)
+    d = np.maximum(delta, 1e-8)
+    rc = (maxc - r) / d
+    gc = (maxc - g) / d
+    bc = (maxc - b) / d
+    h = np.where(maxc == r, bc - gc, np.where(maxc == g, 2.0 + rc - bc, 4.0 + gc - rc))
+    h = np.where(delta > 0, (h / 6.0) % 1.0, 0.0)
+    return h, s, v
+
+def _hsv_to_rgb(h, s, v):
+    i = np.floor(h * 6.0)
+    f = h * 6.0 - i
+    p = v * (1.0 - s)
+    q = v * (1.0 - s * f)
+    t = v * (1.0 - s * (1.0 - f))
+    i = i.astype("int32") % 6
+    r = np.choose(i, [v, q, p, p, t, v])
+    g = np.choose(i, [t, v, v, q, p, p])
+    b = np.choose(i, [p, p, t, v, v, q])
+    return np.stack([r, g, b], -1)
+
+
+class BatchColorJitter:
+    """
+    Randomly change the brightness, contrast, saturation and hue of each
+    image of batch, batch version of ColorJitter. Factors are sampled for
+    each image, the order of adjustments is shuffled for each batch.
+
+    Args::
+
+        [in] brightness, contrast, saturation, hue: same as ColorJitter.
+    """
+    def __init__(self, brightness=0, contrast=0, saturation=0, hue=0):
+        check = ColorJitter._check_input
+        self.brightness = check(brightness, 'brightness')
+        self.contrast = check(contrast, 'contrast')
+        self.saturation = check(saturation, 'saturation')
+        self.hue = check(hue, 'hue', center=0, bound=(-0.5, 0.5),
+                         clip_first_on_zero=False)
+
+    @staticmethod
+    def adjust_brightness(batch, factor):
+        return np.clip(batch * factor, 0, 255)
+
+    @staticmethod
+    def adjust_contrast(batch, factor):
+        mean = _gray(batch).mean(axis=(1,2,3), keepdims=True)
+        return np.clip((batch - mean) * factor + mean, 0, 255)
+
+    @staticmethod
+    def adjust_saturation(batch, factor):
+        gray = _gray(batch)
+        return np.clip((batch - gray) * factor + gray, 0, 255)
+
+    @staticmethod
+    def adjust_hue(batch, factor):
+        h, s, v = _rgb_to_hsv(batch / np.float32(255.))
+        h = (h + factor[...,0]) % 1.0
+        return (_hsv_to_rgb(h, s, v) * np.float32(255.)).astype("float32")
+
+    def __call__(self, batch):
+        n = len(batch)
+        batch = batch.astype("float32")
+        adjusts = []
+        for name in ["brightness", "contrast", "saturation", "hue"]:
+            value = getattr(self, name)
+            if value is not None:
+                factor = np.random.uniform(value[0], value[1],
+                    size=(n,1,1,1)).astype("float32")
+                adjusts.append((getattr(self, "adjust_"+name), factor))
+        for i in np.random.permutation(len(adjusts)):
+            adjust, factor = adjusts[i]
+            batch = adjust(batch, factor)
+        return batch
+
+
+class BatchImageNormalize:
+    '''
+    Normalize a NHWC batch with pixel values in [0, 255] and transpose it
+    to NCHW, batch version of ImageNormalize.
+
+    Args::
+
+    [in] mean(list): the mean value of Normalization.
+    [in] std(list): the std value of Normalization.
+    '''
+    def __init__(self, mean, std):
+        self.mean = np.float32(mean) * np.float32(255.)
+        self.scale = np.float32(1.) / (np.float32(std) * np.float32(255.))
+
+    def __call__(self, batch):
+        batch = batch - self.mean
+        batch *= self.scale
+        return np.ascontiguousarray(batch.transpose((0,3,1,2)))
+
+
+class BatchCompose:
+    '''
+    Combine batch transforms. If the batch is a tuple or list, e.g.
+    (images, labels), only the first field is transformed.
+    BatchRandomCropAndResize followed by BatchRandomHorizontalFlip are
+    fused into one resampling pass.
+
+    Args::
+
+    [in] transforms(list): a list of batch transform.
+    '''
+    def __init__(self, transforms):
+        self.transforms = transforms
+
+    def transform_images(self, batch):
+        ts = self.transforms
+        i = 0
+        while i < len(ts):
+            if isinstance(ts[i], BatchRandomCropAndResize) and \
+                i+1 < len(ts) and isinstance(ts[i+1], BatchRandomHorizontalFlip):
+                batch = ts[i](batch, flip=ts[i+1].get_params(len(batch)))
+                i += 2
+            else:
+                batch = ts[i](batch)
+                i += 1
+        return batch
+
+    def __call__(self, batch):
+        if isinstance(batch, (list, tuple)):
+            return type(batch)([self.transform_images(batch[0])] + list(batch[1:]))
+        return self.transform_images(batch)
@@ -0,0 +1,67 @@
+# ***************************************************************
+# Copyright (c) 2022 Jittor. All Rights Reserved.
+# Maintainers: Dun Liang <randonlang@gmail.com>.
+# This file is subject to the terms and conditions defined in
+# file 'LICENSE.txt', which is part of this source code package.
+# ***************************************************************
+# Bytes on wire vs. convergence of gradient communication hooks,
+# a small mlp is trained on a synthetic regression task.
+#
+# Usage:
+#     mpirun -np 2 python3 -m jittor.utils.bench_comm_hook
+import time
+import jittor as jt
+import numpy as np
+from jittor import nn
+
+n_iter = 200
+batch_size = 64
+
+class Model(nn.Module):
+    def __init__(self):
+        self.linear1 = nn.Linear(64, 256)
+        self.linear2 = nn.Linear(256, 256)
+        self.linear3 = nn.Linear(256, 1)
+    def execute(self, x):
+        x = nn.relu(self.linear1(x))
+        x = nn.relu(self.linear2(x))
+        return self.linear3(x)
+
+def get_batch(i):
+    np.random.seed(i * jt.world_size + jt.rank)
+    x = np.random.randn(batch_size, 64).astype("float32")
+    y = np.sin(x[:, :8].sum(1, keepdims=True))
+    return jt.array(x), jt.array(y)
+
+def train(hook):
+    jt.set_global_seed(0)
+    model = Model()
+    opt = nn.SGD(model.parameters(), 0.05, momentum=0.9)
+    opt.comm_hook = hook
+    start = time.time()
+    for i in range(n_iter):
+        x, y = get_batch(i)
+        loss = ((model(x) - y) ** 2).mean()
+        opt.step(loss)
+    loss = loss.mpi_all_reduce("mean")
+    return loss.item(), hook.sent_bytes / n_iter, time.time() - start
+
+def main():
+    assert jt.in_mpi, "please run by mpirun"
+    hooks = [
+        ("all reduce", nn.CommHook()),
+        ("fp16", nn.FP16CompressHook()),
+        ("top-k 1%", nn.TopKCompressHook(0.01)),
+        ("top-k 10%", nn.TopKCompressHook(0.1)),
+        ("power sgd rank 1", nn.PowerSGDHook(1)),
+        ("power sgd rank 4", nn.PowerSGDHook(4)),
+    ]
+    result = [ (name,) + train(hook) for name, hook in hooks ]
+    if jt.rank == 0:
+        base = result[0][2]
+        print(f"{'hook':<20}{'final loss':>12}{'bytes/step':>14}{'ratio':>10}{'time(s)':>10}")
+        for name, loss, nbytes, t in result:
+            print(f"{name:<20}{loss:>12.5f}{nbytes:>14.0f}{base/nbytes:>9.1f}x{t:>10.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+# ***************************************************************
+# Copyright (c) 2022 Jittor. All Rights Reserved.
+# Maintainers: Dun Liang <randonlang@gmail.com>.
+# This file is subject to the terms and conditions defined in
+# file 'LICENSE.txt', which is part of this source code package.
+# ***************************************************************
+# Link cached jit ops into a few kernel bundles, a warm process loads
+# jit ops from the bundles instead of opening one library per op.
+# Bundles are built in cache_path/kernel_bundle, and used by jittor
+# if flag use_kernel_bundle is set(default). Run it again after new
+# ops are compiled, outdated kernels are not loaded from bundles.
+#
+# Usage:
+#     python3 -m jittor.utils.kernel_bundle [max kernels of a bundle]
+import os
+import sys
+import glob
+import hashlib
+import numpy as np
+import jittor as jt
+import jittor_utils as jit_utils
+from jittor_utils import LOG
+from jittor.compiler import shsplit
+
+def hash64(s):
+    ''' The same as hash64 of misc/hash.h, chars are signed. '''
+    a = np.frombuffer(s, dtype="int8").astype("int64").astype("uint64")
+    pows = np.full(len(a), 257, "uint64")
+    pows[0] = 1
+    pows = np.cumprod(pows, dtype="uint64")
+    return int((a * pows).sum(dtype="uint64"))
+
+def _parse_key(key_file):
+    ''' Return compile command and inputs of a cached jit op. '''
+    with open(key_file) as f:
+        lines = f.read().splitlines()
+    inputs = [ l[2:l.rfind(": ")] for l in lines[1:] if l.startswith("# ") ]
+    return lines[0], inputs
+
+def _split_cmd(cmd, obj_path, jit_run):
+    ''' Split compile command of a jit op into the command compiling
+    an object with renamed jit_run, and flags of linking. '''
+    i = cmd.find("asm_tuner.py --cc_path=")
+    if i >= 0:
+        # assembly of ops is tuned only if they have @begin directives
+        cmd = cmd[i+len("asm_tuner.py --cc_path="):]
+    elif not cmd.startswith(f'"{jt.flags.cc_path}"'):
+        return None
+    compile_flags, link_flags = [], []
+    flags = shsplit(cmd)
+    i = 0
+    while i < len(flags):
+        f = flags[i]
+        if f == "-o":
+            i += 2
+            continue
+        if f.startswith("-l") or f.startswith("-L") or f.startswith("-Wl,"):
+            link_flags.append(f)
+        elif f == "-fopenmp":
+            compile_flags.append(f)
+            link_flags.append(f)
+        elif f and f != "-shared":
+            compile_flags.append(f)
+        i += 1
+    compile_cmd = " ".join(compile_flags) + f" -c -Djit_run={jit_run} -o \"{obj_path}\""
+    return compile_cmd, link_flags
+
+def build_kernel_bundle(max_kernels=512, names=None):
+    ''' Build kernel bundles of cached jit ops, return number of
+    bundled kernels.
+
+    Args:
+        max_kernels (int): max number of kernels of a bundle.
+        names (list): only bundle kernels of these library names in
+            cache_path/jit, default bundles all cached kernels.
+
+    Kernels are compiled again into objects with jit_run renamed as
+    jit_run_<hash>, where hash is hash64 of the compile command and
+    source of the kernel, and linked into bundles of at most
+    max_kernels kernels. Objects are cached, so only new kernels are
+    compiled when bundles are built again. The index lists headers of
+    kernels with their size and mtime, bundles are not used if any
+    header is changed.
+    '''
+    cache_path = jt.flags.cache_path
+    jit_dir = os.path.join(cache_path, "jit")
+    bundle_dir = os.path.join(cache_path, "kernel_bundle")
+    obj_dir = os.path.join(bundle_dir, "obj")
+    if os.name == 'nt':
+        LOG.w("Kernel bundle is not supported on windows.")
+        return 0
+    os.makedirs(obj_dir, exist_ok=True)
+    kernels = []
+    deps = set()
+    for key_file in sorted(glob.glob(os.path.join(jit_dir, "*.so.key"))):
+        lib = key_file[:-len(".key")]
+        name = os.path.basename(lib)
+        if names is not None and name not in names:
+            continue
+        src_file = lib[:-len(".so")] + ".cc"
+        if not os.path.isfile(lib) or not os.path.isfile(src_file):
+            continue
+        cmd, inputs = _parse_key(key_file)
+        with open(src_file, "rb") as f:
+            src = f.read()
+        if b"@begin" in src or "GLOBAL_VAR" in cmd:
+            continue
+        h = "%x" % hash64(cmd.encode() + b"\n" + src)
+        obj = os.path.join(obj_dir, name[:-len(".so")] + ".o")
+        split = _split_cmd(cmd, obj, "jit_run_" + h)
+        if split is None:
+            continue
+        kernels.append((name, h, obj) + split)
+        deps.update(f for f in inputs if not f.startswith(jit_dir))
+    if not kernels:
+        return 0
+    jit_utils.run_cmds([ k[3] for k in kernels ], cache_path,
+        jt.flags.jittor_path, "Compiling kernel bundle")
+
+    # link kernels into bundles
+    bundles, link_cmds = [], []
+    for i in range(0, len(kernels), max_kernels):
+        part = kernels[i:i+max_kernels]
+        link_flags = []
+        for k in part:
+            for f in k[4]:
+                if f not in link_flags:
+                    link_flags.append(f)
+        digest = hashlib.md5("".join(k[1] for k in part).encode()).hexdigest()
+        bundle = f"bundle_{digest[:16]}.so"
+        objs = " ".join(f'"{k[2]}"' for k in part)
+        link_cmds.append(f'"{jt.flags.cc_path}" {objs} -shared -fPIC '
+            + " ".join(link_flags) + f' -o "{os.path.join(bundle_dir, bundle)}"')
+        bundles.append((bundle, part))
+    jit_utils.run_cmds(link_cmds, cache_path, jt.flags.jittor_path, "Linking kernel bundle")
+
+    lines = ["# deps"]
+    for dep in sorted(deps):
+        if not os.path.isfile(dep):
+            continue
+        st = os.stat(dep)
+        lines.append(f"{dep}\t{st.st_size}\t{st.st_mtime_ns}")
+    lines.append("# kernels")
+    for bundle, part in bundles:
+        for name, h, *_ in part:
+            lines.append(f"{name}\t{bundle}\t{h}")
+    index = os.path.join(bundle_dir, "index")
+    with open(index + ".tmp", "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(index + ".tmp", index)
+    # remove bundles not in index, processes which opened them
+    # still keep their mapping
+    used = set(b for b, _ in bundles)
+    for fname in glob.glob(os.path.join(bundle_dir, "bundle_*.so*")):
+        if os.path.basename(fname).split(".so")[0] + ".so" not in used:
+            os.remove(fname)
+    LOG.i(f"{len(kernels)} kernels are linked into {len(bundles)} bundles: {bundle_dir}")
+    return len(kernels)
+
+if __name__ == "__main__":
+    build_kernel_bundle(*[ int(a) for a in sys.argv[1:2] ])
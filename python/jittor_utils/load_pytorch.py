@@ -2,13 +2,19 @@ import pickle
 import os
 import io
 import shutil
-from zipfile import ZipFile
+import mmap
+import struct
+from zipfile import ZipFile, ZIP_STORED
 import jittor as jt
 import numpy as np
 from typing import Any, BinaryIO, cast, Dict, Optional, Type, Tuple, Union, IO, List
 
 loaded_storages = {}
 deserialized_objects = {}
+use_mmap = False
+rebuild_numpy = False
+archive_prefix = "archive/"
+stop_grad_ids = set()
 def _is_zipfile(fn):
     f = open(fn, "rb")
     read_bytes = []
@@ -34,6 +40,29 @@ def load_tensor(contents, dtype, numel, key, location):
     name = os.path.join("archive", "data", str(key))
     loaded_storages[key] = np.frombuffer(contents[name], dtype).copy()
 
+def mmap_zip(fn_name):
+    ''' Returns the mmap of a zip file and the dict of its member names
+    and zero-copy views of their data, members must be stored without
+    compression, as pytorch does. '''
+    with open(fn_name, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    contents = {}
+    with ZipFile(fn_name) as z:
+        infos = z.infolist()
+    for info in infos:
+        if info.compress_type != ZIP_STORED:
+            return None, None
+        # size of names and extra fields of the local file header
+        lo = info.header_offset
+        n, m = struct.unpack("<HH", mm[lo+26:lo+30])
+        start = lo + 30 + n + m
+        contents[info.filename] = memoryview(mm)[start:start+info.file_size]
+    return mm, contents
+
+def load_tensor_mmap(contents, dtype, numel, key, location):
+    name = archive_prefix + "data/" + str(key)
+    loaded_storages[key] = np.frombuffer(contents[name], dtype)
+
 def get_dtype_size(dtype):
     dtype = dtype.__str__()
     if dtype == "float32" or dtype == "int32":
@@ -55,17 +84,21 @@ def persistent_load(saved_id):
     dtype = storage_type.dtype
     if key not in loaded_storages:
         nbytes = numel
-        load_tensor(contents, dtype, nbytes, key, _maybe_decode_ascii(location))
+        load = load_tensor_mmap if use_mmap else load_tensor
+        load(contents, dtype, nbytes, key, _maybe_decode_ascii(location))
     return loaded_storages[key]
 
 def _dtype_to_storage_type_map():
     return {
         np.float16: 'HalfStorage',
         np.float32: 'FloatStorage',
+        np.float64: 'DoubleStorage',
         np.int64: 'LongStorage',
         np.int32: 'IntStorage',
         np.int16: 'ShortStorage',
-        np.int8: 'CharStorage'
+        np.int8: 'CharStorage',
+        np.uint8: 'ByteStorage',
+        np.bool_: 'BoolStorage'
     }
 
 def _storage_type_to_dtype_map():
@@ -88,12 +121,19 @@ class StorageType():
         return f'StorageType(dtype={self.dtype})'
 
 def jittor_rebuild(storage, storage_offset, size, stride, requires_grad, backward_hooks):
-    if len(size) == 0:
-        return jt.array(storage)
-    record_size = np.prod(size)
-    return jt.array(storage[:record_size]).reshape(size)
+    # zero-copy view of the storage
+    itemsize = storage.dtype.itemsize
+    view = np.lib.stride_tricks.as_strided(storage[storage_offset:],
+        tuple(size), tuple(s*itemsize for s in stride), writeable=False)
+    if rebuild_numpy:
+        return view
+    return jt.array(view)
 
 def jittor_rebuild_var(data, requires_grad, backward_hooks):
+    if rebuild_numpy:
+        if not requires_grad:
+            stop_grad_ids.add(id(data))
+        return data
     v = jt.array(data)
     v.requires_grad = requires_grad
     return v
@@ -207,10 +247,43 @@ def persistent_load_direct(saved_id):
     else:
         raise RuntimeError("Unknown saved id type: %s" % saved_id[0])
 
-def load_pytorch(fn_name):
-    global contents, deserialized_objects, loaded_storages
+def _to_var(x):
+    if isinstance(x, list):
+        return [ _to_var(v) for v in x ]
+    if isinstance(x, tuple):
+        return tuple( _to_var(v) for v in x )
+    if isinstance(x, dict):
+        return type(x)((k, _to_var(v)) for k, v in x.items())
+    if isinstance(x, np.ndarray):
+        v = jt.array(x)
+        if id(x) in stop_grad_ids:
+            v.requires_grad = False
+        return v
+    return x
+
+def load_pytorch(fn_name, module=None, to_numpy=False):
+    ''' Loads a pytorch .pth file.
+
+    Zip members of the file are memory mapped, and tensors are built as
+    zero-copy numpy views of the mapped storages, data is read from disk
+    when tensors are copied into jittor.
+
+    Args:
+        fn_name (str): path of the .pth file.
+        module (Module): if set, tensors are loaded into parameters of the
+            module one by one, peak memory stays near one model's size.
+        to_numpy (bool): return the numpy views instead of jittor Vars.
+
+    Example::
+
+        state = load_pytorch("resnet50.pth")
+        load_pytorch("resnet50.pth", module=model)
+    '''
+    global contents, deserialized_objects, loaded_storages, use_mmap, \
+        rebuild_numpy, archive_prefix, stop_grad_ids
     loaded_storages = {}
     deserialized_objects = {}
+    stop_grad_ids = set()
     if not fn_name.endswith(".pth"):
         print("This function is designed to load pytorch pth format files.")
         return None
@@ -218,12 +291,26 @@ def load_pytorch(fn_name):
         if _is_zipfile(fn_name):
             loaded_storages = {}
             deserialized_objects = {}
-            contents = extract_zip(fn_name)
-            data_file = io.BytesIO(contents['archive/data.pkl'])
+            mm, contents = mmap_zip(fn_name)
+            # fall back to extraction if members are compressed
+            use_mmap = contents is not None
+            if not use_mmap:
+                contents = extract_zip(fn_name)
+            name = [ n for n in contents if n.endswith("data.pkl") ][0]
+            archive_prefix = name[:-len("data.pkl")]
+            data_file = io.BytesIO(contents[name])
             pickle_load_args = {'encoding': 'utf-8'}
             unpickler = UnpicklerWrapper(data_file,  **pickle_load_args)
             unpickler.persistent_load = persistent_load
-            result = unpickler.load()
+            rebuild_numpy = True
+            try:
+                result = unpickler.load()
+            finally:
+                use_mmap = rebuild_numpy = False
+                contents = loaded_storages = None
+            if module is None and not to_numpy:
+                result = _to_var(result)
+            stop_grad_ids = set()
         else:
             deserialized_objects = {}
             f = open(fn_name, "rb")
@@ -268,6 +355,8 @@ def load_pytorch(fn_name):
                         result[key] = result[key].reshape(shape)
                 if requires_grad is not None:
                     result[key].requires_grad = requires_grad
+        if module is not None:
+            module.load_parameters(result)
         return result
 
 if __name__ == "__main__":